@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Benchmarks the mycontroller.py code paths against fake_p4runtime.py.
+
+Measured:
+  - startup:      switch connection + provision() until the switch is ready
+  - install:      writeTableRules() throughput at 100, 1k and 10k entries,
+                  and the same entries sent from a runtime_bundle.py bundle
+  - digest_rtt:   hyperperiod digest sent by the switch until handle_stream()
+                  has written last_hyperperiod_reg back
+  - counter_poll: one poll of POLLED_COUNTERS (one read per stream and counter)
+
+Results are written as JSON so runs can be compared between commits:
+    ./bench_controller.py --output before.json
+    ./bench_controller.py --output after.json --compare before.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import mycontroller
+import p4runtime_lib.helper
+from fake_p4runtime import HYPERPERIOD_DIGEST, FakeP4RuntimeServer
+from runtime_bundle import compile_bundle, open_bundle
+
+IPV4_TABLE = "IngressImpl.ipv4_c.ipv4"
+LAST_HYPERPERIOD_REG = "IngressImpl.psfp_c.last_hyperperiod_reg"
+
+
+@contextlib.contextmanager
+def quiet(verbose):
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
+        yield
+
+
+def summarize(samples, unit):
+    samples = sorted(samples)
+    n = len(samples)
+    return {
+        "unit": unit,
+        "n": n,
+        "min": samples[0],
+        "median": statistics.median(samples),
+        "p90": samples[min(n - 1, int(n * 0.9))],
+        "p99": samples[min(n - 1, int(n * 0.99))],
+        "max": samples[-1],
+        "mean": statistics.fmean(samples)
+    }
+
+
+def synthetic_routes(count):
+    """
+    IPv4 /32 routes in s1-runtime.json format, all distinct.
+    """
+    return [{
+        "table": IPV4_TABLE,
+        "match": {"hdr.ipv4.dstAddr": [f"10.{100 + (i >> 16)}.{(i >> 8) & 0xff}.{i & 0xff}", 32]},
+        "action_name": "IngressImpl.ipv4_c.ipv4_forward",
+        "action_params": {"eth_dst_addr": "08:00:00:00:02:22", "port": 2}
+    } for i in range(count)]
+
+
+class Bench:
+    """
+    Runs each benchmark against a fresh fake switch.
+
+    :param args: parsed command line arguments
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.p4info_helper = p4runtime_lib.helper.P4InfoHelper(args.p4info)
+        # Make room for the scaled-up workloads in the pipeline we push
+        max_entries = max(args.install_sizes)
+        max_streams = max(args.stream_counts)
+        for table in self.p4info_helper.p4info.tables:
+            if table.preamble.name == IPV4_TABLE:
+                table.size = max(table.size, max_entries + 16)
+        for counter in self.p4info_helper.p4info.counters:
+            counter.size = max(counter.size, max_streams)
+
+    @contextlib.contextmanager
+    def switch(self, provision=False):
+        server = FakeP4RuntimeServer(self.args.p4info, "127.0.0.1:0",
+                                     latency=self.args.latency_ms / 1000).start()
+        sw = mycontroller.ControllerConnection(
+            name='s1', address=server.address, device_id=0, proto_dump_file=self.args.proto_dump)
+        try:
+            with quiet(self.args.verbose):
+                if provision:
+                    mycontroller.provision(self.p4info_helper, sw, self.args.bmv2_json)
+                else:
+                    sw.MasterArbitrationUpdate()
+                    sw.SetForwardingPipelineConfig(p4info=self.p4info_helper.p4info,
+                                                   bmv2_json_file_path=self.args.bmv2_json)
+            yield server, sw
+        finally:
+            sw.shutdown()
+            server.stop(0)
+
+    def startup(self):
+        samples = []
+        for _ in range(self.args.repeat):
+            server = FakeP4RuntimeServer(self.args.p4info, "127.0.0.1:0",
+                                         latency=self.args.latency_ms / 1000).start()
+            start = time.perf_counter()
+            sw = mycontroller.ControllerConnection(
+                name='s1', address=server.address, device_id=0, proto_dump_file=self.args.proto_dump)
+            with quiet(self.args.verbose):
+                mycontroller.provision(self.p4info_helper, sw, self.args.bmv2_json)
+            samples.append(time.perf_counter() - start)
+            sw.shutdown()
+            server.stop(0)
+        return summarize(samples, "s")
+
+    def install(self):
+        results = {}
+        for size in self.args.install_sizes:
+            entries = synthetic_routes(size)
+            with self.switch() as (server, sw):
+                start = time.perf_counter()
+                with quiet(self.args.verbose):
+                    mycontroller.writeTableRules(self.p4info_helper, sw, entries)
+                elapsed = time.perf_counter() - start
+                results[str(size)] = {
+                    "seconds": elapsed,
+                    "entries_per_s": size / elapsed,
+                    "installed": server.stats["updates"]
+                }
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, "routes.bundle")
+                start = time.perf_counter()
+                compile_bundle(self.p4info_helper, entries, path)
+                results[str(size)]["compile_seconds"] = time.perf_counter() - start
+                with self.switch() as (server, sw):
+                    start = time.perf_counter()
+                    bundle, _ = open_bundle(path, self.p4info_helper.p4info, entries)
+                    bundle.send(sw)
+                    bundle.close()
+                    elapsed = time.perf_counter() - start
+                    results[str(size)].update({
+                        "bundle_seconds": elapsed,
+                        "bundle_entries_per_s": size / elapsed,
+                        "bundle_installed": server.stats["updates"]
+                    })
+        return results
+
+    def digest_rtt(self):
+        reg_id = self.p4info_helper.get_registers_id(LAST_HYPERPERIOD_REG)
+        written = threading.Event()
+
+        def on_write(update):
+            if update.entity.register_entry.register_id == reg_id:
+                written.set()
+
+        samples = []
+        timeouts = 0
+        with self.switch(provision=True) as (server, sw):
+            server.write_listeners.append(on_write)
+            with quiet(self.args.verbose):
+                thread = threading.Thread(target=mycontroller.handle_stream, args=(sw, self.p4info_helper))
+                thread.daemon = True
+                thread.start()
+                for i in range(self.args.digests):
+                    written.clear()
+                    start = time.perf_counter()
+                    server.send_digest(HYPERPERIOD_DIGEST, [server.hyperperiod_digest(1 + i % 4)])
+                    if written.wait(5):
+                        samples.append((time.perf_counter() - start) * 1000)
+                    else:
+                        timeouts += 1
+                # Ends the stream thread while its output is still discarded,
+                # so it does not end up in the JSON report
+                sw.shutdown()
+                thread.join(5)
+        result = summarize(samples, "ms") if samples else {"unit": "ms", "n": 0}
+        result["timeouts"] = timeouts
+        return result
+
+    def counter_poll(self):
+        results = {}
+        with self.switch(provision=True) as (server, sw):
+            for streams in self.args.stream_counts:
+                samples = []
+                for _ in range(self.args.repeat):
+                    start = time.perf_counter()
+                    with quiet(self.args.verbose):
+                        for counter_name in mycontroller.POLLED_COUNTERS:
+                            for index in range(streams):
+                                mycontroller.printCounter(self.p4info_helper, sw, counter_name, index)
+                    samples.append((time.perf_counter() - start) * 1000)
+                result = summarize(samples, "ms")
+                result["per_stream_ms"] = result["median"] / streams
+                results[str(streams)] = result
+        return results
+
+
+BENCHMARKS = ("startup", "install", "digest_rtt", "counter_poll")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(current, baseline):
+    now = flatten(current["results"])
+    before = flatten(baseline["results"])
+    print(f"\n----- {baseline.get('commit')} -> {current.get('commit')} -----")
+    for name in sorted(now):
+        if name in before and before[name]:
+            print(f"{name:45s} {before[name]:14.4f} {now[name]:14.4f}  x{now[name] / before[name]:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the sdn-psfp controller')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/sdn-psfp.p4.p4info.txtpb')
+    parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/sdn-psfp.json')
+    parser.add_argument('--only', help='Run only these benchmarks', nargs='+',
+                        choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--repeat', help='Repetitions for startup and counter polls',
+                        type=int, action="store", required=False, default=5)
+    parser.add_argument('--install-sizes', help='Table sizes for the install benchmark', nargs='+',
+                        type=int, default=[100, 1000, 10000])
+    parser.add_argument('--digests', help='Digests sent for the round trip benchmark',
+                        type=int, action="store", required=False, default=200)
+    parser.add_argument('--stream-counts', help='Stream counts for the counter poll benchmark', nargs='+',
+                        type=int, default=[5, 50, 500])
+    parser.add_argument('--latency-ms', help='Latency added by the fake switch to every RPC',
+                        type=float, action="store", required=False, default=0.0)
+    parser.add_argument('--proto-dump', help='P4Runtime request log (default: none)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--output', help='Write the results to this JSON file',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--compare', help='Baseline JSON results to compare with',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--verbose', help='Keep the controller output', action="store_true")
+    args = parser.parse_args()
+
+    bench = Bench(args)
+    report = {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "latency_ms": args.latency_ms,
+        "results": {}
+    }
+    for name in args.only:
+        print(f"Running {name}...", file=sys.stderr)
+        report["results"][name] = getattr(bench, name)()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
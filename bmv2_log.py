@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Streaming parser and columnar index of the BMv2 debug log (logs/s1.log).
+
+The log is read in large binary chunks and only the per-packet lines
+("[<packet id>.<copy id>] [cxt N] ...") are kept, as events of the packet
+they belong to:
+  - packet received on a port, pipeline/parser/deparser start and end
+  - table applied, hit (entry handle) or miss, action run (first action
+    parameter, e.g. the stream handle of assign_stream_handle)
+  - register read and write (index, value), counter update (index)
+  - egress port, frame transmitted (port, size)
+  - frame dropped at the end of ingress or egress (mark_to_drop)
+
+The index stores the events as NumPy columns sorted by packet, plus one row
+per packet (received port and time, egress port, transmitted size, stream
+handle), and is cached next to the log (s1.log.idx.npz), so the queries
+below only load arrays:
+
+    ./bmv2_log.py index logs/s1.log
+    ./bmv2_log.py hits logs/s1.log --table stream_gate_instance
+    ./bmv2_log.py drops logs/s1.log --stream 3
+    ./bmv2_log.py trace logs/s1.log --packet 42
+
+Timestamps are the log's wall clock in ms (since the midnight before the
+first line).
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+DEFAULT_CHUNK_SIZE = 16 << 20
+INDEX_SUFFIX = ".idx.npz"
+DROP_PORT = 511
+
+# Event kinds
+EV_RECEIVED = 0
+EV_START = 1
+EV_END = 2
+EV_APPLY = 3
+EV_HIT = 4
+EV_MISS = 5
+EV_ACTION = 6
+EV_READ = 7
+EV_WRITE = 8
+EV_COUNTER = 9
+EV_EGRESS = 10
+EV_TRANSMIT = 11
+EV_DROP = 12
+EVENT_NAMES = ("received", "start", "end", "apply", "hit", "miss", "action", "read", "write", "counter",
+               "egress", "transmit", "drop")
+
+STREAM_HANDLE_ACTION = "IngressImpl.psfp_c.streamFilter_c.assign_stream_handle"
+
+# Counters telling why FlowMeter/StreamGate/StreamFilter dropped a frame
+DROP_COUNTERS = {
+    "IngressImpl.psfp_c.streamFilter_c.missed_max_sdu_filter_counter": "frame larger than the stream's max SDU",
+    "IngressImpl.psfp_c.streamGate_c.not_passed_gate_counter": "stream gate permanently closed",
+    "IngressImpl.psfp_c.streamGate_c.missed_interval_counter": "gate interval closed",
+    "IngressImpl.psfp_c.flowMeter_c.marked_red_counter": "flow meter marked red",
+}
+
+# Only the messages parse_message() handles, so the other lines (primitives,
+# conditions, key dumps) are skipped by the regex engine
+LINE = re.compile(rb"^\[(\d\d):(\d\d):(\d\d)\.(\d{3})\] \[bmv2\] \[\w\] \[thread \d+\] \[(\d+)\.(\d+)\] "
+                  rb"\[cxt \d+\] ((?:Appl|Table|Action entry|Read r|Wrote|Updated c|Pipeline|Parser '|Deparser '|"
+                  rb"Egress|Transm|Processing|Dropping)[^\n]*)", re.M)
+RECEIVED = re.compile(rb"Processing packet received on port (\d+)")
+STAGE = re.compile(rb"(Pipeline|Parser|Deparser) '([^']+)': (start|end)$")
+APPLY = re.compile(rb"Applying table '([^']+)'")
+LOOKUP = re.compile(rb"Table '([^']+)': (?:hit with handle (\d+)|miss)")
+ACTION = re.compile(rb"Action entry is (\S+) - ([0-9a-fA-F]*)")
+REGISTER = re.compile(rb"(Read|Wrote) register '([^']+)' at index (\d+) (?:read value|with value) (\d+)")
+COUNTER = re.compile(rb"Updated counter '([^']+)' at index (\d+)")
+EGRESS = re.compile(rb"Egress port is (\d+)")
+TRANSMIT = re.compile(rb"Transmitting packet of size (\d+) out of port (\d+)")
+# No "Egress port is" line precedes it: the drop event sets the drop port
+DROP = re.compile(rb"Dropping packet at the end of (\w+)")
+
+
+class Names:
+    """
+    String table of the table, action, register and counter names.
+    """
+
+    def __init__(self, names=()):
+        self.names = list(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+
+    def id(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def find(self, pattern):
+        """
+        IDs of the names equal to pattern or ending with "." + pattern.
+        """
+        return [i for i, name in enumerate(self.names) if name == pattern or name.endswith("." + pattern)]
+
+
+def read_lines(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Iterates over the packet lines of a BMv2 log.
+
+    :return: generator of (ms of day, packet id, copy id, message bytes)
+    """
+    with open(path, "rb") as f:
+        tail = b""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buf = tail + chunk
+            end = buf.rfind(b"\n") + 1
+            tail = buf[end:]
+            for m in LINE.finditer(buf, 0, end):
+                hours, minutes, seconds, ms, packet, copy, message = m.groups()
+                yield ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(ms), \
+                    int(packet), int(copy), message
+        if tail:
+            for m in LINE.finditer(tail):
+                hours, minutes, seconds, ms, packet, copy, message = m.groups()
+                yield ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(ms), \
+                    int(packet), int(copy), message
+
+
+def parse_message(message, names):
+    """
+    Event of a packet line.
+
+    :return: (kind, name id, arg, value), or None for lines not indexed
+    """
+    first = message[:4]
+    if first == b"Appl":
+        m = APPLY.match(message)
+        return EV_APPLY, names.id(m.group(1).decode()), -1, -1
+    if first == b"Tabl":
+        m = LOOKUP.match(message)
+        if m:
+            handle = m.group(2)
+            return (EV_HIT, names.id(m.group(1).decode()), int(handle), -1) if handle is not None \
+                else (EV_MISS, names.id(m.group(1).decode()), -1, -1)
+    elif first == b"Acti":
+        m = ACTION.match(message)
+        if m:
+            return EV_ACTION, names.id(m.group(1).decode()), int(m.group(2), 16) if m.group(2) else -1, -1
+    elif first in (b"Read", b"Wrot"):
+        m = REGISTER.match(message)
+        if m:
+            return (EV_READ if m.group(1) == b"Read" else EV_WRITE, names.id(m.group(2).decode()),
+                    int(m.group(3)), int(m.group(4)))
+    elif first == b"Upda":
+        m = COUNTER.match(message)
+        if m:
+            return EV_COUNTER, names.id(m.group(1).decode()), int(m.group(2)), -1
+    elif first in (b"Pipe", b"Pars", b"Depa"):
+        m = STAGE.match(message)
+        if m:
+            kind = EV_START if m.group(3) == b"start" else EV_END
+            return kind, names.id(f"{m.group(1).decode().lower()}:{m.group(2).decode()}"), -1, -1
+    elif first == b"Egre":
+        m = EGRESS.match(message)
+        return EV_EGRESS, -1, int(m.group(1)), -1
+    elif first == b"Tran":
+        m = TRANSMIT.match(message)
+        if m:
+            return EV_TRANSMIT, -1, int(m.group(2)), int(m.group(1))
+    elif first == b"Proc":
+        m = RECEIVED.match(message)
+        if m:
+            return EV_RECEIVED, -1, int(m.group(1)), -1
+    elif first == b"Drop":
+        m = DROP.match(message)
+        if m:
+            return EV_DROP, names.id(m.group(1).decode()), DROP_PORT, -1
+    return None
+
+
+class LogIndex:
+    """
+    Columnar index of a BMv2 log.
+
+    Event columns (sorted by packet, then log order): packet (row in the
+    packet columns), ts (ms), kind (EV_*), name (Names id or -1), arg, value.
+    Packet columns: packet_id, copy_id, ts_in, port_in, egress_port,
+    tx_port, tx_size (-1 when not seen), stream (stream handle or -1),
+    first (first event row) and count (number of events).
+    """
+
+    EVENT_COLUMNS = ("packet", "ts", "kind", "name", "arg", "value")
+    PACKET_COLUMNS = ("packet_id", "copy_id", "ts_in", "port_in", "egress_port", "tx_port", "tx_size", "stream",
+                      "first", "count")
+
+    def __init__(self, events, packets, names):
+        self.events = events
+        self.packets = packets
+        self.names = names
+
+    @classmethod
+    def build(cls, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Parses a log in one streaming pass.
+        """
+        names = Names()
+        stream_action = names.id(STREAM_HANDLE_ACTION)
+        rows = {}
+        packet_rows = []
+        columns = {name: [] for name in cls.EVENT_COLUMNS}
+        ev_packet, ev_ts, ev_kind, ev_name, ev_arg, ev_value = (columns[c] for c in cls.EVENT_COLUMNS)
+        day_ms = 24 * 3600 * 1000
+        offset = 0
+        last_ts = None
+        for ts, packet, copy, message in read_lines(path, chunk_size):
+            event = parse_message(message, names)
+            if event is None:
+                continue
+            ts += offset
+            if last_ts is not None and ts < last_ts - day_ms // 2:
+                # Midnight rollover
+                offset += day_ms
+                ts += day_ms
+            last_ts = ts
+            kind, name, arg, value = event
+            row = rows.get((packet, copy))
+            if row is None:
+                row = rows[(packet, copy)] = len(packet_rows)
+                packet_rows.append([packet, copy, ts, -1, -1, -1, -1, -1])
+            info = packet_rows[row]
+            if kind == EV_RECEIVED:
+                info[2] = ts
+                info[3] = arg
+            elif kind in (EV_EGRESS, EV_DROP):
+                info[4] = arg
+            elif kind == EV_TRANSMIT:
+                info[5] = arg
+                info[6] = value
+            elif kind == EV_ACTION and name == stream_action:
+                info[7] = arg
+            ev_packet.append(row)
+            ev_ts.append(ts)
+            ev_kind.append(kind)
+            ev_name.append(name)
+            ev_arg.append(arg)
+            ev_value.append(value)
+
+        dtypes = {"packet": np.int32, "ts": np.int64, "kind": np.int8, "name": np.int32, "arg": np.int64,
+                  "value": np.int64}
+        events = {c: np.array(columns[c], dtype=dtypes[c]) for c in cls.EVENT_COLUMNS}
+        order = np.argsort(events["packet"], kind="stable")
+        events = {c: a[order] for c, a in events.items()}
+        table = np.array(packet_rows, dtype=np.int64).reshape(-1, 8)
+        packets = {c: table[:, i].copy() for i, c in enumerate(cls.PACKET_COLUMNS[:8])}
+        counts = np.bincount(events["packet"], minlength=len(table)).astype(np.int64)
+        packets["count"] = counts
+        packets["first"] = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+        return cls(events, packets, names)
+
+    def save(self, path, source):
+        """
+        Writes the index, tagged with the size and mtime of the source log.
+        """
+        stat = os.stat(source)
+        arrays = {f"ev_{c}": a for c, a in self.events.items()}
+        arrays.update({f"pkt_{c}": a for c, a in self.packets.items()})
+        with open(path, "wb") as f:
+            np.savez(f, names=np.array(self.names.names, dtype=str),
+                     source=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64), **arrays)
+
+    @classmethod
+    def load(cls, path, source=None):
+        """
+        Reads an index; None if it is missing or older than the source log.
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if source is not None:
+                stat = os.stat(source)
+                if data["source"].tolist() != [stat.st_size, stat.st_mtime_ns]:
+                    return None
+            events = {c: data[f"ev_{c}"] for c in cls.EVENT_COLUMNS}
+            packets = {c: data[f"pkt_{c}"] for c in cls.PACKET_COLUMNS}
+            names = Names(data["names"].tolist())
+        return cls(events, packets, names)
+
+    def packet_events(self, row):
+        """
+        Event columns of one packet row.
+        """
+        first = self.packets["first"][row]
+        end = first + self.packets["count"][row]
+        return {c: a[first:end] for c, a in self.events.items()}
+
+    def find_packet(self, packet_id, copy_id=0):
+        rows = np.nonzero((self.packets["packet_id"] == packet_id) & (self.packets["copy_id"] == copy_id))[0]
+        return int(rows[0]) if len(rows) else None
+
+    def hits(self, table):
+        """
+        Hit and miss counts of the tables matching a name.
+
+        :return: {table name: {"miss": n, handle: n, ...}}
+        """
+        result = {}
+        for name in self.names.find(table):
+            mask = self.events["name"] == name
+            kinds = self.events["kind"][mask]
+            handles, counts = np.unique(self.events["arg"][mask][kinds == EV_HIT], return_counts=True)
+            stats = {"miss": int((kinds == EV_MISS).sum())}
+            stats.update({int(h): int(c) for h, c in zip(handles, counts)})
+            if len(kinds):
+                result[self.names.names[name]] = stats
+        return result
+
+    def dropped(self, stream=None):
+        """
+        Rows of the packets not transmitted (or sent to the drop port).
+        """
+        mask = (self.packets["tx_size"] < 0) | (self.packets["egress_port"] == DROP_PORT)
+        if stream is not None:
+            mask &= self.packets["stream"] == stream
+        return np.nonzero(mask)[0]
+
+    def drop_reason(self, row):
+        """
+        Best explanation of why a packet was dropped, from its events.
+        """
+        events = self.packet_events(row)
+        names = self.names.names
+        for kind, name, arg, value in zip(*(events[c].tolist() for c in ("kind", "name", "arg", "value"))):
+            if kind == EV_COUNTER and names[name] in DROP_COUNTERS:
+                return f"{DROP_COUNTERS[names[name]]} ({names[name].rsplit('.', 1)[-1]}[{arg}])"
+            if kind == EV_READ and value == 1 and names[name].endswith("reg_filter_blocked"):
+                return f"stream blocked after an oversize frame (reg_filter_blocked[{arg}] = 1)"
+        for kind, name in zip(events["kind"].tolist(), events["name"].tolist()):
+            if kind == EV_MISS and names[name].endswith(".stream_id"):
+                return "no stream_id entry (not a configured stream)"
+            if kind == EV_MISS and names[name].endswith(".ipv4"):
+                return "no IPv4 route"
+        for kind, name in zip(events["kind"].tolist(), events["name"].tolist()):
+            if kind == EV_DROP:
+                return f"marked to drop in {names[name]}"
+        if self.packets["egress_port"][row] == DROP_PORT:
+            return "egress port set to the drop port"
+        if self.packets["egress_port"][row] < 0:
+            return "trace incomplete (end of log)"
+        return "not transmitted"
+
+    def format_event(self, ts, kind, name, arg, value):
+        label = self.names.names[name] if name >= 0 else ""
+        text = f"{ts / 1000:12.3f}  {EVENT_NAMES[kind]:8s} {label}"
+        if kind == EV_HIT:
+            text += f" handle {arg}"
+        elif kind == EV_ACTION and arg >= 0:
+            text += f" (first param {arg})"
+        elif kind in (EV_READ, EV_WRITE):
+            text += f"[{arg}] = {value}"
+        elif kind == EV_COUNTER:
+            text += f"[{arg}]"
+        elif kind in (EV_RECEIVED, EV_EGRESS):
+            text += f"port {arg}"
+        elif kind == EV_DROP:
+            text += f" (port {arg})"
+        elif kind == EV_TRANSMIT:
+            text += f"port {arg}, {value} bytes"
+        return text
+
+
+def open_index(path, rebuild=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Loads the cached index of a log, building it if missing or stale.
+    """
+    index_path = path + INDEX_SUFFIX
+    index = None if rebuild else LogIndex.load(index_path, path)
+    if index is None:
+        index = LogIndex.build(path, chunk_size)
+        try:
+            index.save(index_path, path)
+        except OSError as e:
+            print(f"Could not write the index {index_path}: {e}", file=sys.stderr)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index and query the BMv2 debug log')
+    parser.add_argument('command', help='index: (re)build the index, hits: table hit distribution, '
+                        'drops: dropped packets and why, trace: events of a packet',
+                        choices=["index", "hits", "drops", "trace"])
+    parser.add_argument('log', help='BMv2 log file', nargs='?', default='logs/s1.log')
+    parser.add_argument('--table', help='Table name or suffix (hits)',
+                        type=str, action="store", required=False, default="stream_gate_instance")
+    parser.add_argument('--stream', help='Only packets of this stream handle (drops)',
+                        type=int, action="store", required=False, default=None)
+    parser.add_argument('--packet', help='Packet ID (trace)',
+                        type=int, action="store", required=False, default=None)
+    parser.add_argument('--copy', help='Packet copy ID (trace)',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--limit', help='Maximum packets listed (drops)',
+                        type=int, action="store", required=False, default=50)
+    parser.add_argument('--chunk-mb', help='Read buffer size in MiB',
+                        type=int, action="store", required=False, default=16)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = open_index(args.log, rebuild=args.command == "index", chunk_size=args.chunk_mb << 20)
+    loaded = time.perf_counter()
+
+    if args.command == "index":
+        size = os.path.getsize(args.log)
+        print(f"Indexed {len(index.packets['packet_id'])} packets, {len(index.events['kind'])} events "
+              f"from {size / 1e6:.1f} MB in {loaded - start:.2f} s ({size / 1e6 / (loaded - start):.1f} MB/s) "
+              f"to {args.log + INDEX_SUFFIX}")
+    elif args.command == "hits":
+        for table, stats in index.hits(args.table).items():
+            total = sum(stats.values())
+            print(f"{table}: {total} lookups")
+            for key, count in sorted(stats.items(), key=lambda kv: (kv[0] != "miss", kv[0] if kv[0] != "miss" else 0)):
+                label = "miss" if key == "miss" else f"handle {key}"
+                print(f"  {label:12s} {count:10d} ({100 * count / total:5.1f}%)")
+    elif args.command == "drops":
+        rows = index.dropped(args.stream)
+        print(f"{len(rows)} dropped packets" + (f" of stream {args.stream}" if args.stream is not None else ""))
+        reasons = {}
+        for listed, row in enumerate(rows):
+            reason = index.drop_reason(row)
+            reasons[reason] = reasons.get(reason, 0) + 1
+            if listed < args.limit:
+                print(f"  packet {index.packets['packet_id'][row]}.{index.packets['copy_id'][row]} "
+                      f"at {index.packets['ts_in'][row] / 1000:.3f} s, port {index.packets['port_in'][row]}, "
+                      f"stream {index.packets['stream'][row]}: {reason}")
+        for reason, count in sorted(reasons.items(), key=lambda kv: -kv[1]):
+            print(f"{count:10d}  {reason}")
+    elif args.command == "trace":
+        if args.packet is None:
+            parser.error("trace needs --packet")
+        row = index.find_packet(args.packet, args.copy)
+        if row is None:
+            parser.error(f"Packet {args.packet}.{args.copy} not in the log")
+        events = index.packet_events(row)
+        for values in zip(*(events[c].tolist() for c in ("ts", "kind", "name", "arg", "value"))):
+            print(index.format_event(*values))
+    print(f"({(time.perf_counter() - loaded) * 1000:.1f} ms query, {(loaded - start) * 1000:.1f} ms index load)",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
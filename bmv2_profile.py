@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Per-stage data-plane time profile from BMv2 debug logs.
+
+Uses the bmv2_log.py index of s1.log: the time between two consecutive
+events of a packet is attributed to the stage the packet was in at the
+first event, a stack of pipeline, controls, table and action:
+
+    ingress;psfp_c;streamGate_c;stream_gate_instance;set_gate_and_ipv
+    ingress;psfp_c;tbl_PSFP99;PSFP99
+
+(register reads and writes are part of the action running them). Outside
+the pipelines the stages are receive, parser, traffic_manager, deparser and
+transmit.
+
+BMv2 logs timestamps with millisecond resolution, so a single packet's
+stage times are quantized to 0 or 1 ms steps. The sum over many packets is
+an unbiased estimate of the mean per-stage cost, which is what the report
+gives (per packet, per stream, per table with its number of entries); run
+enough traffic through the switch to get stable numbers.
+
+    ./bmv2_profile.py logs/s1.log --folded logs/s1.folded
+    flamegraph.pl logs/s1.folded > s1.svg     # or load it in speedscope
+
+The folded file has one "stack count" line per stage, in microseconds.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from bmv2_log import (EV_ACTION, EV_APPLY, EV_END, EV_HIT, EV_RECEIVED,
+                      EV_START, EV_TRANSMIT, open_index)
+from psfp_runtime import load_runtime_config
+
+PIPELINES = ("ingress", "egress")
+
+
+def control_path(table, names):
+    """
+    Stack frames of a table: its controls (without the top-level
+    IngressImpl/EgressImpl) and its name.
+
+    Tables synthesized by the compiler (tbl_<Control><line>) are put in the
+    control whose instance name matches <Control>.
+    """
+    if "." in table:
+        return table.split(".")[1:]
+    if table.startswith("tbl_"):
+        control = table[4:].rstrip("0123456789").lower()
+        for name in names:
+            parts = name.split(".")
+            for i, part in enumerate(parts[:-1]):
+                if part.lower() == control + "_c":
+                    return parts[1:i + 1] + [table]
+    return [table]
+
+
+def stage_stacks(index):
+    """
+    Stage of every event of the index.
+
+    :return: (stage id per event as int32, list of stage stacks as
+              ";"-joined strings)
+    """
+    names = index.names.names
+    events = index.events
+    stacks = []
+    stack_ids = {}
+    table_paths = {}
+
+    def stack_id(stack):
+        i = stack_ids.get(stack)
+        if i is None:
+            i = stack_ids[stack] = len(stacks)
+            stacks.append(stack)
+        return i
+
+    received = stack_id("receive")
+    transmit = stack_id("transmit")
+    stages = np.empty(len(events["kind"]), dtype=np.int32)
+    current = received
+    pipeline = "ingress"
+    table_stack = pipeline
+    last_packet = -1
+    for i, (packet, kind, name) in enumerate(zip(events["packet"].tolist(), events["kind"].tolist(),
+                                                 events["name"].tolist())):
+        if packet != last_packet:
+            last_packet = packet
+            current = received
+            pipeline = "ingress"
+        if kind == EV_START:
+            section, stage = names[name].split(":", 1)
+            if section == "pipeline":
+                pipeline = stage
+            current = stack_id(stage)
+        elif kind == EV_END:
+            section, stage = names[name].split(":", 1)
+            if section == "pipeline":
+                current = stack_id("traffic_manager" if stage == "ingress" else stage + "_end")
+            elif section == "deparser":
+                current = transmit
+        elif kind == EV_APPLY:
+            path = table_paths.get(name)
+            if path is None:
+                path = table_paths[name] = ";".join(control_path(names[name], names))
+            table_stack = f"{pipeline};{path}"
+            current = stack_id(table_stack)
+        elif kind == EV_ACTION:
+            current = stack_id(f"{table_stack};{names[name].rsplit('.', 1)[-1]}")
+        elif kind == EV_RECEIVED:
+            current = received
+        elif kind == EV_TRANSMIT:
+            current = transmit
+        stages[i] = current
+    return stages, stacks
+
+
+def stage_times(index, stages, n_stages, packet_mask=None):
+    """
+    Time (ms) spent in every stage, summed over the packets of a mask.
+    """
+    events = index.events
+    ts = events["ts"]
+    same_packet = events["packet"][1:] == events["packet"][:-1]
+    durations = np.where(same_packet, np.diff(ts), 0)
+    owners = stages[:-1]
+    if packet_mask is not None:
+        keep = packet_mask[events["packet"][:-1]]
+        durations = durations[keep]
+        owners = owners[keep]
+    return np.bincount(owners, weights=durations, minlength=n_stages)
+
+
+def inclusive(stacks, times):
+    """
+    Total time of every stack prefix (a stage and all its sub-stages).
+    """
+    totals = {}
+    for stack, value in zip(stacks, times.tolist()):
+        parts = stack.split(";")
+        for i in range(1, len(parts) + 1):
+            prefix = ";".join(parts[:i])
+            totals[prefix] = totals.get(prefix, 0.0) + value
+    return totals
+
+
+def print_tree(totals, packets, min_share):
+    """
+    Prints the stage tree, children sorted by time.
+    """
+    grand = sum(v for k, v in totals.items() if ";" not in k) or 1.0
+    children = {}
+    for stack in totals:
+        parent = stack.rsplit(";", 1)[0] if ";" in stack else ""
+        children.setdefault(parent, []).append(stack)
+
+    def walk(parent, depth):
+        for stack in sorted(children.get(parent, []), key=lambda s: -totals[s]):
+            share = totals[stack] / grand
+            if share < min_share:
+                continue
+            label = "  " * depth + stack.rsplit(";", 1)[-1]
+            print(f"{label:58s} {totals[stack]:10.0f} {100 * share:6.1f}% {1000 * totals[stack] / packets:9.1f}")
+            walk(stack, depth + 1)
+
+    print(f"{'stage':58s} {'total ms':>10s} {'share':>7s} {'µs/pkt':>9s}")
+    walk("", 0)
+
+
+def table_report(index, stacks, times, config):
+    """
+    Per-table lookups, hit rate, entries installed and mean time per lookup.
+    """
+    names = index.names.names
+    events = index.events
+    entries = {}
+    for entry in config["table_entries"]:
+        if not entry.get("default_action"):
+            entries[entry["table"]] = entries.get(entry["table"], 0) + 1
+    totals = inclusive(stacks, times)
+    applied = events["name"][events["kind"] == EV_APPLY]
+    lookups = np.bincount(applied, minlength=len(names))
+    rows = []
+    for name in np.nonzero(lookups)[0].tolist():
+        table = names[name]
+        path = ";".join(control_path(table, names))
+        total = sum(totals.get(f"{pipeline};{path}", 0.0) for pipeline in PIPELINES)
+        hits = int(((events["name"] == name) & (events["kind"] == EV_HIT)).sum())
+        rows.append((1000 * total / lookups[name], table, int(lookups[name]), hits, entries.get(table)))
+    print(f"\n{'table':62s} {'entries':>7s} {'lookups':>8s} {'hit %':>6s} {'µs/lookup':>10s}")
+    for mean, table, count, hits, installed in sorted(rows, reverse=True):
+        print(f"{table:62s} {'-' if installed is None else installed:>7} {count:8d} {100 * hits / count:6.1f} "
+              f"{mean:10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-stage time profile of the BMv2 pipeline')
+    parser.add_argument('log', help='BMv2 log file', nargs='?', default='logs/s1.log')
+    parser.add_argument('--folded', help='Write the stages in folded stack format (µs) to this file',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--runtime', help='Runtime JSON for the table sizes (default: the entries installed by '
+                        'mycontroller.py)', type=str, action="store", required=False, default=None)
+    parser.add_argument('--streams', help='Also profile each stream handle separately',
+                        action="store_true")
+    parser.add_argument('--min-share', help='Hide stages below this share of the total time (%%)',
+                        type=float, action="store", required=False, default=0.5)
+    parser.add_argument('--rebuild', help='Rebuild the log index', action="store_true")
+    args = parser.parse_args()
+
+    index = open_index(args.log, rebuild=args.rebuild)
+    stages, stacks = stage_stacks(index)
+    packets = index.packets
+    complete = packets["tx_size"] >= 0
+    times = stage_times(index, stages, len(stacks))
+    n = len(packets["packet_id"])
+    print(f"{n} packets ({int(complete.sum())} transmitted, {int((packets['stream'] >= 0).sum())} with a stream "
+          f"handle), {int(times.sum())} ms attributed; the log resolution is 1 ms, means need many packets")
+    if not n:
+        return
+    print_tree(inclusive(stacks, times), n, args.min_share / 100)
+    table_report(index, stacks, times, load_runtime_config(args.runtime))
+
+    if args.streams:
+        for stream in sorted(set(packets["stream"].tolist()) - {-1}):
+            mask = packets["stream"] == stream
+            print(f"\n----- stream {stream}: {int(mask.sum())} packets -----")
+            print_tree(inclusive(stacks, stage_times(index, stages, len(stacks), mask)), int(mask.sum()),
+                       args.min_share / 100)
+
+    if args.folded:
+        os.makedirs(os.path.dirname(args.folded) or ".", exist_ok=True)
+        with open(args.folded, "w") as f:
+            for stack, value in zip(stacks, times.tolist()):
+                if value:
+                    f.write(f"{stack} {int(round(value * 1000))}\n")
+        print(f"\nFolded stacks in {args.folded}")
+
+
+if __name__ == '__main__':
+    main()
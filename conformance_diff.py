@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Conformance diff between the PSFP reference model and captured switch output.
+
+Every s1-ethN_in.pcap is replayed through psfp_model.PSFPModel in timestamp
+order and the predicted forwarded frames are matched against the
+s1-ethN_out.pcap captures. Inputs and outputs are streamed and only frames
+inside the matching window are kept in memory.
+
+Mismatches are grouped by the stage (filter, gate, meter, ipv4) responsible:
+  - unexpected_forward: the model drops the frame, the switch forwarded it
+  - unexpected_drop:    the model forwards the frame, the switch did not
+  - rewrite:            both forward, but the forwarded headers differ
+"""
+
+import argparse
+import heapq
+import json
+import os
+import re
+import sys
+from collections import deque
+
+from pcap_utils import read_pcap
+from psfp_model import (ETH_802_1Q, ETH_IPV4, STAGE_FILTER, STAGE_GATE,
+                        STAGE_IPV4, STAGE_METER, STAGES, PSFPModel)
+from psfp_runtime import load_runtime_config
+
+PCAP_NAME = re.compile(r"^(?P<switch>\w+)-eth(?P<port>\d+)_(?P<dir>in|out)\.pcap$")
+
+IN = 0
+OUT = 1
+
+
+def ip_offset(frame):
+    ether_type = int.from_bytes(frame[12:14], "big")
+    if ether_type == ETH_802_1Q and int.from_bytes(frame[16:18], "big") == ETH_IPV4:
+        return 18
+    if ether_type == ETH_IPV4:
+        return 14
+    return None
+
+
+def frame_key(frame):
+    """
+    Key that survives the switch rewrites (MACs, VLAN tag, TTL, checksum).
+    """
+    offset = ip_offset(frame)
+    if offset is None:
+        return hash(frame[12:])
+    return hash(frame[offset:offset + 8] + frame[offset + 9:offset + 10] + frame[offset + 12:])
+
+
+def rewrite_stage(predicted, observed):
+    """
+    Returns the stage responsible for a header difference, or None.
+    """
+    offset = ip_offset(predicted)
+    if predicted[:12] != observed[:12]:
+        # dst comes from ipv4_forward, src from the (possibly overwritten) dst
+        return STAGE_IPV4 if predicted[:6] != observed[:6] else STAGE_FILTER
+    if offset == 18:
+        p_tci = int.from_bytes(predicted[14:16], "big")
+        o_tci = int.from_bytes(observed[14:16], "big")
+        if (p_tci ^ o_tci) & 0xefff:
+            return STAGE_FILTER
+        if p_tci != o_tci:
+            return STAGE_METER
+    if offset is not None and predicted[offset + 8] != observed[offset + 8]:
+        return STAGE_IPV4
+    return None
+
+
+def find_captures(pcap_dir, switch):
+    inputs, outputs = {}, {}
+    for name in sorted(os.listdir(pcap_dir)):
+        m = PCAP_NAME.match(name)
+        if not m or m.group("switch") != switch:
+            continue
+        target = inputs if m.group("dir") == "in" else outputs
+        target[int(m.group("port"))] = os.path.join(pcap_dir, name)
+    return inputs, outputs
+
+
+def tagged(path, kind, port):
+    for index, (ts, frame) in enumerate(read_pcap(path)):
+        yield ts, kind, port, index, frame
+
+
+class ConformanceDiff:
+    """
+    Streams model predictions against observed output.
+
+    :param model: a PSFPModel
+    :param clock_offset_us: added to capture timestamps to get switch time
+    :param window_us: how long a predicted frame may wait for its output
+    :param gate_tolerance_us: unexpected drops this close to a gate interval
+                              boundary are attributed to the gate
+    :param examples: number of examples kept per stage and kind
+    """
+
+    def __init__(self, model, clock_offset_us, window_us, gate_tolerance_us, examples):
+        self.model = model
+        self.clock_offset_us = clock_offset_us
+        self.window_us = window_us
+        self.gate_tolerance_us = gate_tolerance_us
+        self.max_examples = examples
+
+        self.pending = {}        # key -> deque of pending predictions
+        self.expiry = deque()    # (ts, key, prediction) in arrival order
+        self.counts = {stage: {"unexpected_forward": 0, "unexpected_drop": 0, "rewrite": 0}
+                       for stage in STAGES}
+        self.examples = {}
+        self.totals = {"frames_in": 0, "frames_out": 0, "predicted_forward": 0,
+                       "predicted_drop": 0, "matched": 0, "unmatched_out": 0}
+
+    def record(self, stage, kind, prediction):
+        self.counts[stage][kind] += 1
+        examples = self.examples.setdefault(f"{stage}/{kind}", [])
+        if len(examples) < self.max_examples:
+            ts, port, index, verdict = prediction[:4]
+            examples.append({
+                "ts_us": ts, "in_port": port, "frame_index": index,
+                "stream_handle": verdict.stream_handle, "gate_id": verdict.gate_id,
+                "diff_ts": verdict.diff_ts, "reason": verdict.reason
+            })
+
+    def blame_drop(self, verdict):
+        if verdict.boundary_us is not None and verdict.boundary_us <= self.gate_tolerance_us:
+            return STAGE_GATE
+        if verdict.color is not None and verdict.stream_handle:
+            return STAGE_METER
+        if verdict.stream_handle:
+            return STAGE_FILTER
+        return STAGE_IPV4
+
+    def expire(self, now):
+        while self.expiry and self.expiry[0][0] < now - self.window_us:
+            ts, key, prediction = self.expiry.popleft()
+            queue = self.pending.get(key)
+            if not queue or queue[0] is not prediction:
+                continue
+            queue.popleft()
+            if not queue:
+                del self.pending[key]
+            verdict = prediction[3]
+            if verdict.forwarded:
+                self.record(self.blame_drop(verdict), "unexpected_drop", prediction)
+
+    def on_input(self, ts, port, index, frame):
+        self.totals["frames_in"] += 1
+        verdict = self.model.process(ts + self.clock_offset_us, frame)
+        if verdict.forwarded:
+            self.totals["predicted_forward"] += 1
+        else:
+            self.totals["predicted_drop"] += 1
+        prediction = (ts, port, index, verdict)
+        key = frame_key(frame)
+        self.pending.setdefault(key, deque()).append(prediction)
+        self.expiry.append((ts, key, prediction))
+
+    def on_output(self, ts, port, frame):
+        self.totals["frames_out"] += 1
+        key = frame_key(frame)
+        queue = self.pending.get(key)
+        if not queue:
+            self.totals["unmatched_out"] += 1
+            return
+        prediction = queue.popleft()
+        if not queue:
+            del self.pending[key]
+        verdict = prediction[3]
+        if not verdict.forwarded:
+            self.record(verdict.stage, "unexpected_forward", prediction)
+            return
+        self.totals["matched"] += 1
+        if verdict.egress_port != port:
+            stage = STAGE_IPV4
+        else:
+            stage = rewrite_stage(verdict.frame, frame)
+        if stage is not None:
+            self.record(stage, "rewrite", prediction)
+
+    def run(self, inputs, outputs):
+        streams = [tagged(path, IN, port) for port, path in inputs.items()]
+        streams += [tagged(path, OUT, port) for port, path in outputs.items()]
+        # Inputs sort before outputs with the same timestamp
+        for ts, kind, port, index, frame in heapq.merge(*streams, key=lambda e: (e[0], e[1])):
+            self.expire(ts)
+            if kind == IN:
+                self.on_input(ts, port, index, frame)
+            else:
+                self.on_output(ts, port, frame)
+        self.expire(float("inf"))
+
+    def report(self):
+        return {
+            "totals": self.totals,
+            "hyperperiod_digests": self.model.digests,
+            "mismatches": {stage: kinds for stage, kinds in self.counts.items() if any(kinds.values())},
+            "examples": self.examples
+        }
+
+
+def print_report(report):
+    totals = report["totals"]
+    print(f"Input frames: {totals['frames_in']} "
+          f"(predicted {totals['predicted_forward']} forwarded, {totals['predicted_drop']} dropped)")
+    print(f"Output frames: {totals['frames_out']} "
+          f"({totals['matched']} matched, {totals['unmatched_out']} without input)")
+    print(f"Hyperperiod digests: {report['hyperperiod_digests']}")
+    if not report["mismatches"]:
+        print("No mismatch: switch output conforms to the model")
+        return
+    print("\n----- Mismatches by stage -----")
+    for stage, kinds in report["mismatches"].items():
+        print(f"{stage}: " + ", ".join(f"{kind}={count}" for kind, count in kinds.items() if count))
+        for kind in kinds:
+            for example in report["examples"].get(f"{stage}/{kind}", []):
+                print(f"   {kind} port {example['in_port']} frame #{example['frame_index']} "
+                      f"ts={example['ts_us']} stream={example['stream_handle']} "
+                      f"gate={example['gate_id']} diff_ts={example['diff_ts']} ({example['reason']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diff PSFP model predictions against captured switch output')
+    parser.add_argument('--pcap-dir', help='Directory holding <switch>-ethN_{in,out}.pcap',
+                        type=str, action="store", required=False, default='pcaps')
+    parser.add_argument('--switch', help='Switch name used in the capture file names',
+                        type=str, action="store", required=False, default='s1')
+    parser.add_argument('--runtime', help='Runtime JSON (default: the entries installed by mycontroller.py)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--anchor-us', help='last_hyperperiod programmed by the controller (switch time, µs)',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--clock-offset-us', help='Offset from capture time to switch time (default: first input frame is t=0)',
+                        type=int, action="store", required=False, default=None)
+    parser.add_argument('--rollover', help='Emulate controller register writes on hyperperiod digests',
+                        action="store_true")
+    parser.add_argument('--window-ms', help='Maximum switch latency when matching frames',
+                        type=float, action="store", required=False, default=1000.0)
+    parser.add_argument('--gate-tolerance-us', help='Attribute unexpected drops this close to a gate boundary to the gate',
+                        type=int, action="store", required=False, default=1000)
+    parser.add_argument('--examples', help='Examples printed per stage and mismatch kind',
+                        type=int, action="store", required=False, default=5)
+    parser.add_argument('--json', help='Print the report as JSON', action="store_true")
+    args = parser.parse_args()
+
+    inputs, outputs = find_captures(args.pcap_dir, args.switch)
+    if not inputs:
+        print(f"No {args.switch}-ethN_in.pcap capture found in {args.pcap_dir}")
+        sys.exit(1)
+
+    clock_offset_us = args.clock_offset_us
+    if clock_offset_us is None:
+        first = [next(read_pcap(path), None) for path in inputs.values()]
+        clock_offset_us = -min(f[0] for f in first if f is not None) if any(first) else 0
+
+    config = load_runtime_config(args.runtime)
+    model = PSFPModel(config["table_entries"], config["hyperperiods"], config["meters"],
+                      anchor_us=args.anchor_us, rollover=args.rollover)
+    diff = ConformanceDiff(model, clock_offset_us, int(args.window_ms * 1000),
+                           args.gate_tolerance_us, args.examples)
+    diff.run(inputs, outputs)
+
+    report = diff.report()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    sys.exit(1 if report["mismatches"] else 0)
+
+
+if __name__ == '__main__':
+    main()
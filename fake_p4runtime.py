@@ -0,0 +1,719 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+In-process stand-in for simple_switch_grpc's P4Runtime server.
+
+Implements Write, Read, SetForwardingPipelineConfig,
+GetForwardingPipelineConfig, Capabilities and StreamChannel (arbitration,
+digests and digest acks). Table, register, counter and meter state is kept in
+memory and validated against the p4info (ids, register/counter sizes,
+bitwidths). RPC latency and synthetic digest storms can be injected so the
+controller can be tested and benchmarked without BMv2 or Mininet.
+
+Usage as a standalone server:
+    ./fake_p4runtime.py --address 127.0.0.1:50051 --latency-ms 1 --digest-rate 100
+
+Self-check of the arbitration (primary and backup connecting and leaving):
+    ./fake_p4runtime.py --self-check
+
+Usage from Python:
+    server = FakeP4RuntimeServer('build/sdn-psfp.p4.p4info.txtpb')
+    server.start()
+    ...
+    server.stop()
+"""
+
+import argparse
+import itertools
+import queue
+import threading
+import time
+from concurrent import futures
+
+import grpc
+from google.protobuf import text_format
+from google.rpc import code_pb2, status_pb2
+
+from p4.config.v1 import p4info_pb2
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+HYPERPERIOD_DIGEST = "digest_finished_hyperperiod_t"
+
+READ_BATCH_SIZE = 1000
+
+
+class WriteError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def load_p4info(p4info_file_path):
+    p4info = p4info_pb2.P4Info()
+    with open(p4info_file_path) as f:
+        text_format.Merge(f.read(), p4info)
+    return p4info
+
+
+def encode_bitstring(value, bitwidth):
+    return (value & ((1 << bitwidth) - 1)).to_bytes((bitwidth + 7) // 8, "big")
+
+
+def _strip(value):
+    # P4Runtime canonical byte strings have no leading zero bytes
+    return value.lstrip(b"\x00") or b"\x00"
+
+
+def match_key(table_entry):
+    """
+    Canonical key of a table entry: match fields (in field id order) and priority.
+    """
+    fields = []
+    for m in sorted(table_entry.match, key=lambda m: m.field_id):
+        kind = m.WhichOneof("field_match_type")
+        if kind == "exact":
+            value = (_strip(m.exact.value),)
+        elif kind == "lpm":
+            value = (_strip(m.lpm.value), m.lpm.prefix_len)
+        elif kind == "ternary":
+            value = (_strip(m.ternary.value), _strip(m.ternary.mask))
+        elif kind == "range":
+            value = (_strip(m.range.low), _strip(m.range.high))
+        else:
+            value = (m.SerializeToString(deterministic=True),)
+        fields.append((m.field_id, kind) + value)
+    return tuple(fields), table_entry.priority
+
+
+class _Stream:
+    __slots__ = ("queue", "election_id", "device_id")
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.election_id = None
+        self.device_id = None
+
+
+class P4RuntimeState:
+    """
+    In-memory switch state indexed by the p4info.
+    """
+
+    def __init__(self, p4info):
+        self.lock = threading.RLock()
+        self.load(p4info)
+
+    def load(self, p4info):
+        with self.lock:
+            self.p4info = p4info
+            self.tables = {t.preamble.id: t for t in p4info.tables}
+            self.actions = {a.preamble.id: a for a in p4info.actions}
+            self.registers = {r.preamble.id: r for r in p4info.registers}
+            self.counters = {c.preamble.id: c for c in p4info.counters}
+            self.meters = {m.preamble.id: m for m in p4info.meters}
+            self.direct_counters = {c.preamble.id: c for c in p4info.direct_counters}
+            self.direct_meters = {m.preamble.id: m for m in p4info.direct_meters}
+            self.digests = {d.preamble.id: d for d in p4info.digests}
+            self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.table_entries = {table_id: {} for table_id in self.tables}
+            self.default_actions = {}
+            self.register_values = {}
+            for reg_id, reg in self.registers.items():
+                width = reg.type_spec.bitstring.bit.bitwidth or 1
+                self.register_values[reg_id] = [encode_bitstring(0, width)] * reg.size
+            self.counter_values = {c_id: [(0, 0)] * c.size for c_id, c in self.counters.items()}
+            self.meter_configs = {m_id: {} for m_id in self.meters}
+            self.direct_meter_configs = {m_id: {} for m_id in self.direct_meters}
+            self.direct_counter_values = {c_id: {} for c_id in self.direct_counters}
+
+    def _check_index(self, size, index, name):
+        if not 0 <= index < size:
+            raise WriteError(code_pb2.OUT_OF_RANGE, f"index {index} out of range for {name} (size {size})")
+
+    def _write_table_entry(self, update_type, te):
+        table = self.tables.get(te.table_id)
+        if table is None:
+            raise WriteError(code_pb2.NOT_FOUND, f"unknown table id {te.table_id}")
+        if te.HasField("action") and te.action.action.action_id not in self.actions:
+            raise WriteError(code_pb2.NOT_FOUND, f"unknown action id {te.action.action.action_id}")
+        if te.is_default_action:
+            if update_type != p4runtime_pb2.Update.MODIFY:
+                raise WriteError(code_pb2.INVALID_ARGUMENT, "default action can only be modified")
+            self.default_actions[te.table_id] = te.SerializeToString()
+            return
+
+        entries = self.table_entries[te.table_id]
+        key = match_key(te)
+        if update_type == p4runtime_pb2.Update.INSERT:
+            if key in entries:
+                raise WriteError(code_pb2.ALREADY_EXISTS, f"entry already exists in {table.preamble.name}")
+            if len(entries) >= table.size:
+                raise WriteError(code_pb2.RESOURCE_EXHAUSTED, f"table {table.preamble.name} is full")
+            entries[key] = te.SerializeToString()
+        elif update_type == p4runtime_pb2.Update.MODIFY:
+            if key not in entries:
+                raise WriteError(code_pb2.NOT_FOUND, f"entry not found in {table.preamble.name}")
+            entries[key] = te.SerializeToString()
+        elif update_type == p4runtime_pb2.Update.DELETE:
+            if entries.pop(key, None) is None:
+                raise WriteError(code_pb2.NOT_FOUND, f"entry not found in {table.preamble.name}")
+            for direct in (self.direct_counter_values, self.direct_meter_configs):
+                for values in direct.values():
+                    values.pop((te.table_id, key), None)
+
+    def _write_register_entry(self, update_type, re_):
+        reg = self.registers.get(re_.register_id)
+        if reg is None:
+            raise WriteError(code_pb2.NOT_FOUND, f"unknown register id {re_.register_id}")
+        if update_type != p4runtime_pb2.Update.MODIFY:
+            raise WriteError(code_pb2.INVALID_ARGUMENT, "registers can only be modified")
+        width = reg.type_spec.bitstring.bit.bitwidth
+        value = re_.data.bitstring
+        if width and int.from_bytes(value, "big") >> width:
+            raise WriteError(code_pb2.INVALID_ARGUMENT,
+                             f"value does not fit in {width} bits for {reg.preamble.name}")
+        indexes = [re_.index.index] if re_.HasField("index") else range(reg.size)
+        for index in indexes:
+            self._check_index(reg.size, index, reg.preamble.name)
+            self.register_values[reg.preamble.id][index] = encode_bitstring(int.from_bytes(value, "big"), width or 8)
+
+    def _write_counter_entry(self, update_type, ce):
+        counter = self.counters.get(ce.counter_id)
+        if counter is None:
+            raise WriteError(code_pb2.NOT_FOUND, f"unknown counter id {ce.counter_id}")
+        if update_type != p4runtime_pb2.Update.MODIFY:
+            raise WriteError(code_pb2.INVALID_ARGUMENT, "counters can only be modified")
+        indexes = [ce.index.index] if ce.HasField("index") else range(counter.size)
+        for index in indexes:
+            self._check_index(counter.size, index, counter.preamble.name)
+            self.counter_values[ce.counter_id][index] = (ce.data.packet_count, ce.data.byte_count)
+
+    def _write_meter_entry(self, update_type, me):
+        meter = self.meters.get(me.meter_id)
+        if meter is None:
+            raise WriteError(code_pb2.NOT_FOUND, f"unknown meter id {me.meter_id}")
+        if update_type != p4runtime_pb2.Update.MODIFY:
+            raise WriteError(code_pb2.INVALID_ARGUMENT, "meters can only be modified")
+        self._check_index(meter.size, me.index.index, meter.preamble.name)
+        self.meter_configs[me.meter_id][me.index.index] = me.config.SerializeToString()
+
+    def _write_direct_entry(self, update_type, te, store, data, name):
+        if update_type != p4runtime_pb2.Update.MODIFY:
+            raise WriteError(code_pb2.INVALID_ARGUMENT, f"{name} can only be modified")
+        key = match_key(te)
+        if key not in self.table_entries.get(te.table_id, {}):
+            raise WriteError(code_pb2.NOT_FOUND, f"{name}: table entry not found")
+        store[(te.table_id, key)] = data
+
+    def write(self, update):
+        """
+        Applies one Update. Raises WriteError on failure.
+        """
+        entity = update.entity
+        kind = entity.WhichOneof("entity")
+        with self.lock:
+            if kind == "table_entry":
+                self._write_table_entry(update.type, entity.table_entry)
+            elif kind == "register_entry":
+                self._write_register_entry(update.type, entity.register_entry)
+            elif kind == "counter_entry":
+                self._write_counter_entry(update.type, entity.counter_entry)
+            elif kind == "meter_entry":
+                self._write_meter_entry(update.type, entity.meter_entry)
+            elif kind == "direct_meter_entry":
+                dme = entity.direct_meter_entry
+                meter = next((m for m in self.direct_meters.values()
+                              if m.direct_table_id == dme.table_entry.table_id), None)
+                if meter is None:
+                    raise WriteError(code_pb2.NOT_FOUND, "table has no direct meter")
+                self._write_direct_entry(update.type, dme.table_entry, self.direct_meter_configs[meter.preamble.id],
+                                         dme.config.SerializeToString(), "direct meters")
+            elif kind == "direct_counter_entry":
+                dce = entity.direct_counter_entry
+                counter = next((c for c in self.direct_counters.values()
+                                if c.direct_table_id == dce.table_entry.table_id), None)
+                if counter is None:
+                    raise WriteError(code_pb2.NOT_FOUND, "table has no direct counter")
+                self._write_direct_entry(update.type, dce.table_entry, self.direct_counter_values[counter.preamble.id],
+                                         (dce.data.packet_count, dce.data.byte_count), "direct counters")
+            else:
+                raise WriteError(code_pb2.UNIMPLEMENTED, f"{kind} is not supported")
+
+    def read(self, entity):
+        """
+        Yields the entities matching one (possibly wildcard) read entity.
+        """
+        kind = entity.WhichOneof("entity")
+        with self.lock:
+            if kind == "table_entry":
+                te = entity.table_entry
+                table_ids = [te.table_id] if te.table_id else list(self.tables)
+                for table_id in table_ids:
+                    entries = self.table_entries.get(table_id, {})
+                    if te.table_id and len(te.match):
+                        data = entries.get(match_key(te))
+                        selected = [data] if data is not None else []
+                    else:
+                        selected = list(entries.values())
+                    for data in selected:
+                        out = p4runtime_pb2.Entity()
+                        out.table_entry.ParseFromString(data)
+                        yield out
+            elif kind == "register_entry":
+                re_ = entity.register_entry
+                reg_ids = [re_.register_id] if re_.register_id else list(self.registers)
+                for reg_id in reg_ids:
+                    values = self.register_values.get(reg_id, [])
+                    indexes = [re_.index.index] if re_.HasField("index") else range(len(values))
+                    for index in indexes:
+                        if 0 <= index < len(values):
+                            out = p4runtime_pb2.Entity()
+                            out.register_entry.register_id = reg_id
+                            out.register_entry.index.index = index
+                            out.register_entry.data.bitstring = values[index]
+                            yield out
+            elif kind == "counter_entry":
+                ce = entity.counter_entry
+                counter_ids = [ce.counter_id] if ce.counter_id else list(self.counters)
+                for counter_id in counter_ids:
+                    values = self.counter_values.get(counter_id, [])
+                    indexes = [ce.index.index] if ce.HasField("index") else range(len(values))
+                    for index in indexes:
+                        if 0 <= index < len(values):
+                            out = p4runtime_pb2.Entity()
+                            out.counter_entry.counter_id = counter_id
+                            out.counter_entry.index.index = index
+                            out.counter_entry.data.packet_count, out.counter_entry.data.byte_count = values[index]
+                            yield out
+            elif kind == "meter_entry":
+                me = entity.meter_entry
+                meter_ids = [me.meter_id] if me.meter_id else list(self.meters)
+                for meter_id in meter_ids:
+                    meter = self.meters.get(meter_id)
+                    if meter is None:
+                        continue
+                    indexes = [me.index.index] if me.HasField("index") else range(meter.size)
+                    for index in indexes:
+                        out = p4runtime_pb2.Entity()
+                        out.meter_entry.meter_id = meter_id
+                        out.meter_entry.index.index = index
+                        config = self.meter_configs[meter_id].get(index)
+                        if config is not None:
+                            out.meter_entry.config.ParseFromString(config)
+                        yield out
+            elif kind == "direct_counter_entry":
+                table_id = entity.direct_counter_entry.table_entry.table_id
+                for counter in self.direct_counters.values():
+                    if table_id and counter.direct_table_id != table_id:
+                        continue
+                    values = self.direct_counter_values[counter.preamble.id]
+                    for key, data in self.table_entries.get(counter.direct_table_id, {}).items():
+                        out = p4runtime_pb2.Entity()
+                        out.direct_counter_entry.table_entry.ParseFromString(data)
+                        packets, octets = values.get((counter.direct_table_id, key), (0, 0))
+                        out.direct_counter_entry.data.packet_count = packets
+                        out.direct_counter_entry.data.byte_count = octets
+                        yield out
+
+    def set_counter(self, counter_id, index, packets, octets):
+        with self.lock:
+            self.counter_values[counter_id][index] = (packets, octets)
+
+
+class FakeP4RuntimeServer(p4runtime_pb2_grpc.P4RuntimeServicer):
+    """
+    P4Runtime servicer backed by P4RuntimeState.
+
+    :param p4info_file_path: p4info used until a pipeline config is pushed
+    :param address: listen address
+    :param device_id: the only device id accepted
+    :param latency: per-RPC added latency in seconds, either a number applied
+                    to every RPC or a dict {rpc name: seconds}
+    :param workers: gRPC server thread pool size
+    """
+
+    def __init__(self, p4info_file_path, address='127.0.0.1:50051', device_id=0, latency=0.0, workers=16):
+        self.address = address
+        self.device_id = device_id
+        self.latency = latency
+        self.workers = workers
+        self.state = P4RuntimeState(load_p4info(p4info_file_path))
+        self.pipeline_config = None
+        self.streams = set()
+        self.streams_lock = threading.Lock()
+        self.primary = None
+        self.list_ids = itertools.count(1)
+        self.digest_sent_at = {}
+        self.write_listeners = []
+        self.stats = {"Write": 0, "updates": 0, "Read": 0, "entities_read": 0,
+                      "digests_sent": 0, "digest_acks": 0, "errors": 0}
+        # Held while stats is updated, from the gRPC worker threads
+        self.stats_lock = threading.Lock()
+        self.server = None
+
+    # ------------------------------------------------------------------
+    # Server lifecycle
+
+    def start(self):
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=self.workers))
+        p4runtime_pb2_grpc.add_P4RuntimeServicer_to_server(self, self.server)
+        port = self.server.add_insecure_port(self.address)
+        if self.address.endswith(":0"):
+            self.address = f"{self.address.rsplit(':', 1)[0]}:{port}"
+        self.server.start()
+        return self
+
+    def stop(self, grace=None):
+        with self.streams_lock:
+            for stream in self.streams:
+                stream.queue.put(None)
+        if self.server is not None:
+            self.server.stop(grace)
+
+    def wait(self):
+        self.server.wait_for_termination()
+
+    # ------------------------------------------------------------------
+    # Helpers
+
+    def _delay(self, rpc):
+        latency = self.latency.get(rpc, 0.0) if isinstance(self.latency, dict) else self.latency
+        if latency:
+            time.sleep(latency)
+
+    def _check_device(self, device_id, context):
+        if device_id != self.device_id:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"unknown device id {device_id}")
+
+    def _check_primary(self, election_id, context):
+        with self.streams_lock:
+            primary = self.primary
+            is_primary = primary is not None and (election_id.high, election_id.low) == primary.election_id
+        if not is_primary:
+            context.abort(grpc.StatusCode.PERMISSION_DENIED, "not primary")
+
+    def _count(self, name, count=1):
+        with self.stats_lock:
+            self.stats[name] += count
+
+    def _elect(self):
+        # Called with streams_lock held: the highest election id is primary
+        candidates = [s for s in self.streams if s.election_id is not None]
+        primary = max(candidates, key=lambda s: s.election_id, default=None)
+        changed = primary is not self.primary
+        self.primary = primary
+        return changed
+
+    def _arbitration_response(self, stream):
+        response = p4runtime_pb2.StreamMessageResponse()
+        arbitration = response.arbitration
+        arbitration.device_id = self.device_id
+        if self.primary is not None:
+            arbitration.election_id.high, arbitration.election_id.low = self.primary.election_id
+        if stream is self.primary:
+            arbitration.status.code = code_pb2.OK
+        elif self.primary is not None:
+            arbitration.status.code = code_pb2.ALREADY_EXISTS
+        else:
+            arbitration.status.code = code_pb2.NOT_FOUND
+        return response
+
+    def _notify_arbitration(self, requester):
+        # Every stream learns about a new primary; the requester always gets an answer
+        with self.streams_lock:
+            changed = self._elect()
+            # A closed stream (requester None) only matters if the primary changed
+            targets = self.streams if changed else [s for s in (requester,) if s is not None]
+            for stream in targets:
+                if stream.election_id is not None:
+                    stream.queue.put(self._arbitration_response(stream))
+
+    def _read_stream(self, stream, request_iterator):
+        try:
+            for request in request_iterator:
+                kind = request.WhichOneof("update")
+                if kind == "arbitration":
+                    if request.arbitration.device_id != self.device_id:
+                        # simple_switch_grpc ends the stream of an unknown device
+                        stream.queue.put((grpc.StatusCode.NOT_FOUND,
+                                          f"unknown device id {request.arbitration.device_id}"))
+                        return
+                    election_id = request.arbitration.election_id
+                    with self.streams_lock:
+                        stream.election_id = (election_id.high, election_id.low)
+                        stream.device_id = request.arbitration.device_id
+                    self._notify_arbitration(stream)
+                elif kind == "digest_ack":
+                    self._count("digest_acks")
+        except grpc.RpcError:
+            pass
+        finally:
+            stream.queue.put(None)
+
+    # ------------------------------------------------------------------
+    # Digests
+
+    def build_digest(self, digest_name, members_list):
+        """
+        Builds a DigestList from a list of {member name: int} dicts.
+
+        Members are encoded in the type_info struct order with their p4info bitwidths.
+        """
+        digest = next(d for d in self.state.p4info.digests if d.preamble.name == digest_name)
+        struct_name = digest.type_spec.struct.name
+        layout = [(m.name, m.type_spec.bitstring.bit.bitwidth)
+                  for m in self.state.p4info.type_info.structs[struct_name].members]
+        response = p4runtime_pb2.StreamMessageResponse()
+        digest_list = response.digest
+        digest_list.digest_id = digest.preamble.id
+        digest_list.list_id = next(self.list_ids)
+        digest_list.timestamp = time.time_ns()
+        for members in members_list:
+            data = digest_list.data.add()
+            for name, width in layout:
+                data.struct.members.add().bitstring = encode_bitstring(members.get(name, 0), width)
+        return response
+
+    def send_digest(self, digest_name, members_list):
+        """
+        Sends one DigestList to the primary controller.
+
+        :return: the list_id, or None when there is no primary
+        """
+        message = self.build_digest(digest_name, members_list)
+        with self.streams_lock:
+            primary = self.primary
+        if primary is None:
+            return None
+        self.digest_sent_at[message.digest.list_id] = time.perf_counter()
+        primary.queue.put(message)
+        self._count("digests_sent")
+        return message.digest.list_id
+
+    def hyperperiod_digest(self, gate_id, hyperperiod_us=20_000_000):
+        """
+        Members of a digest_finished_hyperperiod_t as the data plane would send it.
+        """
+        now_us = int(time.time() * 1_000_000)
+        return {"stream_gate_id": gate_id, "ingress_ts": now_us,
+                "hyperperiod_ts": hyperperiod_us, "last_hyperperiod": now_us - hyperperiod_us}
+
+    def digest_storm(self, rate, duration, gates=(1, 2, 3, 4), batch=1, digest_name=HYPERPERIOD_DIGEST):
+        """
+        Sends synthetic hyperperiod digests at ``rate`` lists per second.
+
+        Runs in a background thread; returns the thread.
+        """
+        def storm():
+            period = 1.0 / rate
+            deadline = time.perf_counter()
+            end = deadline + duration
+            for gate_id in itertools.cycle(gates):
+                if deadline >= end:
+                    break
+                members = [self.hyperperiod_digest(gate_id) for _ in range(batch)]
+                self.send_digest(digest_name, members)
+                deadline += period
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+        thread = threading.Thread(target=storm, daemon=True)
+        thread.start()
+        return thread
+
+    # ------------------------------------------------------------------
+    # P4Runtime RPCs
+
+    def Capabilities(self, request, context):
+        self._delay("Capabilities")
+        return p4runtime_pb2.CapabilitiesResponse(p4runtime_api_version="1.3.0")
+
+    def SetForwardingPipelineConfig(self, request, context):
+        self._delay("SetForwardingPipelineConfig")
+        self._check_device(request.device_id, context)
+        self._check_primary(request.election_id, context)
+        if request.config.HasField("p4info"):
+            self.state.load(request.config.p4info)
+        else:
+            self.state.reset()
+        self.pipeline_config = request.config.SerializeToString()
+        return p4runtime_pb2.SetForwardingPipelineConfigResponse()
+
+    def GetForwardingPipelineConfig(self, request, context):
+        self._delay("GetForwardingPipelineConfig")
+        self._check_device(request.device_id, context)
+        response = p4runtime_pb2.GetForwardingPipelineConfigResponse()
+        if self.pipeline_config is not None:
+            response.config.ParseFromString(self.pipeline_config)
+        else:
+            response.config.p4info.CopyFrom(self.state.p4info)
+        return response
+
+    def Write(self, request, context):
+        self._delay("Write")
+        self._check_device(request.device_id, context)
+        self._check_primary(request.election_id, context)
+        self._count("Write")
+        errors = []
+        # One p4.v1.Error per update, as BMv2 reports a partially failed batch
+        results = []
+        for index, update in enumerate(request.updates):
+            try:
+                self.state.write(update)
+            except WriteError as e:
+                errors.append(f"update {index}: {e}")
+                results.append(p4runtime_pb2.Error(canonical_code=e.code, message=str(e)))
+                continue
+            results.append(p4runtime_pb2.Error(canonical_code=code_pb2.OK))
+            self._count("updates")
+            for listener in self.write_listeners:
+                listener(update)
+        if errors:
+            self._count("errors", len(errors))
+            context.abort_with_status(_Status(code_pb2.UNKNOWN, "; ".join(errors), results))
+        return p4runtime_pb2.WriteResponse()
+
+    def Read(self, request, context):
+        self._delay("Read")
+        self._check_device(request.device_id, context)
+        self._count("Read")
+        response = p4runtime_pb2.ReadResponse()
+        for entity in request.entities:
+            for out in self.state.read(entity):
+                response.entities.append(out)
+                if len(response.entities) >= READ_BATCH_SIZE:
+                    self._count("entities_read", len(response.entities))
+                    yield response
+                    response = p4runtime_pb2.ReadResponse()
+        self._count("entities_read", len(response.entities))
+        yield response
+
+    def StreamChannel(self, request_iterator, context):
+        stream = _Stream()
+        with self.streams_lock:
+            self.streams.add(stream)
+        context.add_callback(lambda: stream.queue.put(None))
+        reader = threading.Thread(target=self._read_stream, args=(stream, request_iterator), daemon=True)
+        reader.start()
+        try:
+            while True:
+                message = stream.queue.get()
+                if message is None:
+                    break
+                if isinstance(message, tuple):
+                    # (status code, details) of a stream ended by the server
+                    context.abort(*message)
+                self._delay("StreamChannel")
+                yield message
+        finally:
+            with self.streams_lock:
+                self.streams.discard(stream)
+            self._notify_arbitration(None)
+
+
+class _Status(grpc.Status):
+    def __init__(self, code, details, errors=()):
+        self.code = grpc.StatusCode.UNKNOWN
+        self.details = details
+        status = status_pb2.Status(code=code, message=details)
+        for error in errors:
+            status.details.add().Pack(error)
+        self.trailing_metadata = (
+            ("grpc-status-details-bin", status.SerializeToString()),
+        )
+
+
+def self_check(p4info_file_path):
+    """
+    Connects a primary and a backup controller, then disconnects them one
+    after the other, checking the elected primary at every step.
+
+    :raise AssertionError: the arbitration went wrong
+    """
+    server = FakeP4RuntimeServer(p4info_file_path, "127.0.0.1:0").start()
+    channel = grpc.insecure_channel(server.address)
+    stub = p4runtime_pb2_grpc.P4RuntimeStub(channel)
+
+    def connect(election_id):
+        requests = queue.Queue()
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.arbitration.device_id = server.device_id
+        request.arbitration.election_id.low = election_id
+        requests.put(request)
+        responses = stub.StreamChannel(iter(requests.get, None))
+        return requests, responses, next(responses).arbitration.status.code
+
+    def wait_streams(count):
+        deadline = time.monotonic() + 5
+        while len(server.streams) != count:
+            assert time.monotonic() < deadline, f"{len(server.streams)} streams open, expected {count}"
+            time.sleep(0.01)
+
+    try:
+        primary, primary_responses, code = connect(2)
+        assert code == code_pb2.OK, f"primary got {code_pb2.Code.Name(code)}"
+        backup, _, code = connect(1)
+        assert code == code_pb2.ALREADY_EXISTS, f"backup got {code_pb2.Code.Name(code)}"
+
+        # Backup leaving: the primary does not change and nobody is notified
+        backup.put(None)
+        wait_streams(1)
+        server._notify_arbitration(None)
+        assert server.primary is not None and server.primary.election_id == (0, 2), "primary lost"
+
+        # Primary leaving: no primary left
+        primary.put(None)
+        for _ in primary_responses:
+            pass
+        wait_streams(0)
+        assert server.primary is None, "primary still elected"
+    finally:
+        channel.close()
+        server.stop()
+    print("Arbitration self-check passed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake P4Runtime server for tests and benchmarks')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/sdn-psfp.p4.p4info.txtpb')
+    parser.add_argument('--address', help='Listen address',
+                        type=str, action="store", required=False, default='127.0.0.1:50051')
+    parser.add_argument('--device-id', help='Device id served',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--latency-ms', help='Latency added to every RPC',
+                        type=float, action="store", required=False, default=0.0)
+    parser.add_argument('--digest-rate', help='Synthetic hyperperiod digests per second (0: none)',
+                        type=float, action="store", required=False, default=0.0)
+    parser.add_argument('--digest-batch', help='Digests per DigestList in a storm',
+                        type=int, action="store", required=False, default=1)
+    parser.add_argument('--digest-duration', help='Duration of the digest storm in seconds',
+                        type=float, action="store", required=False, default=3600.0)
+    parser.add_argument('--self-check', help='Check the arbitration and exit', action="store_true")
+    args = parser.parse_args()
+
+    if args.self_check:
+        self_check(args.p4info)
+        return
+    server = FakeP4RuntimeServer(args.p4info, args.address, args.device_id, args.latency_ms / 1000).start()
+    print(f"Fake P4Runtime server listening on {server.address} (device {args.device_id})")
+    try:
+        if args.digest_rate:
+            # Wait for a primary controller before starting the storm
+            while server.primary is None:
+                time.sleep(0.1)
+            print(f"Digest storm: {args.digest_rate} lists/s of {args.digest_batch} digests")
+            server.digest_storm(args.digest_rate, args.digest_duration, batch=args.digest_batch)
+        server.wait()
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+High-rate version of gen_pkts.py.
+
+Frames are rendered once per flow class (pkt_templates.FlowTemplate) and sent
+through an AF_PACKET raw socket; only the sequence number, source port and
+checksums change between packets. Needs root (raw socket), as scapy's sendp.
+Each flow class is a probe stream (probe ID = flow class) for
+receive.py --latency, unless --no-probe is given.
+
+    ./gen_fast_pkts.py 10.0.2.2 "hello" 1 2 --rate 20000 --duration 10
+"""
+
+import argparse
+import socket
+
+from pkt_templates import (DEFAULT_DST_MAC, FLOW_NAMES, FLOWS, PROBE_LEN,
+                           FlowTemplate, Probe, RawSender, get_if, iface_mac,
+                           send_flows, source_ip)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Template-based raw socket traffic generator')
+    parser.add_argument('destination', help='Destination host', type=str)
+    parser.add_argument('message', help='Payload message, repeated --repeat times', type=str)
+    parser.add_argument('flow_types', help='Flow classes: 1. audio, 2. video, 3. text, 4. streaming, 5. varied',
+                        nargs='+', choices=sorted(FLOWS))
+    parser.add_argument('--repeat', help='Times the message is repeated in the payload',
+                        type=int, action="store", required=False, default=100)
+    parser.add_argument('--rate', help='Target packets per second over all flows (0: as fast as possible)',
+                        type=float, action="store", required=False, default=0.0)
+    parser.add_argument('--count', help='Packets to send (0: no limit)',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--duration', help='Seconds to send for (0: no limit)',
+                        type=float, action="store", required=False, default=0.0)
+    parser.add_argument('--batch', help='Packets sent between two pacing checks',
+                        type=int, action="store", required=False, default=64)
+    parser.add_argument('--iface', help='Interface (default: the eth0 interface)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--dst-mac', help='Destination MAC address',
+                        type=str, action="store", required=False, default=DEFAULT_DST_MAC)
+    parser.add_argument('--no-qdisc-bypass', help='Send through the kernel qdisc layer',
+                        action="store_true")
+    parser.add_argument('--no-probe', help='Do not put a latency probe header before the message',
+                        action="store_true")
+    args = parser.parse_args()
+
+    if not args.count and not args.duration:
+        args.count = len(args.flow_types)
+
+    addr = socket.gethostbyname(args.destination)
+    iface = args.iface or get_if()
+    src_mac = iface_mac(iface)
+    src_ip = source_ip(addr)
+    payload = (args.message * args.repeat).encode()
+    probes = {}
+    if not args.no_probe:
+        payload = bytes(PROBE_LEN) + payload
+        probes = {f: Probe(int(f)) for f in args.flow_types}
+
+    templates = [FlowTemplate(FLOWS[f], src_mac, args.dst_mac, src_ip, addr, payload, probe=probes.get(f))
+                 for f in args.flow_types]
+    for flow_type, template in zip(args.flow_types, templates):
+        param = FLOWS[flow_type]
+        print(f"Sending {FLOW_NAMES[flow_type]} packets on interface {iface} to {addr} "
+              f"with VLAN ID {param['vid']}, PCP {param['pcp']} ({len(template)} bytes)")
+
+    sender = RawSender(iface, qdisc_bypass=not args.no_qdisc_bypass)
+    try:
+        stats = send_flows(sender, templates, rate=args.rate, count=args.count,
+                           duration=args.duration, batch=args.batch)
+    except KeyboardInterrupt:
+        stats = {"packets": sender.sent, "bytes": sender.bytes, "errors": sender.errors, "seconds": 0}
+    finally:
+        sender.close()
+
+    seconds = stats["seconds"] or float("nan")
+    print(f"Sent {stats['packets']} packets, {stats['bytes']} bytes in {stats['seconds']:.3f} s "
+          f"({stats['packets'] / seconds:.0f} pps, {stats['bytes'] * 8 / seconds / 1e6:.2f} Mbit/s), "
+          f"{stats['errors']} send errors")
+
+
+if __name__ == '__main__':
+    main()
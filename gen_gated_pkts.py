@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Gate-aligned traffic generator.
+
+Sends one frame per stream at chosen positions inside the open and/or closed
+windows of the stream gates installed by mycontroller.py, so forwarded and
+dropped frames can be attributed to gating. Frames are sent at absolute
+deadlines (sleep, then busy-wait) and every send is logged as CSV with the
+target and actual send time.
+
+The windows are computed from the hyperperiod anchor, i.e. the
+last_hyperperiod value the controller printed when programming the switch
+(the epoch value, or the 48-bit register value, which is extended to the
+latest matching epoch time):
+    ./gen_gated_pkts.py --anchor-us 1756110307475123 --windows closed --positions 0.01 0.5 0.99
+
+Frame N carries N in the IPv4 identification (and the TCP sequence number),
+matching the "seq" column of the log. Each stream is also a probe stream
+(probe ID = stream handle, send time = target time) for receive.py --latency,
+so frames lost to closed gates show up as loss there.
+"""
+
+import argparse
+import csv
+import os
+import statistics
+import time
+
+from pkt_templates import (FLOWS, PROBE_LEN, FlowTemplate, Probe, RawSender,
+                           get_if, iface_mac, source_ip, wait_until)
+from psfp_runtime import (GATE_OPEN, gate_schedule, gate_streams,
+                          gate_windows, load_runtime_config)
+
+# Width of the last_hyperperiod_reg timestamps written by the controller
+ANCHOR_BITS = 48
+
+
+def epoch_anchor(anchor_us, now_us):
+    """
+    Epoch time of an anchor given as a 48-bit register value: the latest
+    time not after now_us with the same low 48 bits. Epoch values pass
+    unchanged.
+    """
+    mask = (1 << ANCHOR_BITS) - 1
+    if anchor_us > mask:
+        return anchor_us
+    return now_us - ((now_us - anchor_us) & mask)
+
+
+def stream_template(stream, src_mac, src_ip, payload):
+    """
+    Template for a stream: the gen_pkts.py profile with the stream's PCP,
+    re-tagged with the stream's VLAN ID and sent to its destination.
+    """
+    profile = next((f for f in FLOWS.values() if f["pcp"] == stream["pcp"]), FLOWS["1"])
+    flow = dict(profile, pcp=stream["pcp"], vid=stream["vid"])
+    return FlowTemplate(flow, src_mac, stream["dst_mac"], src_ip, stream["dst_ip"], payload,
+                        probe=Probe(stream["stream_handle"]))
+
+
+def send_plan(config, gates, windows, positions, hyperperiods, anchor_us, start_us):
+    """
+    Computes the frames to send.
+
+    :param config: runtime config from load_runtime_config
+    :param gates: gate IDs to target
+    :param windows: window kinds to target ("open", "closed")
+    :param positions: positions inside each window, as a fraction of its length
+    :param hyperperiods: number of hyperperiods to cover per gate
+    :param anchor_us: hyperperiod anchor (epoch µs)
+    :param start_us: first hyperperiod used starts at or after this time (epoch µs)
+    :return: list of (deadline_us, diff_ts_us, gate_id, stream, window) sorted
+             by deadline, where window is (start_us, end_us, gate_state,
+             interval_identifier)
+    """
+    schedule = gate_schedule(config["table_entries"])
+    streams = gate_streams(config["table_entries"])
+    plan = []
+    for gate_id in gates:
+        hyperperiod_us = config["hyperperiods"][gate_id] * 1_000_000
+        first = max(0, -(-(start_us - anchor_us) // hyperperiod_us))
+        for window in gate_windows(schedule.get(gate_id, []), hyperperiod_us):
+            kind = "open" if window[2] == GATE_OPEN else "closed"
+            if kind not in windows:
+                continue
+            for cycle in range(first, first + hyperperiods):
+                base = anchor_us + cycle * hyperperiod_us
+                for position in positions:
+                    offset = window[0] + round(position * (window[1] - window[0]))
+                    for stream in streams.get(gate_id, []):
+                        if stream["dst_ip"] is not None:
+                            plan.append((base + offset, offset, gate_id, stream, window))
+    plan.sort(key=lambda p: p[0])
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send frames aligned with the stream gate schedule')
+    parser.add_argument('--anchor-us', help='Hyperperiod anchor printed by the controller (epoch or 48-bit µs, '
+                        'default: now + lead)',
+                        type=int, action="store", required=False, default=None)
+    parser.add_argument('--runtime', help='Runtime JSON (default: the entries installed by mycontroller.py)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--gates', help='Stream gate IDs to target (default: all)', nargs='+',
+                        type=int, default=None)
+    parser.add_argument('--windows', help='Gate windows to send in', nargs='+',
+                        choices=["open", "closed"], default=["open", "closed"])
+    parser.add_argument('--positions', help='Send positions inside each window (0: window start, 1: window end)',
+                        nargs='+', type=float, default=[0.5])
+    parser.add_argument('--hyperperiods', help='Hyperperiods to cover per gate',
+                        type=int, action="store", required=False, default=1)
+    parser.add_argument('--lead-ms', help='Skip hyperperiods starting sooner than this',
+                        type=float, action="store", required=False, default=100.0)
+    parser.add_argument('--spin-us', help='Busy-wait budget before each deadline',
+                        type=int, action="store", required=False, default=200)
+    parser.add_argument('--message', help='Payload message',
+                        type=str, action="store", required=False, default="gate")
+    parser.add_argument('--repeat', help='Times the message is repeated in the payload',
+                        type=int, action="store", required=False, default=25)
+    parser.add_argument('--iface', help='Interface (default: the eth0 interface)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--log', help='CSV log of the send timestamps',
+                        type=str, action="store", required=False, default='logs/gated_send.csv')
+    parser.add_argument('--dry-run', help='Print the plan without sending', action="store_true")
+    args = parser.parse_args()
+
+    config = load_runtime_config(args.runtime)
+    gates = args.gates or sorted(config["hyperperiods"])
+    now_us = time.time_ns() // 1000
+    start_us = now_us + int(args.lead_ms * 1000)
+    anchor_us = args.anchor_us
+    if anchor_us is None:
+        print("No --anchor-us given: windows are not aligned with the switch hyperperiods")
+        anchor_us = start_us
+    else:
+        anchor_us = epoch_anchor(anchor_us, now_us)
+
+    plan = send_plan(config, gates, set(args.windows), args.positions, args.hyperperiods,
+                     anchor_us, start_us)
+    if not plan:
+        print("Nothing to send")
+        return
+    print(f"{len(plan)} frames from {(plan[0][0] - now_us) / 1e6:.3f} s to {(plan[-1][0] - now_us) / 1e6:.3f} s from now")
+    if args.dry_run:
+        for deadline_us, diff_ts, gate_id, stream, window in plan:
+            print(f"  +{(deadline_us - now_us) / 1e6:10.6f} s  gate {gate_id}  stream {stream['stream_handle']}  "
+                  f"diff_ts {diff_ts}  window [{window[0]}, {window[1]}] state {window[2]}")
+        return
+
+    iface = args.iface or get_if()
+    src_mac = iface_mac(iface)
+    payload = bytes(PROBE_LEN) + (args.message * args.repeat).encode()
+    templates = {}
+    for _, _, _, stream, _ in plan:
+        if stream["stream_handle"] not in templates:
+            templates[stream["stream_handle"]] = stream_template(stream, src_mac, source_ip(stream["dst_ip"]), payload)
+
+    sender = RawSender(iface)
+    os.makedirs(os.path.dirname(args.log) or ".", exist_ok=True)
+    errors = []
+    spin_ns = args.spin_us * 1000
+    with open(args.log, "w", newline="") as f:
+        log = csv.writer(f)
+        log.writerow(["seq", "gate_id", "stream_handle", "vid", "window", "interval_identifier",
+                      "diff_ts_us", "target_ns", "sent_ns", "error_ns"])
+        try:
+            for seq, (deadline_us, diff_ts, gate_id, stream, window) in enumerate(plan):
+                target_ns = deadline_us * 1000
+                frame = templates[stream["stream_handle"]].patch(seq, 49152 + seq % 16384, target_ns)
+                sent_ns = wait_until(target_ns, spin_ns)
+                sender.send(frame)
+                errors.append(sent_ns - target_ns)
+                log.writerow([seq, gate_id, stream["stream_handle"], stream["vid"],
+                              "open" if window[2] == GATE_OPEN else "closed", window[3],
+                              diff_ts, target_ns, sent_ns, sent_ns - target_ns])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sender.close()
+
+    if errors:
+        errors.sort()
+        print(f"Sent {sender.sent} frames ({sender.errors} send errors), log in {args.log}")
+        print(f"Send time error: median {statistics.median(errors) / 1000:.1f} µs, "
+              f"p99 {errors[min(len(errors) - 1, int(len(errors) * 0.99))] / 1000:.1f} µs, "
+              f"max {errors[-1] / 1000:.1f} µs")
+
+
+if __name__ == '__main__':
+    main()
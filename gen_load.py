@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Multi-process load orchestrator for the gen_pkts.py flow classes.
+
+Starts one worker process per --flow spec, each pinned to its own core and
+sending pre-rendered frames (pkt_templates.FlowTemplate) at its own rate,
+frame size distribution and duration. Workers are released at a common
+start time published through shared memory, and the sent packet/byte
+counters are shared too, so the aggregated rate is printed every second.
+
+A --flow spec is "<flow_types>:<key>=<value>,...", e.g.
+    ./gen_load.py 10.0.2.2 --flow 1:rate=20000,size=200 \\
+                           --flow 2,4:rate=5000,size=uniform:64:1400,cpu=3 \\
+                           --flow 3:rate=0,size=choice:64/512/1250,duration=5
+
+Keys: rate (packets/s over the worker's flows, 0: as fast as possible),
+size (frame size distribution: N, uniform:MIN:MAX, choice:A/B/..,
+normal:MEAN:STDDEV), duration (s), count (packets) and cpu.
+
+Every flow class of a spec (every flow of a profile) is a probe stream for
+receive.py --latency, with probe ID (worker number << 8) + flow class (or
+flow index), unless --no-probe is given.
+
+With --profile, the flows of a traffic_profile.py file are sent instead, at
+send times and sizes precomputed before the start:
+    ./gen_load.py --profile profiles/tsn_mix.json
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import random
+import socket
+import sys
+import time
+
+from pkt_templates import (DEFAULT_DST_MAC, FLOW_NAMES, FLOWS, MAX_FRAME,
+                           FlowTemplate, Probe, RawSender, get_if, header_len,
+                           iface_mac, source_ip, wait_until)
+
+SIZE_SAMPLES = 4096
+
+# Shared memory layout (int64 slots)
+START_NS = 0
+HEADER_SLOTS = 1
+SLOT_READY = 0
+SLOT_SENT = 1
+SLOT_BYTES = 2
+SLOT_ERRORS = 3
+SLOT_DONE = 4
+WORKER_SLOTS = 5
+
+
+def parse_size(spec):
+    """
+    Parses a frame size distribution into a sampling function.
+
+    :param spec: N, uniform:MIN:MAX, choice:A/B/.. or normal:MEAN:STDDEV
+    :return: function (random.Random) -> frame size
+    """
+    kind, _, params = spec.partition(":")
+    if not params:
+        size = int(kind)
+        return lambda rng: size
+    if kind == "uniform":
+        low, high = (int(v) for v in params.split(":"))
+        return lambda rng: rng.randint(low, high)
+    if kind == "choice":
+        sizes = [int(v) for v in params.split("/")]
+        return lambda rng: rng.choice(sizes)
+    if kind == "normal":
+        mean, stddev = (float(v) for v in params.split(":"))
+        return lambda rng: int(rng.gauss(mean, stddev))
+    raise ValueError(f"Unknown size distribution: {spec}")
+
+
+def parse_flow_spec(spec, defaults):
+    """
+    Parses a --flow spec.
+
+    :param spec: "<flow_types>:<key>=<value>,..."
+    :param defaults: default values for the keys
+    :return: worker config dict
+    """
+    flow_types, _, options = spec.partition(":")
+    config = dict(defaults)
+    config["flows"] = flow_types.split(",")
+    for flow_type in config["flows"]:
+        if flow_type not in FLOWS:
+            raise ValueError(f"Invalid flow type {flow_type} in {spec}")
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        if key not in ("rate", "size", "duration", "count", "cpu"):
+            raise ValueError(f"Unknown key {key} in {spec}")
+        config[key] = value if key == "size" else float(value) if key in ("rate", "duration") else int(value)
+    parse_size(config["size"])
+    return config
+
+
+def size_cycle(flow_types, size_spec, seed):
+    """
+    Pre-samples frame sizes: (flow_type, frame_size) for SIZE_SAMPLES packets,
+    flows taken round-robin, sizes clamped to what the flow can carry.
+    """
+    rng = random.Random(seed)
+    sample = parse_size(size_spec)
+    cycle = []
+    for i in range(SIZE_SAMPLES):
+        flow_type = flow_types[i % len(flow_types)]
+        minimum = header_len(FLOWS[flow_type])
+        cycle.append((flow_type, min(MAX_FRAME, max(minimum, sample(rng)))))
+    return cycle
+
+
+class FlowJitter:
+    """
+    Send jitter of one flow: deviation of the inter-departure times from the
+    scheduled ones, plus the worst lateness against the schedule.
+    """
+
+    __slots__ = ("last_sent", "last_scheduled", "count", "deviation_sum", "max_late_ns")
+
+    def __init__(self):
+        self.last_sent = None
+        self.last_scheduled = None
+        self.count = 0
+        self.deviation_sum = 0
+        self.max_late_ns = 0
+
+    def add(self, sent_ns, scheduled_ns):
+        if self.last_sent is not None:
+            self.deviation_sum += abs(sent_ns - self.last_sent - (scheduled_ns - self.last_scheduled))
+            self.count += 1
+        self.last_sent = sent_ns
+        self.last_scheduled = scheduled_ns
+        if sent_ns - scheduled_ns > self.max_late_ns:
+            self.max_late_ns = sent_ns - scheduled_ns
+
+    def result(self):
+        return {"jitter_us": self.deviation_sum / self.count / 1000 if self.count else 0.0,
+                "max_late_us": self.max_late_ns / 1000}
+
+
+def pin(index, cpu):
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except OSError as e:
+            print(f"Worker {index}: cannot pin to CPU {cpu}: {e}", file=sys.stderr)
+
+
+def publish(shared, base, sender):
+    shared[base + SLOT_SENT] = sender.sent
+    shared[base + SLOT_BYTES] = sender.bytes
+    shared[base + SLOT_ERRORS] = sender.errors
+
+
+def wait_start(shared, base):
+    shared[base + SLOT_READY] = 1
+    while not shared[START_NS]:
+        time.sleep(0.001)
+    return wait_until(shared[START_NS])
+
+
+def finish(index, shared, base, sender, start_ns, jitter, results):
+    sender.close()
+    publish(shared, base, sender)
+    shared[base + SLOT_DONE] = 1
+    results.put((index, (time.time_ns() - start_ns) / 1e9, {name: j.result() for name, j in jitter.items()}))
+
+
+def worker(index, config, args, shared, results):
+    """
+    Worker process for a --flow spec: renders the templates, waits for the
+    shared start time and sends at the configured rate.
+    """
+    pin(index, config["cpu"])
+    base = HEADER_SLOTS + index * WORKER_SLOTS
+    src_mac = iface_mac(args.iface)
+    src_ip = source_ip(args.destination)
+    payload_byte = args.message.encode()[:1] or b"x"
+    cycle = size_cycle(config["flows"], config["size"], args.seed + index)
+    probes = {} if args.no_probe else {f: Probe(((index + 1) << 8) + int(f)) for f in config["flows"]}
+    templates = {}
+    for key in set(cycle):
+        flow_type, frame_size = key
+        payload = payload_byte * (frame_size - header_len(FLOWS[flow_type]))
+        templates[key] = FlowTemplate(FLOWS[flow_type], src_mac, args.dst_mac, src_ip, args.destination, payload,
+                                      probe=probes.get(flow_type))
+
+    rate = config["rate"]
+    interval_ns = int(1e9 / rate) if rate else 0
+    jitter = {FLOW_NAMES[flow_type]: FlowJitter() for flow_type in config["flows"]}
+    plan = [(templates[key], jitter[FLOW_NAMES[key[0]]]) for key in cycle]
+    sender = RawSender(args.iface)
+
+    start_ns = wait_start(shared, base)
+    end_ns = start_ns + int(config["duration"] * 1e9) if config["duration"] else None
+    count = config["count"]
+    spin_ns = args.spin_us * 1000
+    seq = 0
+    now = start_ns
+    try:
+        while (not count or seq < count) and (end_ns is None or now < end_ns):
+            template, flow_jitter = plan[seq % SIZE_SAMPLES]
+            if interval_ns:
+                deadline = start_ns + seq * interval_ns
+                if deadline > now:
+                    now = wait_until(deadline, spin_ns)
+            else:
+                deadline = now
+            sender.send(template.patch(seq, 49152 + seq % 16384))
+            flow_jitter.add(now, deadline)
+            seq += 1
+            if not seq & 63:
+                publish(shared, base, sender)
+            now = time.time_ns()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        finish(index, shared, base, sender, start_ns, jitter, results)
+
+
+def profile_worker(index, config, args, shared, results):
+    """
+    Worker process for traffic_profile flows: sends at the precomputed send
+    times with the precomputed frame sizes.
+    """
+    from traffic_profile import merge
+
+    pin(index, config["cpu"])
+    base = HEADER_SLOTS + index * WORKER_SLOTS
+    flows = config["flows"]
+    times, flow_index, sizes = merge(flows)
+    payload_byte = args.message.encode()[:1] or b"x"
+    templates = {}
+    for i, flow in enumerate(flows):
+        src_mac = flow["src_mac"] or iface_mac(args.iface)
+        src_ip = flow["src_ip"] or source_ip(flow["dst_ip"])
+        probe = None if args.no_probe else Probe(((index + 1) << 8) + i)
+        for size in set(sizes[flow_index == i].tolist()):
+            templates[(i, size)] = FlowTemplate(flow, src_mac, flow["dst_mac"], src_ip, flow["dst_ip"],
+                                                payload_byte * (size - header_len(flow)), dport=flow["dport"],
+                                                probe=probe)
+    jitter = {flow["name"]: FlowJitter() for flow in flows}
+    names = [flow["name"] for flow in flows]
+    plan = [(templates[(i, size)], jitter[names[i]]) for i, size in zip(flow_index.tolist(), sizes.tolist())]
+    offsets = times.tolist()
+    sender = RawSender(args.iface)
+
+    start_ns = wait_start(shared, base)
+    spin_ns = args.spin_us * 1000
+    now = start_ns
+    try:
+        for seq, (offset, (template, flow_jitter)) in enumerate(zip(offsets, plan)):
+            deadline = start_ns + offset
+            if deadline > now:
+                now = wait_until(deadline, spin_ns)
+            sender.send(template.patch(seq, 49152 + seq % 16384))
+            flow_jitter.add(now, deadline)
+            if not seq & 63:
+                publish(shared, base, sender)
+            now = time.time_ns()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        finish(index, shared, base, sender, start_ns, jitter, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-process traffic load for the PSFP flow classes')
+    parser.add_argument('destination', help='Destination host (with --flow)', type=str, nargs='?')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--flow', help='Worker spec "<flow_types>:<key>=<value>,..." (repeatable)',
+                        action="append")
+    source.add_argument('--profile', help='Traffic profile file (see traffic_profile.py); one worker per flow '
+                        'or per "worker" key',
+                        type=str, action="store")
+    parser.add_argument('--rate', help='Default worker rate in packets/s (0: as fast as possible)',
+                        type=float, action="store", required=False, default=1000.0)
+    parser.add_argument('--size', help='Default frame size distribution',
+                        type=str, action="store", required=False, default="542")
+    parser.add_argument('--duration', help='Default worker duration in seconds',
+                        type=float, action="store", required=False, default=10.0)
+    parser.add_argument('--message', help='Payload filler (first character is used)',
+                        type=str, action="store", required=False, default="x")
+    parser.add_argument('--iface', help='Interface (default: the eth0 interface)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--dst-mac', help='Destination MAC address',
+                        type=str, action="store", required=False, default=DEFAULT_DST_MAC)
+    parser.add_argument('--start-delay-ms', help='Delay between all workers ready and the common start',
+                        type=float, action="store", required=False, default=200.0)
+    parser.add_argument('--spin-us', help='Busy-wait budget before each send deadline',
+                        type=int, action="store", required=False, default=50)
+    parser.add_argument('--seed', help='Seed for the frame size sampling',
+                        type=int, action="store", required=False, default=1)
+    parser.add_argument('--no-probe', help='Do not stamp latency probe headers in the payloads',
+                        action="store_true")
+    args = parser.parse_args()
+
+    args.iface = args.iface or get_if()
+    if args.profile:
+        from traffic_profile import load_profile
+        try:
+            flows = load_profile(args.profile)
+        except ValueError as e:
+            parser.error(str(e))
+        groups = {}
+        for i, flow in enumerate(flows):
+            groups.setdefault(flow["worker"] if flow["worker"] is not None else f"flow{i}", []).append(flow)
+        configs = [{"flows": group, "cpu": next((f["cpu"] for f in group if f["cpu"] is not None), None)}
+                   for group in groups.values()]
+        target = profile_worker
+    else:
+        if not args.destination:
+            parser.error("A destination is needed with --flow")
+        args.destination = socket.gethostbyname(args.destination)
+        defaults = {"rate": args.rate, "size": args.size, "duration": args.duration, "count": 0, "cpu": None}
+        try:
+            configs = [parse_flow_spec(spec, defaults) for spec in args.flow]
+        except ValueError as e:
+            parser.error(str(e))
+        target = worker
+
+    cpus = sorted(os.sched_getaffinity(0))
+    for i, config in enumerate(configs):
+        if config["cpu"] is None:
+            config["cpu"] = cpus[i % len(cpus)]
+
+    ctx = multiprocessing.get_context("fork")
+    shared = ctx.RawArray("q", HEADER_SLOTS + WORKER_SLOTS * len(configs))
+    results = ctx.Queue()
+    workers = [ctx.Process(target=target, args=(i, config, args, shared, results), daemon=True)
+               for i, config in enumerate(configs)]
+    for i, (process, config) in enumerate(zip(workers, configs)):
+        process.start()
+        if args.profile:
+            print(f"Worker {i} (pid {process.pid}, cpu {config['cpu']}): "
+                  f"{', '.join(flow['name'] for flow in config['flows'])} from {args.profile}")
+        else:
+            print(f"Worker {i} (pid {process.pid}, cpu {config['cpu']}): "
+                  f"{', '.join(FLOW_NAMES[f] for f in config['flows'])} at "
+                  f"{config['rate'] or 'max'} pps, size {config['size']}, "
+                  f"{config['count'] or 'no limit on'} packets, {config['duration'] or 'no limit on'} s")
+
+    slots = range(len(configs))
+
+    def slot(i, name):
+        return shared[HEADER_SLOTS + i * WORKER_SLOTS + name]
+
+    while not all(slot(i, SLOT_READY) for i in slots):
+        failed = [i for i in slots if not slot(i, SLOT_READY) and not workers[i].is_alive()]
+        if failed:
+            for i in failed:
+                print(f"Worker {i} (pid {workers[i].pid}) exited before start with code {workers[i].exitcode}")
+            for process in workers:
+                if process.is_alive():
+                    process.terminate()
+            sys.exit(1)
+        time.sleep(0.01)
+    shared[START_NS] = time.time_ns() + int(args.start_delay_ms * 1e6)
+
+    def totals():
+        return (sum(shared[HEADER_SLOTS + i * WORKER_SLOTS + SLOT_SENT] for i in slots),
+                sum(shared[HEADER_SLOTS + i * WORKER_SLOTS + SLOT_BYTES] for i in slots))
+
+    wait_until(shared[START_NS])
+    last_t, (last_packets, last_bytes) = time.perf_counter(), totals()
+    try:
+        while not all(slot(i, SLOT_DONE) or not workers[i].is_alive() for i in slots):
+            time.sleep(1)
+            now, (packets, nbytes) = time.perf_counter(), totals()
+            dt = now - last_t
+            print(f"{(packets - last_packets) / dt:12.0f} pps {(nbytes - last_bytes) * 8 / dt / 1e6:10.2f} Mbit/s")
+            last_t, last_packets, last_bytes = now, packets, nbytes
+    except KeyboardInterrupt:
+        pass
+
+    reports = {}
+    while len(reports) < len(configs):
+        # Checked before waiting: a worker that exited has posted its result by then
+        pending = any(workers[i].is_alive() for i in slots if i not in reports)
+        try:
+            index, elapsed, jitter = results.get(timeout=0.5)
+        except queue.Empty:
+            if not pending:
+                break
+            continue
+        reports[index] = (elapsed, jitter)
+    for process in workers:
+        process.join()
+    for i in slots:
+        if i not in reports:
+            print(f"Worker {i} (pid {workers[i].pid}) exited with code {workers[i].exitcode} without a result")
+
+    print("\n----- Load summary -----")
+    total_packets = total_bytes = 0
+    longest = 0.0
+    for i in sorted(reports):
+        base = HEADER_SLOTS + i * WORKER_SLOTS
+        packets, nbytes, errors = shared[base + SLOT_SENT], shared[base + SLOT_BYTES], shared[base + SLOT_ERRORS]
+        elapsed, jitter = reports[i]
+        total_packets += packets
+        total_bytes += nbytes
+        longest = max(longest, elapsed)
+        print(f"Worker {i}: {packets} packets, {packets / elapsed:.0f} pps, "
+              f"{nbytes * 8 / elapsed / 1e6:.2f} Mbit/s, {errors} send errors")
+        for name, result in jitter.items():
+            print(f"   {name:10s} jitter {result['jitter_us']:9.1f} µs  "
+                  f"max late {result['max_late_us']:9.1f} µs")
+    if longest:
+        print(f"Total: {total_packets} packets, {total_packets / longest:.0f} pps, "
+              f"{total_bytes * 8 / longest / 1e6:.2f} Mbit/s")
+
+
+if __name__ == '__main__':
+    main()
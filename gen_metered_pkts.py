@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Rate-shaped traffic generator for flow meter verification.
+
+Sends one stream of the chosen flow meter instance through a sequence of
+phases, each shaped by an internal token bucket:
+  - rate:R:SECONDS       constant byte rate R
+  - ramp:R1:R2:SECONDS   byte rate ramped linearly from R1 to R2
+  - burst:B              B bytes back to back
+  - idle:SECONDS         nothing sent (lets the meter buckets refill)
+Rates and sizes are bytes (per second), or relative to the meter band of the
+instance: 0.8cir, 1.5pir, 2cbs, 1pbs.
+
+Every frame sent is logged, and the log is replayed through the two rate
+three color meter of psfp_model to give the expected green/yellow/red split
+per phase, and the values marked_{green,yellow,red}_counter should then
+show given the flow_meter_config entry of the instance (BMv2 colors RED as 2,
+which FlowMeter.p4 handles like yellow):
+
+    ./gen_metered_pkts.py --phase idle:1 --phase rate:0.8cir:10 --phase burst:2cbs \\
+                          --phase ramp:0.5cir:1.5pir:10 --output logs/meter_run.json
+
+The meter only runs for frames that passed the stream gate, so send while
+the stream's gate is open (see gen_gated_pkts.py). --dry-run computes the
+expected colors for an ideally timed run without sending. Frames carry a
+latency probe (probe ID = stream handle) for receive.py --latency.
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import time
+
+from pkt_templates import (FLOWS, FlowTemplate, Probe, RawSender, get_if,
+                           header_len, iface_mac, source_ip, wait_until)
+from psfp_model import METER_GREEN, TwoRateMeter
+from psfp_runtime import gate_streams, load_runtime_config
+
+METER_CONFIG_TABLE = "IngressImpl.psfp_c.flowMeter_c.flow_meter_config"
+COLORS = ("green", "yellow", "red")
+VALUE = re.compile(r"^(?P<value>[0-9.]+)(?P<unit>cir|pir|cbs|pbs)?$")
+
+
+def parse_value(text, band):
+    """
+    Parses a byte rate or size, absolute or relative to the meter band.
+    """
+    m = VALUE.match(text)
+    if not m:
+        raise ValueError(f"Invalid rate or size: {text}")
+    unit = m.group("unit")
+    scale = {None: 1, "cir": band["cir"], "pir": band["pir"], "cbs": band["cburst"], "pbs": band["pburst"]}[unit]
+    return float(m.group("value")) * scale
+
+
+def parse_phase(spec, band):
+    """
+    Parses a --phase spec.
+
+    :return: dict with kind, name, and start_rate/end_rate/seconds or bytes
+    """
+    kind, *params = spec.split(":")
+    if kind == "rate" and len(params) == 2:
+        rate = parse_value(params[0], band)
+        return {"kind": kind, "name": spec, "start_rate": rate, "end_rate": rate, "seconds": float(params[1])}
+    if kind == "ramp" and len(params) == 3:
+        return {"kind": kind, "name": spec, "start_rate": parse_value(params[0], band),
+                "end_rate": parse_value(params[1], band), "seconds": float(params[2])}
+    if kind == "burst" and len(params) == 1:
+        return {"kind": kind, "name": spec, "bytes": parse_value(params[0], band)}
+    if kind == "idle" and len(params) == 1:
+        return {"kind": kind, "name": spec, "seconds": float(params[0])}
+    raise ValueError(f"Invalid phase: {spec}")
+
+
+class VirtualClock:
+    """
+    Clock for --dry-run: waiting just moves the time forward.
+    """
+
+    def __init__(self):
+        self.now_ns = 0
+
+    def time_ns(self):
+        return self.now_ns
+
+    def wait_until(self, deadline_ns, spin_ns=0):
+        self.now_ns = max(self.now_ns, deadline_ns)
+        return self.now_ns
+
+
+def shape(phases, length, send, time_ns, wait, shaper_burst, spin_ns):
+    """
+    Runs the phases, calling send(phase_index) for every frame.
+
+    Rate and ramp phases go through a token bucket filled at the phase's
+    current rate and holding at most shaper_burst bytes, so sends never run
+    ahead of the target rate by more than that.
+    """
+    for index, phase in enumerate(phases):
+        start = time_ns()
+        if phase["kind"] == "idle":
+            wait(start + int(phase["seconds"] * 1e9), spin_ns)
+        elif phase["kind"] == "burst":
+            sent = 0
+            while sent < phase["bytes"]:
+                send(index)
+                sent += length
+        else:
+            end = start + int(phase["seconds"] * 1e9)
+            slope = (phase["end_rate"] - phase["start_rate"]) / (end - start)
+            tokens = float(length)
+            last = start
+            now = start
+            while now < end:
+                rate = phase["start_rate"] + slope * (now - start)
+                tokens = min(max(shaper_burst, length), tokens + (now - last) * rate / 1e9)
+                last = now
+                if tokens >= length:
+                    send(index)
+                    tokens -= length
+                    now = time_ns()
+                elif rate > 0:
+                    now = wait(min(end, now + math.ceil((length - tokens) / rate * 1e9) + 1), spin_ns)
+                else:
+                    now = wait(min(end, now + 1_000_000), spin_ns)
+
+
+def expected_colors(records, band):
+    """
+    Replays the sent frames through the two rate three color meter.
+
+    :param records: list of (seq, phase_index, sent_ns, length)
+    :param band: the meter band (cir, cburst, pir, pburst)
+    :return: list of colors, one per record
+    """
+    meter = TwoRateMeter(band["cir"], band["cburst"], band["pir"], band["pburst"])
+    return [meter.execute(sent_ns // 1000, length) for _, _, sent_ns, length in records]
+
+
+def counter_color(color, drop_on_yellow):
+    """
+    Counter a meter color ends up in, as FlowMeter.p4 handles BMv2 colors.
+    """
+    if color == METER_GREEN:
+        return "green"
+    return "red" if drop_on_yellow else "yellow"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rate-shaped traffic for flow meter verification')
+    parser.add_argument('--runtime', help='Runtime JSON (default: the entries installed by mycontroller.py)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--meter-instance', help='Flow meter instance ID (default: first configured meter)',
+                        type=int, action="store", required=False, default=None)
+    parser.add_argument('--stream', help='Stream handle to send (default: first stream of the meter instance)',
+                        type=int, action="store", required=False, default=None)
+    parser.add_argument('--phase', help='Phase spec, see the module help (repeatable)', action="append",
+                        default=None)
+    parser.add_argument('--size', help='Frame size in bytes',
+                        type=int, action="store", required=False, default=500)
+    parser.add_argument('--shaper-burst', help='Token bucket depth of the shaper in bytes (default: one frame)',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--spin-us', help='Busy-wait budget before each send deadline',
+                        type=int, action="store", required=False, default=200)
+    parser.add_argument('--iface', help='Interface (default: the eth0 interface)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--log', help='CSV log of the frames sent',
+                        type=str, action="store", required=False, default='logs/meter_send.csv')
+    parser.add_argument('--output', help='Write the expected colors per phase to this JSON file',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--dry-run', help='Compute the expected colors of an ideally timed run without sending',
+                        action="store_true")
+    args = parser.parse_args()
+
+    config = load_runtime_config(args.runtime)
+    bands = {m["index"]: m for m in config["meters"]}
+    instance = args.meter_instance if args.meter_instance is not None else config["meters"][0]["index"]
+    if instance not in bands:
+        parser.error(f"No meter band configured for flow meter instance {instance}")
+    band = bands[instance]
+    drop_on_yellow = next((e["action_params"]["dropOnYellow"] for e in config["table_entries"]
+                           if e["table"] == METER_CONFIG_TABLE and not e.get("default_action")
+                           and e["match"]["meta.ingress_md.stream_filter.flow_meter_instance_id"] == instance), 0)
+
+    streams = [s for gate in gate_streams(config["table_entries"]).values() for s in gate
+               if s["flow_meter_instance_id"] == instance and s["dst_ip"] is not None
+               and (args.stream is None or s["stream_handle"] == args.stream)]
+    if not streams:
+        parser.error(f"No stream uses flow meter instance {instance}")
+    stream = streams[0]
+
+    try:
+        phases = [parse_phase(spec, band) for spec in
+                  args.phase or ["idle:1", "rate:0.8cir:10", "idle:1", "burst:2cbs", "idle:1", "ramp:0.5cir:1.5pir:10"]]
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(f"Meter instance {instance}: CIR {band['cir']} B/s, CBS {band['cburst']} B, "
+          f"PIR {band['pir']} B/s, PBS {band['pburst']} B, dropOnYellow {drop_on_yellow}")
+    print(f"Stream {stream['stream_handle']} (VID {stream['vid']}, PCP {stream['pcp']}) to {stream['dst_ip']}, "
+          f"{args.size} byte frames")
+
+    records = []
+    if args.dry_run:
+        clock = VirtualClock()
+
+        def send(phase_index):
+            records.append((len(records), phase_index, clock.now_ns, args.size))
+
+        shape(phases, args.size, send, clock.time_ns, clock.wait_until, args.shaper_burst, 0)
+    else:
+        iface = args.iface or get_if()
+        profile = next((f for f in FLOWS.values() if f["pcp"] == stream["pcp"]), FLOWS["1"])
+        flow = dict(profile, pcp=stream["pcp"], vid=stream["vid"])
+        template = FlowTemplate(flow, iface_mac(iface), stream["dst_mac"], source_ip(stream["dst_ip"]),
+                                stream["dst_ip"], b"m" * max(0, args.size - header_len(flow)),
+                                probe=Probe(stream["stream_handle"]))
+        length = len(template)
+        sender = RawSender(iface)
+
+        def send(phase_index):
+            seq = len(records)
+            sender.send(template.patch(seq, 49152 + (seq & 16383)))
+            records.append((seq, phase_index, time.time_ns(), length))
+
+        try:
+            shape(phases, length, send, time.time_ns, wait_until, args.shaper_burst, args.spin_us * 1000)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sender.close()
+
+        os.makedirs(os.path.dirname(args.log) or ".", exist_ok=True)
+        with open(args.log, "w", newline="") as f:
+            log = csv.writer(f)
+            log.writerow(["seq", "phase", "sent_ns", "length"])
+            log.writerows(records)
+        print(f"Sent {sender.sent} frames ({sender.errors} send errors), log in {args.log}")
+
+    colors = expected_colors(records, band)
+    report = {"meter_instance": instance, "band": band, "drop_on_yellow": drop_on_yellow,
+              "stream_handle": stream["stream_handle"], "phases": [], "counters": dict.fromkeys(COLORS, 0)}
+    for index, phase in enumerate(phases):
+        phase_records = [(r, c) for r, c in zip(records, colors) if r[1] == index]
+        frames = len(phase_records)
+        nbytes = sum(r[3] for r, _ in phase_records)
+        meter = dict.fromkeys(COLORS, 0)
+        for _, color in phase_records:
+            meter[COLORS[color]] += 1
+            report["counters"][counter_color(color, drop_on_yellow)] += 1
+        seconds = (phase_records[-1][0][2] - phase_records[0][0][2]) / 1e9 if frames > 1 else 0
+        report["phases"].append({"phase": phase["name"], "frames": frames, "bytes": nbytes,
+                                 "rate": nbytes / seconds if seconds else None, "meter": meter})
+
+    print("\n----- Expected meter colors -----")
+    for phase in report["phases"]:
+        if not phase["frames"]:
+            continue
+        rate = f"{phase['rate']:.0f} B/s" if phase["rate"] else "-"
+        shares = "  ".join(f"{c} {phase['meter'][c]:6d} ({100 * phase['meter'][c] / phase['frames']:5.1f}%)"
+                           for c in COLORS)
+        print(f"{phase['phase']:24s} {phase['frames']:7d} frames {rate:>14s}  {shares}")
+    print("Expected counter increments: " + ", ".join(f"marked_{c}_counter[{instance}] +{n}"
+                                                     for c, n in report["counters"].items()))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
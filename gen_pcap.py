@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Offline traffic synthesis to a pcap file.
+
+Same --flow specs as gen_load.py, but instead of sending on eth0 the frames
+are written with virtual timestamps (constant bit rate per spec, or Poisson
+arrivals) to a nanosecond pcap, through the buffered pcap_utils.PcapWriter.
+No interface or root is needed, so the output can feed offline replay,
+conformance_diff.py or tcpreplay anywhere:
+
+    ./gen_pcap.py --output pcaps/mix.pcap --flow 1:rate=20000,size=200 \\
+                  --flow 2,4:rate=5000,size=uniform:64:1400 --duration 60
+    ./gen_pcap.py --output pcaps/mix.pcap --profile profiles/tsn_mix.json
+"""
+
+import argparse
+import heapq
+import random
+import time
+
+from gen_load import SIZE_SAMPLES, parse_flow_spec, size_cycle
+from pcap_utils import PcapWriter
+from pkt_templates import (DEFAULT_DST_MAC, FLOW_NAMES, FLOWS, FlowTemplate,
+                           header_len)
+
+SIZE_SAMPLES_MASK = SIZE_SAMPLES - 1
+
+
+def spec_frames(index, config, templates, start_ns, poisson, seed):
+    """
+    Virtual send times and templates of one --flow spec.
+
+    :return: generator of (ts_ns, spec index, seq, template)
+    """
+    cycle = [templates[key] for key in size_cycle(config["flows"], config["size"], seed)]
+    interval_ns = 1e9 / config["rate"]
+    end_ns = start_ns + int(config["duration"] * 1e9) if config["duration"] else None
+    count = config["count"]
+    rng = random.Random(seed)
+    ts = float(start_ns)
+    seq = 0
+    while (not count or seq < count) and (end_ns is None or ts < end_ns):
+        yield int(ts), index, seq, cycle[seq & SIZE_SAMPLES_MASK]
+        seq += 1
+        ts += rng.expovariate(1.0) * interval_ns if poisson else interval_ns
+
+
+def write_profile(args):
+    """
+    Writes the flows of a traffic profile, using its precomputed timeline.
+    """
+    from traffic_profile import load_profile, merge
+
+    flows = load_profile(args.profile)
+    times, flow_index, sizes = merge(flows)
+    payload_byte = args.message.encode()[:1] or b"x"
+    templates = {}
+    for i, flow in enumerate(flows):
+        src_mac = flow["src_mac"] or args.src_mac
+        src_ip = flow["src_ip"] or args.src_ip
+        for size in set(sizes[flow_index == i].tolist()):
+            templates[(i, size)] = FlowTemplate(flow, src_mac, flow["dst_mac"], src_ip, flow["dst_ip"],
+                                                payload_byte * (size - header_len(flow)), dport=flow["dport"])
+        print(f"{flow['name']}: VID {flow['vid']}, PCP {flow['pcp']}, {int((flow_index == i).sum())} frames")
+
+    start = time.perf_counter()
+    start_ns = int(args.start * 1e9)
+    divisor = 1000 if args.microseconds else 1
+    nbytes = int(sizes.sum())
+    with PcapWriter(args.output, chunk_size=args.chunk_mb << 20, nanoseconds=not args.microseconds) as writer:
+        write = writer.write
+        for seq, (ts, i, size) in enumerate(zip(times.tolist(), flow_index.tolist(), sizes.tolist())):
+            write((start_ns + ts) // divisor, templates[(i, size)].patch(seq, 49152 + (seq & 16383)))
+        count = writer.count
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {count} frames, {nbytes} bytes to {args.output} in {elapsed:.2f} s "
+          f"({count / elapsed if elapsed else 0:.0f} frames/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthesize PSFP test traffic to a pcap file')
+    parser.add_argument('--output', help='Output pcap file',
+                        type=str, action="store", required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--flow', help='Spec "<flow_types>:<key>=<value>,..." as in gen_load.py (repeatable)',
+                        action="append")
+    source.add_argument('--profile', help='Traffic profile file (see traffic_profile.py)',
+                        type=str, action="store")
+    parser.add_argument('--rate', help='Default spec rate in packets/s',
+                        type=float, action="store", required=False, default=1000.0)
+    parser.add_argument('--size', help='Default frame size distribution',
+                        type=str, action="store", required=False, default="542")
+    parser.add_argument('--duration', help='Default spec duration in virtual seconds',
+                        type=float, action="store", required=False, default=10.0)
+    parser.add_argument('--start', help='Virtual start time (epoch seconds)',
+                        type=float, action="store", required=False, default=0.0)
+    parser.add_argument('--poisson', help='Poisson arrivals instead of constant bit rate',
+                        action="store_true")
+    parser.add_argument('--microseconds', help='Write a microsecond pcap instead of a nanosecond one',
+                        action="store_true")
+    parser.add_argument('--src-mac', help='Source MAC address',
+                        type=str, action="store", required=False, default='08:00:00:00:01:11')
+    parser.add_argument('--dst-mac', help='Destination MAC address',
+                        type=str, action="store", required=False, default=DEFAULT_DST_MAC)
+    parser.add_argument('--src-ip', help='Source IPv4 address',
+                        type=str, action="store", required=False, default='10.0.1.1')
+    parser.add_argument('--dst-ip', help='Destination IPv4 address',
+                        type=str, action="store", required=False, default='10.0.2.2')
+    parser.add_argument('--message', help='Payload filler (first character is used)',
+                        type=str, action="store", required=False, default="x")
+    parser.add_argument('--seed', help='Seed for the frame sizes and Poisson arrivals',
+                        type=int, action="store", required=False, default=1)
+    parser.add_argument('--chunk-mb', help='Write buffer size in MiB',
+                        type=int, action="store", required=False, default=16)
+    args = parser.parse_args()
+
+    if args.profile:
+        write_profile(args)
+        return
+
+    defaults = {"rate": args.rate, "size": args.size, "duration": args.duration, "count": 0, "cpu": None}
+    try:
+        configs = [parse_flow_spec(spec, defaults) for spec in args.flow]
+    except ValueError as e:
+        parser.error(str(e))
+    for config in configs:
+        if config["rate"] <= 0:
+            parser.error("Offline synthesis needs a rate > 0 for every spec")
+        if not config["count"] and not config["duration"]:
+            parser.error("Every spec needs a count or a duration")
+
+    payload_byte = args.message.encode()[:1] or b"x"
+    templates = {}
+    streams = []
+    for i, config in enumerate(configs):
+        for key in set(size_cycle(config["flows"], config["size"], args.seed + i)):
+            if key not in templates:
+                flow_type, frame_size = key
+                payload = payload_byte * (frame_size - header_len(FLOWS[flow_type]))
+                templates[key] = FlowTemplate(FLOWS[flow_type], args.src_mac, args.dst_mac,
+                                              args.src_ip, args.dst_ip, payload)
+        streams.append(spec_frames(i, config, templates, int(args.start * 1e9), args.poisson, args.seed + i))
+        print(f"Spec {i}: {', '.join(FLOW_NAMES[f] for f in config['flows'])} at {config['rate']} pps, "
+              f"size {config['size']}, {config['count'] or 'no limit on'} packets, "
+              f"{config['duration'] or 'no limit on'} s")
+
+    start = time.perf_counter()
+    nbytes = 0
+    divisor = 1000 if args.microseconds else 1
+    with PcapWriter(args.output, chunk_size=args.chunk_mb << 20, nanoseconds=not args.microseconds) as writer:
+        write = writer.write
+        # (ts, spec index, seq) orders the merge without a key function
+        for seq, (ts_ns, _, _, template) in enumerate(heapq.merge(*streams)):
+            frame = template.patch(seq, 49152 + (seq & 16383))
+            write(ts_ns // divisor, frame)
+            nbytes += len(frame)
+        count = writer.count
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {count} frames, {nbytes} bytes to {args.output} in {elapsed:.2f} s "
+          f"({count / elapsed if elapsed else 0:.0f} frames/s)")
+
+
+if __name__ == '__main__':
+    main()
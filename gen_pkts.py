@@ -6,6 +6,8 @@ import socket
 import sys
 from scapy.all import IP, TCP, UDP, Ether, Dot1Q, get_if_hwaddr, get_if_list, sendp
 
+from pkt_templates import FLOWS
+
 def get_if():
     ifs = get_if_list()
     iface = None
@@ -27,13 +29,7 @@ def main():
     message = sys.argv[2]
     flow_type = sys.argv[3].lower()
 
-    flows = {
-        "1": {"pcp": 5, "vid": 100, "dscp": 46, "ecn": 0, "protocol": 17, "ttl": 64}, # Audio
-        "2": {"pcp": 4, "vid": 200, "dscp": 34, "ecn": 0, "protocol": 17, "ttl": 64}, # Video
-        "3": {"pcp": 0, "vid": 300, "dscp": 0, "ecn": 0, "protocol": 6, "ttl": 128}, # Text
-        "4": {"pcp": 3, "vid": 400, "dscp": 26, "ecn": 0, "protocol": 17, "ttl": 64}, # Streaming
-        "5": {"pcp": 2, "vid": 500, "dscp": 18, "ecn": 0, "protocol": 6, "ttl": 128}, # Varied
-    }
+    flows = FLOWS
 
     if flow_type not in flows:
         print("Invalid flow type. Choose from: 1. audio, 2. video, 3. text, 4. streaming, 5. varied")
@@ -2,13 +2,19 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import argparse
+import contextlib
+import hashlib
+import json
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from time import sleep
 import threading  # Ajout pour thread stream
 
 import grpc
 from google.protobuf import text_format
+from google.rpc import code_pb2, status_pb2
 
 # Import P4Runtime lib from parent utils dir
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
@@ -16,12 +22,175 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../
 import p4runtime_lib.bmv2
 import p4runtime_lib.helper
 from p4runtime_lib.error_utils import printGrpcError
-from p4runtime_lib.switch import ShutdownAllSwitchConnections
+import p4runtime_lib.switch
+from p4runtime_lib.switch import GrpcRequestLogger, IterableQueue, ShutdownAllSwitchConnections
 
-from p4.v1 import p4runtime_pb2
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
 
 from datetime import datetime
 
+from p4runtime_log import p4info_names
+from psfp_runtime import (HYPERPERIOD_SECONDS, TABLE_ENTRIES, TIMESTAMP_BITS, diff_table_entries,
+                          hyperperiod_state_entries, load_runtime_config, revert_updates)
+from runtime_bundle import DEFAULT_CHUNK_UPDATES, build_update, bundle_path, open_bundle
+from shadow_state import ShadowState
+from state_verify import IntendedState, print_report, verify
+from stats_log import StatsWriter
+from stream_api import StreamError, serve_api
+
+# Counters read periodically by main()
+POLLED_COUNTERS = [
+    "IngressImpl.psfp_c.streamFilter_c.overall_counter",
+    "IngressImpl.psfp_c.streamFilter_c.missed_max_sdu_filter_counter",
+    "IngressImpl.psfp_c.streamGate_c.not_passed_gate_counter",
+    "IngressImpl.psfp_c.flowMeter_c.marked_red_counter",
+    "IngressImpl.psfp_c.flowMeter_c.marked_yellow_counter",
+    "IngressImpl.psfp_c.flowMeter_c.marked_green_counter"
+]
+
+# simple_switch_grpc ports given by run_exercise.py, in topology order
+BASE_GRPC_PORT = 50051
+
+# Election ID of a single controller; with several, the highest is primary
+DEFAULT_ELECTION_ID = 1
+# Seconds between two arbitration requests of a backup controller
+TAKEOVER_INTERVAL = 0.5
+# Seconds between two checks of a watched runtime config file
+WATCH_INTERVAL = 0.2
+# Trailing metadata accepted from the switch: a failed Write carries one
+# p4.v1.Error per update, over gRPC's 16 KB default for large batches
+MAX_METADATA_SIZE = 4 << 20
+
+
+class RecordingStub:
+    """
+    P4Runtime stub recording the Writes the switch accepted in the shadow
+    state of its connection (shadow_state.py).
+    """
+
+    def __init__(self, stub, sw):
+        self.stub = stub
+        self.sw = sw
+
+    def __getattr__(self, name):
+        return getattr(self.stub, name)
+
+    def Write(self, request, *args, **kwargs):
+        try:
+            response = self.stub.Write(request, *args, **kwargs)
+        except grpc.RpcError as e:
+            shadow = self.sw.shadow
+            if shadow is not None:
+                failed = failed_updates(e, len(request.updates))
+                if failed is None:
+                    shadow.record_failure()
+                else:
+                    shadow.record(request, failed)
+            raise
+        if self.sw.shadow is not None:
+            self.sw.shadow.record(request)
+        return response
+
+
+class ControllerConnection(p4runtime_lib.bmv2.Bmv2SwitchConnection):
+    """
+    Switch connection arbitrating and writing with its own election ID, so
+    several controllers can share the switch: the one with the highest
+    election ID is primary, the others are backups until it goes away.
+
+    Once this controller installed or took over the pipeline, the entities
+    it writes are mirrored in shadow (shadow_state.ShadowState).
+
+    :param election_id: election ID of this controller (low 64 bits)
+    """
+
+    def __init__(self, election_id=DEFAULT_ELECTION_ID, name=None, address='127.0.0.1:50051', device_id=0,
+                 proto_dump_file=None):
+        self.election_id = election_id
+        self.primary = threading.Event()
+        self.shadow = None
+        # SwitchConnection.__init__, with a channel accepting the error
+        # details of large batches (failed_updates)
+        self.name = name
+        self.address = address
+        self.device_id = device_id
+        self.p4info = None
+        self.channel = grpc.insecure_channel(address, options=[("grpc.max_metadata_size", MAX_METADATA_SIZE)])
+        # Channel of the pre-serialized requests (runtime_bundle.Bundle.send),
+        # which log themselves: the request logger cannot print raw bytes
+        self.raw_channel = self.channel
+        if proto_dump_file is not None:
+            self.channel = grpc.intercept_channel(self.channel, GrpcRequestLogger(proto_dump_file))
+        self.client_stub = RecordingStub(p4runtime_pb2_grpc.P4RuntimeStub(self.channel), self)
+        self.requests_stream = IterableQueue()
+        self.stream_msg_resp = self.client_stub.StreamChannel(iter(self.requests_stream))
+        self.proto_dump_file = proto_dump_file
+        p4runtime_lib.switch.connections.append(self)
+
+    def arbitration_request(self):
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.arbitration.device_id = self.device_id
+        request.arbitration.election_id.high = 0
+        request.arbitration.election_id.low = self.election_id
+        return request
+
+    def update_role(self, arbitration):
+        """
+        Tracks the role given by an arbitration response.
+
+        :return: True when this controller just became primary
+        """
+        was_primary = self.primary.is_set()
+        if arbitration.status.code == code_pb2.OK:
+            self.primary.set()
+        else:
+            self.primary.clear()
+        return self.primary.is_set() and not was_primary
+
+    def MasterArbitrationUpdate(self, dry_run=False, **kwargs):
+        request = self.arbitration_request()
+        if dry_run:
+            print("P4Runtime MasterArbitrationUpdate: ", request)
+            return None
+        self.requests_stream.put(request)
+        for item in self.stream_msg_resp:
+            if item.HasField('arbitration'):
+                self.update_role(item.arbitration)
+            return item
+
+    def SetForwardingPipelineConfig(self, p4info, dry_run=False, cookie=None, **kwargs):
+        device_config = self.buildDeviceConfig(**kwargs)
+        request = p4runtime_pb2.SetForwardingPipelineConfigRequest()
+        request.election_id.low = self.election_id
+        request.device_id = self.device_id
+        config = request.config
+        config.p4info.CopyFrom(p4info)
+        config.p4_device_config = device_config.SerializeToString()
+        if cookie is not None:
+            config.cookie.cookie = cookie
+        request.action = p4runtime_pb2.SetForwardingPipelineConfigRequest.VERIFY_AND_COMMIT
+        if dry_run:
+            print("P4Runtime SetForwardingPipelineConfig:", request)
+        else:
+            self.client_stub.SetForwardingPipelineConfig(request)
+            self.shadow = ShadowState(p4info, self)
+
+    def WriteTableEntry(self, table_entry, dry_run=False):
+        request = p4runtime_pb2.WriteRequest()
+        request.device_id = self.device_id
+        request.election_id.low = self.election_id
+        update = request.updates.add()
+        if table_entry.is_default_action:
+            update.type = p4runtime_pb2.Update.MODIFY
+        else:
+            update.type = p4runtime_pb2.Update.INSERT
+        update.entity.table_entry.CopyFrom(table_entry)
+        if dry_run:
+            print("P4Runtime Write:", request)
+        else:
+            self.client_stub.Write(request)
+
+
 def configure_meter(p4info_helper, sw, meter_name, index, cir, cburst, pir, pburst):
     meter_entry = p4runtime_pb2.MeterEntry()
     meter_entry.meter_id = p4info_helper.get_meters_id(meter_name)
@@ -35,7 +204,7 @@ def configure_meter(p4info_helper, sw, meter_name, index, cir, cburst, pir, pbur
 
     request = p4runtime_pb2.WriteRequest()
     request.device_id = sw.device_id
-    request.election_id.low = 1  # or your controller election ID
+    request.election_id.low = sw.election_id
 
     update = request.updates.add()
     update.type = p4runtime_pb2.Update.INSERT
@@ -49,18 +218,19 @@ def configure_meter(p4info_helper, sw, meter_name, index, cir, cburst, pir, pbur
 
 def configure_direct_meter(sw, p4info_helper, meter_name, index, cir, cburst, pir, pburst):
     """
-    Configure a direct_meter attached to a table entry by index.
+    Configure a direct_meter attached to a table entry by index: the entry
+    of the meter's table whose match field is index (the flow_meter_instance
+    entry of a flow meter ID), which must be installed.
+
+    :raise grpc.RpcError: the write failed
     """
+    meter = p4info_helper.get("direct_meters", name=meter_name)
+    table = p4info_helper.get("tables", id=meter.direct_table_id)
+    table_entry = p4info_helper.buildTableEntry(table_name=table.preamble.name,
+                                                match_fields={table.match_fields[0].name: index})
 
-    try:
-        meter_id = p4info_helper.get_meters_id(meter_name)
-    except Exception as e:
-        print(f"Erreur récupération meter_id pour {meter_name} : {e}")
-        return
-    
-    meter_entry = p4runtime_pb2.MeterEntry()
-    meter_entry.meter_id = meter_id
-    meter_entry.index.index = index
+    meter_entry = p4runtime_pb2.DirectMeterEntry()
+    meter_entry.table_entry.CopyFrom(table_entry)
 
     # Define meter bands (CIR/CBS and PIR/PBS)
     meter_entry.config.cir = cir         # Committed Information Rate (bytes/sec)
@@ -70,606 +240,35 @@ def configure_direct_meter(sw, p4info_helper, meter_name, index, cir, cburst, pi
 
     request = p4runtime_pb2.WriteRequest()
     request.device_id = sw.device_id
-    request.election_id.low = 1  # The primary controller
+    request.election_id.low = sw.election_id
 
     update = request.updates.add()
-    update.type = p4runtime_pb2.Update.INSERT
-    update.entity.meter_entry.CopyFrom(meter_entry)
+    # Direct resources exist with their table entry: they are only modified
+    update.type = p4runtime_pb2.Update.MODIFY
+    update.entity.direct_meter_entry.CopyFrom(meter_entry)
 
-    try:
-        sw.client_stub.Write(request)
-        print(f"Mise à jour du meter index {index} réussie.")
-    except grpc.RpcError as e:
-        print(f"Erreur d’écriture du meter index {index} : {e}")
+    sw.client_stub.Write(request)
+    print(f"Mise à jour du meter index {index} réussie.")
 
 def read_meter(p4info_helper, sw, meter_name, index):
+    if sw.shadow is not None:
+        meter = sw.shadow.meter(meter_name, index)
+        print(f"{meter_name}[{index}]: " + (f"cir={meter.cir} cburst={meter.cburst} pir={meter.pir} "
+                                            f"pburst={meter.pburst}" if meter else "not configured"))
+        return
     meter_id = p4info_helper.get_meters_id(meter_name)
     for response in sw.ReadMeterEntries(meter_id, index):
         print(response)
 
 
-def writeTableRules(p4info_helper, sw):
+def writeTableRules(p4info_helper, sw, table_entries=TABLE_ENTRIES):
     """
-    Installs table entries from s1-runtime.json for the sdn-psfp.p4 program.
+    Installs the table entries of psfp_runtime.TABLE_ENTRIES for the sdn-psfp.p4 program.
 
     :param p4info_helper: the P4Info helper
     :param sw: the switch connection
+    :param table_entries: entries to install (s1-runtime.json format)
     """
-    # Table entries from s1-runtime.json
-    table_entries = [
-        # Default action for ipv4_c.ipv4
-        {
-            "table": "IngressImpl.ipv4_c.ipv4",
-            "default_action": True,
-            "action_name": "IngressImpl.ipv4_c.drop",
-            "action_params": {}
-        },
-        # IPv4 forwarding rule for 10.0.1.1
-        {
-            "table": "IngressImpl.ipv4_c.ipv4",
-            "match": {
-                "hdr.ipv4.dstAddr": ["10.0.1.1", 32]
-            },
-            "action_name": "IngressImpl.ipv4_c.ipv4_forward",
-            "action_params": {
-                "eth_dst_addr": "08:00:00:00:01:11",
-                "port": 1
-            }
-        },
-        # IPv4 forwarding rule for 10.0.2.2
-        {
-            "table": "IngressImpl.ipv4_c.ipv4",
-            "match": {
-                "hdr.ipv4.dstAddr": ["10.0.2.2", 32]
-            },
-            "action_name": "IngressImpl.ipv4_c.ipv4_forward",
-            "action_params": {
-                "eth_dst_addr": "08:00:00:00:02:22",
-                "port": 2
-            }
-        },
-        ############################### Stream ID rules ###############################
-        # Assigning stream handles based on Ethernet destination address and VLAN ID
-        ## Voice stream (stream_handle 1)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_id",
-            "match": {
-                "hdr.ethernet.dst_addr": "08:00:00:00:02:22",
-                "hdr.eth_802_1q.vid": 1
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_stream_handle",
-            "action_params": {
-                "stream_handle": 1,
-                "active": 1,
-                "stream_blocked_due_to_oversize_frame_enable": 0
-            }
-        },
-        ## Video stream (stream_handle 2)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_id",
-            "match": {
-                "hdr.ethernet.dst_addr": "08:00:00:00:02:22",
-                "hdr.eth_802_1q.vid": 2
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_stream_handle",
-            "action_params": {
-                "stream_handle": 2,
-                "active": 1, # Stream identification is active
-                "stream_blocked_due_to_oversize_frame_enable": 0
-            }
-        },
-        ## Data (Text) stream (stream_handle 3)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_id",
-            "match": {
-                "hdr.ethernet.dst_addr": "08:00:00:00:02:22",
-                "hdr.eth_802_1q.vid": 3
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_stream_handle",
-            "action_params": {
-                "stream_handle": 3,
-                "active": 0,  # Stream identification is inactive
-                "stream_blocked_due_to_oversize_frame_enable": 1
-            }
-        },
-        ## Streaming service Stream (stream_handle 4)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_id",
-            "match": {
-                "hdr.ethernet.dst_addr": "08:00:00:00:01:11",
-                "hdr.eth_802_1q.vid": 4
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_stream_handle",
-            "action_params": {
-                "stream_handle": 4,
-                "active": 1,
-                "stream_blocked_due_to_oversize_frame_enable": 0
-            }
-        },
-        ## Varied Services Stream (stream_handle 5)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_id",
-            "match": {
-                "hdr.ethernet.dst_addr": "08:00:00:00:01:11",
-                "hdr.eth_802_1q.vid": 5
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_stream_handle",
-            "action_params": {
-                "stream_handle": 5,
-                "active": 0,  # Stream identification is inactive
-                "stream_blocked_due_to_oversize_frame_enable": 1
-            }
-        },
-        ############################### Stream filter instance rules ###############################
-        # Assigning stream gates and flow meters based on stream handles
-        # Stream handle 1 (Audio)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 1
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_gate_and_meter",
-            "action_params": {
-                "stream_gate_id": 1,
-                "flow_meter_instance_id": 1,
-                "gate_closed_due_to_invalid_rx_enable": 1,
-                "gate_closed_due_to_octets_exceeded_enable": 1
-            }
-        },
-        # Stream handle 2 (Video)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 2
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_gate_and_meter",
-            "action_params": {
-                "stream_gate_id": 2,
-                "flow_meter_instance_id": 2,
-                "gate_closed_due_to_invalid_rx_enable": 1,
-                "gate_closed_due_to_octets_exceeded_enable": 0
-            }
-        },
-        # Stream handle 3 (Data/Text)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 3
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_gate_and_meter",
-            "action_params": {
-                "stream_gate_id": 3,
-                "flow_meter_instance_id": 1,
-                "gate_closed_due_to_invalid_rx_enable": 0,
-                "gate_closed_due_to_octets_exceeded_enable": 1
-            }
-        },
-        # Stream handle 4 (Streaming service)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 4
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_gate_and_meter",
-            "action_params": {
-                "stream_gate_id": 4,
-                "flow_meter_instance_id": 2,
-                "gate_closed_due_to_invalid_rx_enable": 0,
-                "gate_closed_due_to_octets_exceeded_enable": 0
-            }
-        },
-        # Stream handle 5 (Varied services)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 5
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_gate_and_meter",
-            "action_params": {
-                "stream_gate_id": 1,
-                "flow_meter_instance_id": 1,
-                "gate_closed_due_to_invalid_rx_enable": 1,
-                "gate_closed_due_to_octets_exceeded_enable": 1
-            }
-        },
-        ############################# Stream ID active rules #############################
-        # Audio stream (stream_handle 1)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_id_active",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 1
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.overwrite_stream_active",
-            "action_params": {
-                "eth_dst_addr": "08:00:00:00:02:22",
-                "vid": 1,
-                "pcp": 5
-            }
-        },
-        # Video stream (stream_handle 2)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_id_active",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 2
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.overwrite_stream_active",
-            "action_params": {
-                "eth_dst_addr": "08:00:00:00:02:22",
-                "vid": 2,
-                "pcp": 4
-            }
-        },
-        # Data (Text) stream (stream_handle 3)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_id_active",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 3
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.overwrite_stream_active",
-            "action_params": {
-                "eth_dst_addr": "08:00:00:00:02:22",
-                "vid": 3,
-                "pcp": 0
-            }
-        },
-        # Streaming service Stream (stream_handle 4)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_id_active",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 4
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.overwrite_stream_active",
-            "action_params": {
-                "eth_dst_addr": "08:00:00:00:01:11",
-                "vid": 4,
-                "pcp": 3
-            }
-        },
-        # Varied Services Stream (stream_handle 5)
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.stream_id_active",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 5
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.overwrite_stream_active",
-            "action_params": {
-                "eth_dst_addr": "08:00:00:00:01:11",
-                "vid": 5,
-                "pcp": 2
-            }
-        },
-        ############################# Max SDU filter rules (TERNARY and RANGE) #############################
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 1,
-                "hdr.eth_802_1q.pcp": (5, 0x7),  # TERNARY: value, mask # PCP 5 for video
-                "std_md.packet_length": (1, 1500)  # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.none",
-            "action_params": {},
-            "priority": 100
-        },
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 2,
-                "hdr.eth_802_1q.pcp": (4, 0x7), # PCP 4 for video
-                "std_md.packet_length": (1, 1400)
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.none",
-            "action_params": {},
-            "priority": 99
-        },
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 3,
-                "hdr.eth_802_1q.pcp": (0, 0x7), # PCP 0 for data (text)
-                "std_md.packet_length": (1, 1250)
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.none",
-            "action_params": {},
-            "priority": 98
-        },
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 4,
-                "hdr.eth_802_1q.pcp": (3, 0x7), # PCP 3 for streaming service
-                "std_md.packet_length": (1, 1490)
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.none",
-            "action_params": {},
-            "priority": 97
-        },
-        {
-            "table": "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_handle": 5,
-                "hdr.eth_802_1q.pcp": (2, 0x7), # PCP 2 for varied services
-                "std_md.packet_length": (1, 1500)
-            },
-            "action_name": "IngressImpl.psfp_c.streamFilter_c.none",
-            "action_params": {},
-            "priority": 96
-        },
-        ############################# Stream gate instance rules #############################
-        # Assigning inetrval specifications to the frame based on stream gate ID and time difference (arrival time relative to the hyperperiod)
-        # Interval 1 for stream gate ID 1 ([0, 2000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 1,
-                "meta.ingress_md.diff_ts": (0, 2000000) # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 0,
-                "ipv": 2,
-                "interval_identifier": 1,
-                "max_octects_interval": 180000
-            },
-            "priority": 99
-        },
-        # Interval 2 for stream gate ID 1 ([2000000, 8000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 1,
-                "meta.ingress_md.diff_ts": (2000000, 8000000)  # RANGE: min, max , Time in microseconds
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 1,
-                "ipv": 2,
-                "interval_identifier": 2,
-                "max_octects_interval": 0
-            },
-            "priority": 98
-        },
-        # Interval 3 for stream gate ID 1 ([8000000, 16000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 1,
-                "meta.ingress_md.diff_ts": (8000000, 16000000)  # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 0,
-                "ipv": 2,
-                "interval_identifier": 3,
-                "max_octects_interval": 300000
-            },
-            "priority": 97
-        },
-        # Interval 4 for stream gate ID 1 ([16000000, 20000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 1,
-                "meta.ingress_md.diff_ts": (16000000, 20000000)
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 1,
-                "ipv": 2,
-                "interval_identifier": 4,
-                "max_octects_interval": 0
-            },
-            "priority": 96
-        },
-        # Interval 1 for stream gate ID 2 ([0, 6000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 2,
-                "meta.ingress_md.diff_ts": (0, 6000000)  # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 0,
-                "ipv": 9,
-                "interval_identifier": 1,
-                "max_octects_interval": 55000
-            },
-            "priority": 100
-        },
-        # Interval 2 for stream gate ID 2 ([6000000, 10000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 2,
-                "meta.ingress_md.diff_ts": (6000000, 10000000)  # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 1,
-                "ipv": 9,
-                "interval_identifier": 2,
-                "max_octects_interval": 0
-            },
-            "priority": 99
-        },
-        # Interval 3 for stream gate ID 2 ([10000000, 16000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 2,
-                "meta.ingress_md.diff_ts": (10000000, 16000000)  # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 0,
-                "ipv": 9,
-                "interval_identifier": 3,
-                "max_octects_interval": 150000
-            },
-            "priority": 98
-        },
-        # Interval 1 for stream gate ID 3 ([0, 2000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 3,
-                "meta.ingress_md.diff_ts": (0, 2000000)
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 1,
-                "ipv": 12,
-                "interval_identifier": 1,
-                "max_octects_interval": 0
-            },
-            "priority": 99
-        },
-        # Interval 2 for stream gate ID 3 ([2000000, 12000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 3,
-                "meta.ingress_md.diff_ts": (2000000, 12000000)  # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 0,
-                "ipv": 12,
-                "interval_identifier": 2,
-                "max_octects_interval": 40000
-            },
-            "priority": 98
-        },
-        # Interval 3 for stream gate ID 3 ([12000000, 14000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 3,
-                "meta.ingress_md.diff_ts": (12000000, 14000000)  # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 1,
-                "ipv": 12,
-                "interval_identifier": 3,
-                "max_octects_interval": 0
-            },
-            "priority": 97
-        },
-        # Interval 4 for stream gate ID 3 ([14000000, 18000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 3,
-                "meta.ingress_md.diff_ts": (14000000, 18000000)  # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 0,
-                "ipv": 12,
-                "interval_identifier": 4,
-                "max_octects_interval": 260000
-            },
-            "priority": 96
-        },
-        # Interval 5 for stream gate ID 3 ([18000000, 22000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 3,
-                "meta.ingress_md.diff_ts": (18000000, 22000000)  # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 1,
-                "ipv": 12,
-                "interval_identifier": 5,
-                "max_octects_interval": 0
-            },
-            "priority": 95
-        },
-        # Interval 1 for stream gate ID 4 ([0, 10000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 4,
-                "meta.ingress_md.diff_ts": (0, 10000000)  # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 0,
-                "ipv": 12,
-                "interval_identifier": 1,
-                "max_octects_interval": 100000
-            },
-            "priority": 101
-        },
-        # Interval 2 for stream gate ID 4 ([10000000, 20000000 (microseconds)])
-        {
-            "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.stream_gate_id": 4,
-                "meta.ingress_md.diff_ts": (10000000, 20000000)  # RANGE: min, max
-            },
-            "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
-            "action_params": {
-                "gate_state": 1,
-                "ipv": 12,
-                "interval_identifier": 2,
-                "max_octects_interval": 0
-            },
-            "priority": 100
-        },
-        ############################# Flow meter config rules #############################
-        # Assigning flow meter configurations based on flow meter instance IDs
-        # Flow meter instance ID 1
-        {
-            "table": "IngressImpl.psfp_c.flowMeter_c.flow_meter_config",
-            "match": {
-                "meta.ingress_md.stream_filter.flow_meter_instance_id": 1
-            },
-            "action_name": "IngressImpl.psfp_c.flowMeter_c.set_flow_meter_config",
-            "action_params": {
-                "dropOnYellow": 1,
-                "markAllFramesRedEnable": 1,
-                "colorAware": 1
-            }
-        },
-        # Flow meter instance ID 2
-        {
-            "table": "IngressImpl.psfp_c.flowMeter_c.flow_meter_config",
-            "match": {
-                "meta.ingress_md.stream_filter.flow_meter_instance_id": 2
-            },
-            "action_name": "IngressImpl.psfp_c.flowMeter_c.set_flow_meter_config",
-            "action_params": {
-                "dropOnYellow": 1,
-                "markAllFramesRedEnable": 0,
-                "colorAware": 1
-            }
-        },
-        ############################# Flow meter instance rules #############################
-        # Applying flow meter instances coloring based on stream filter instance IDs
-        # Flow meter instance ID 1 (used by stream handle 1, 3 and 5)
-        {
-            "table": "IngressImpl.psfp_c.flowMeter_c.flow_meter_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.flow_meter_instance_id": 1
-            },
-            "action_name": "IngressImpl.psfp_c.flowMeter_c.set_color_direct",
-            "action_params": {}
-        },
-        # Flow meter instance ID 2 (used by stream handle 2 and 4)
-        {
-            "table": "IngressImpl.psfp_c.flowMeter_c.flow_meter_instance",
-            "match": {
-                "meta.ingress_md.stream_filter.flow_meter_instance_id": 2
-            },
-            "action_name": "IngressImpl.psfp_c.flowMeter_c.set_color_direct",
-            "action_params": {}
-        }
-    ]
-
     for entry in table_entries:
         table_entry = p4info_helper.buildTableEntry(
             table_name=entry["table"],
@@ -682,6 +281,168 @@ def writeTableRules(p4info_helper, sw):
         sw.WriteTableEntry(table_entry)
         print(f"Installed rule on {sw.name} for table {entry['table']}")
 
+def write_table_entries(p4info_helper, sw, config):
+    """
+    Installs the table entries of a runtime configuration, from its
+    precompiled bundle (runtime_bundle.py, config["bundle"]) when it matches
+    the p4info and the entries, one entry at a time otherwise.
+
+    :param config: runtime configuration (psfp_runtime.load_runtime_config)
+    """
+    bundle, reason = open_bundle(config.get("bundle"), p4info_helper.p4info, config["table_entries"])
+    if bundle is None:
+        if reason:
+            print(f"Not using the bundle for {sw.name}: {reason}")
+        writeTableRules(p4info_helper, sw, config["table_entries"])
+        return
+    try:
+        bundle.send(sw)
+        print(f"Installed {bundle.updates()} rules on {sw.name} from {config['bundle']} "
+              f"({len(bundle.chunks)} writes)")
+    finally:
+        bundle.close()
+
+def failed_updates(error, count):
+    """
+    Indices of the updates a Write rejected, from the p4.v1.Error of every
+    update in the status details, or None when the switch sent none.
+
+    :param error: the grpc.RpcError of the Write
+    :param count: number of updates in the WriteRequest
+    """
+    for key, value in error.trailing_metadata() or ():
+        if key != "grpc-status-details-bin":
+            continue
+        details = status_pb2.Status.FromString(value).details
+        if len(details) != count:
+            return None
+        failed = set()
+        for index, detail in enumerate(details):
+            update_error = p4runtime_pb2.Error()
+            if not detail.Unpack(update_error) or update_error.canonical_code != code_pb2.OK:
+                failed.add(index)
+        return failed
+    return None
+
+def write_table_updates(p4info_helper, sw, updates, applied_entries=None, chunk_updates=DEFAULT_CHUNK_UPDATES):
+    """
+    Writes table entry updates in batched WriteRequests, in their order.
+
+    BMv2 applies the updates of a WriteRequest it can and reports the
+    others (CONTINUE_ON_ERROR, the only atomicity it implements), so with
+    applied_entries a failed write is rolled back here: the updates that
+    went through are reverted, last first, before the error is raised.
+
+    :param updates: list of (update type, entry) from psfp_runtime.diff_table_entries
+    :param applied_entries: entries installed before the updates, restored on failure
+    :param chunk_updates: updates per WriteRequest
+    :raise grpc.RpcError: a write failed
+    """
+    for start in range(0, len(updates), chunk_updates):
+        chunk = updates[start:start + chunk_updates]
+        request = p4runtime_pb2.WriteRequest()
+        request.device_id = sw.device_id
+        request.election_id.low = sw.election_id
+        for update_type, entry in chunk:
+            request.updates.append(build_update(p4info_helper, entry, update_type))
+        try:
+            sw.client_stub.Write(request)
+        except grpc.RpcError as e:
+            if applied_entries is None:
+                raise
+            failed = failed_updates(e, len(chunk))
+            if failed is None:
+                print(f"Write to {sw.name} failed without per-update errors ({e.code().name}): "
+                      f"assuming all {len(chunk)} updates of the batch went through")
+            # Without per-update errors, every update may have gone through
+            done = updates[:start] + [update for i, update in enumerate(chunk) if failed is None or i not in failed]
+            reverts = revert_updates(applied_entries, done)
+            print(f"Write to {sw.name} failed, rolling back {len(reverts)} updates")
+            try:
+                write_table_updates(p4info_helper, sw, reverts, chunk_updates=chunk_updates)
+            except grpc.RpcError as rollback_error:
+                if failed is not None:
+                    print(f"Rolling back {sw.name} failed:")
+                    printGrpcError(rollback_error)
+            raise e
+
+def apply_runtime_config(p4info_helper, sw, applied, config):
+    """
+    Pushes the differences between the applied runtime configuration and a
+    new one, without touching the pipeline: the table entries, with the
+    hyperperiod_state entries of the gates, in batched writes, then the
+    changed meter bands. A failed write rolls back what went through before
+    it is raised, so only a configuration applied completely is counted.
+
+    :param applied: runtime configuration installed on the switch
+    :param config: new runtime configuration, its table entries get the
+                   hyperperiod_state entries (psfp_runtime.hyperperiod_state_entries)
+    :return: number of changes pushed
+    :raise grpc.RpcError: a write failed
+    """
+    config["table_entries"] = hyperperiod_state_entries(config["table_entries"], config["hyperperiods"],
+                                                        applied["table_entries"])
+    updates = diff_table_entries(applied["table_entries"], config["table_entries"])
+    if updates:
+        write_table_updates(p4info_helper, sw, updates, applied["table_entries"])
+    meters = [meter for meter in config["meters"] if meter not in applied["meters"]]
+    done = []
+    try:
+        for meter in meters:
+            write_meter_bands(p4info_helper, sw, meter)
+            done.append(meter)
+    except grpc.RpcError:
+        # Undo the bands written, then the table entries: the meters of new
+        # table entries go away with them
+        previous = {(meter["meter"], meter["index"]): meter for meter in applied["meters"]}
+        reverts = revert_updates(applied["table_entries"], updates)
+        print(f"Writing meter bands to {sw.name} failed, rolling back {len(done)} meters and {len(reverts)} updates")
+        try:
+            for meter in reversed(done):
+                if (meter["meter"], meter["index"]) in previous:
+                    write_meter_bands(p4info_helper, sw, previous[(meter["meter"], meter["index"])])
+            write_table_updates(p4info_helper, sw, reverts)
+        except grpc.RpcError as rollback_error:
+            print(f"Rolling back {sw.name} failed:")
+            printGrpcError(rollback_error)
+        raise
+    return len(updates) + len(done)
+
+def write_meter_bands(p4info_helper, sw, meter):
+    """
+    :param meter: meter bands as in the "meters" of a runtime configuration
+    :raise grpc.RpcError: the write failed
+    """
+    configure_direct_meter(sw, p4info_helper, meter["meter"], index=meter["index"], cir=meter["cir"],
+                           cburst=meter["cburst"], pir=meter["pir"], pburst=meter["pburst"])
+
+def watch_runtime_config(path, on_change, interval=WATCH_INTERVAL):
+    """
+    Calls on_change(path, config) with the new configuration every time a
+    runtime JSON file changes. A file that does not parse (still being
+    written) is skipped until its next change.
+    """
+    def stamp():
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    last = stamp()
+    while True:
+        sleep(interval)
+        current = stamp()
+        if current is None or current == last:
+            continue
+        last = current
+        try:
+            config = load_runtime_config(path)
+        except (ValueError, KeyError, AttributeError) as e:
+            print(f"Not reloading {path}: {e}")
+            continue
+        on_change(path, config)
+
 def get_register_width(p4info_helper, register_name):
     try:
         reg = next(r for r in p4info_helper.p4info.registers if r.preamble.name == register_name)
@@ -697,7 +458,7 @@ def get_register_width(p4info_helper, register_name):
 def write_register(sw, p4info_helper, register_name, index, value):
     request = p4runtime_pb2.WriteRequest()
     request.device_id = sw.device_id
-    request.election_id.low = 1
+    request.election_id.low = sw.election_id
 
     # Resolve register and width from P4Info
     try:
@@ -749,8 +510,11 @@ def write_register(sw, p4info_helper, register_name, index, value):
 
 def upsert_hyperperiod_state(sw, p4info_helper, gate_id, hyperperiod_us, last_us):
     """
-    Insert-or-modify the hyperperiod_state table for a given stream gate.
-    Stores values in microseconds (switch timebase).
+    Modify the hyperperiod_state entry of a given stream gate, which must be
+    installed (install() inserts one per gate). Stores values in
+    microseconds (switch timebase).
+
+    :raise grpc.RpcError: the write failed
     """
     te = p4info_helper.buildTableEntry(
         table_name="IngressImpl.psfp_c.hyperperiod_state",
@@ -765,35 +529,29 @@ def upsert_hyperperiod_state(sw, p4info_helper, gate_id, hyperperiod_us, last_us
 
     req = p4runtime_pb2.WriteRequest()
     req.device_id = sw.device_id
-    req.election_id.low = 1
+    req.election_id.low = sw.election_id
     up = req.updates.add()
-    up.type = p4runtime_pb2.Update.MODIFY  # MODIFY works for insert-or-replace on BMv2
+    up.type = p4runtime_pb2.Update.MODIFY
     up.entity.table_entry.CopyFrom(te)
 
-    try:
-        sw.client_stub.Write(req)
-        print(f"[HP STATE] gate {gate_id}: hyperperiod={hyperperiod_us}µs last={last_us}µs")
-    except grpc.RpcError as e:
-        print(f"[HP STATE] Failed to upsert for gate {gate_id}: {e}")
+    sw.client_stub.Write(req)
+    print(f"[HP STATE] gate {gate_id}: hyperperiod={hyperperiod_us}µs last={last_us}µs")
 
 
-def program_hyperperiods(sw, p4info_helper):
+def program_hyperperiods(sw, p4info_helper, hyperperiods=HYPERPERIOD_SECONDS):
     """
     Program initial hyperperiod state in SECONDS (converted to µs here).
+
+    :param hyperperiods: {gate_id: seconds}
     """
     SECONDS_TO_US = 1_000_000
-    ts_us = int(datetime.now().timestamp() * SECONDS_TO_US) & ((1 << 48) - 1)
-
-    # Configure in SECONDS (nice & readable)
-    configs_seconds = {
-        1: 20,   # Stream Gate 1: 20 seconds
-        2: 16,    # Stream Gate 2: 16 seconds
-        3: 26,   # Stream Gate 3: 23 seconds
-        4: 20    # Stream Gate 4: 20 seconds
-    }
+    epoch_us = int(datetime.now().timestamp() * SECONDS_TO_US)
+    ts_us = epoch_us & ((1 << 48) - 1)
 
-    for gate_id, secs in configs_seconds.items():
+    # Configured in SECONDS in psfp_runtime.HYPERPERIOD_SECONDS
+    for gate_id, secs in hyperperiods.items():
         upsert_hyperperiod_state(sw, p4info_helper, gate_id, secs * SECONDS_TO_US, ts_us)
+    print(f"Hyperperiod anchor (last_hyperperiod): {ts_us} µs (epoch {epoch_us} µs)")
 
 """
 def populate_hyperperiod_registers(sw, p4info_helper):
@@ -817,30 +575,35 @@ def populate_hyperperiod_registers(sw, p4info_helper):
         write_register(sw, p4info_helper, "IngressImpl.psfp_c.last_hyperperiod_reg", gate_id, ts_micro)
         write_register(sw, p4info_helper, "IngressImpl.psfp_c.hyperperiod_done_reg", gate_id, 0)
 """
-def writeRegisters(p4info_helper, sw):
+def writeRegisters(p4info_helper, sw, hyperperiods=HYPERPERIOD_SECONDS):
     """
     Writes to registers for hyperperiod configuration.
 
     :param sw: the switch connection
     :param p4info_helper: the P4Info helper
+    :param hyperperiods: {gate_id: seconds}
     """
     # Populate hyperperiod configuration registers
-    program_hyperperiods(sw, p4info_helper)
+    program_hyperperiods(sw, p4info_helper, hyperperiods)
     
 
 def readTableRules(p4info_helper, sw):
     """
-    Reads the table entries from all tables on the switch.
+    Prints the table entries of all tables on the switch, from the shadow
+    state of the connection; the switch is only read when there is none
+    (backup controller) or it went stale.
 
     :param p4info_helper: the P4Info helper
     :param sw: the switch connection
     """
     print(f'\n----- Reading tables rules for {sw.name} -----')
-    for response in sw.ReadTableEntries():
-        for entity in response.entities:
-            entry = entity.table_entry
-            print(entry)
-            print('-----')
+    if sw.shadow is None:
+        entries = [entity.table_entry for response in sw.ReadTableEntries() for entity in response.entities]
+    else:
+        entries = sw.shadow.table_entries()
+    for entry in entries:
+        print(entry)
+        print('-----')
 
 def printCounter(p4info_helper, sw, counter_name, index):
     """
@@ -850,11 +613,34 @@ def printCounter(p4info_helper, sw, counter_name, index):
     :param sw: the switch connection
     :param counter_name: the name of the counter from the P4 program
     :param index: the counter index
+    :return: list of (index, packet count, byte count) read
     """
+    values = []
     for response in sw.ReadCounters(p4info_helper.get_counters_id(counter_name), index):
         for entity in response.entities:
             counter = entity.counter_entry
             print(f"{sw.name} {counter_name} {index}: {counter.data.packet_count} packets ({counter.data.byte_count} bytes)")
+            values.append((counter.index.index, counter.data.packet_count, counter.data.byte_count))
+    return values
+
+def log_counters(stats, previous, sw, counter_name, values, now):
+    """
+    Writes "counter" records with the rates since the previous poll, over
+    the time measured between the two reads (a late poll is not a faster
+    stream).
+
+    :param stats: the StatsWriter
+    :param previous: {(counter name, index): (packets, bytes, time.monotonic())} of the previous poll, updated
+    :param values: list of (index, packet count, byte count) from printCounter
+    :param now: time.monotonic() of the read
+    """
+    for index, packets, nbytes in values:
+        last = previous.get((counter_name, index))
+        previous[(counter_name, index)] = (packets, nbytes, now)
+        seconds = now - last[2] if last else 0
+        stats.write("counter", switch=sw.name, counter=counter_name, index=index, packets=packets, bytes=nbytes,
+                    pps=(packets - last[0]) / seconds if seconds > 0 else None,
+                    bps=(nbytes - last[1]) * 8 / seconds if seconds > 0 else None)
 
 def read_direct_counters(p4info_helper, sw, table_name):
     """
@@ -886,150 +672,543 @@ def read_direct_counters(p4info_helper, sw, table_name):
     except grpc.RpcError as e:
         print(f"Error reading direct counter: {e}")
 
-def handle_stream(s1, p4info_helper):
-    print("Initialisation du StreamChannel")
-    def stream_requests():
-        request = p4runtime_pb2.StreamMessageRequest()
-        request.arbitration.device_id = s1.device_id
-        request.arbitration.election_id.high = 0
-        request.arbitration.election_id.low = 1
-        yield request
-        while True:
-            yield p4runtime_pb2.StreamMessageRequest()  # Keep stream alive
-            sleep(1)
+def decode_digest(p4info_helper, digest_name, data):
+    """
+    Decodes the struct members of one digest into {member name: int}.
 
-    stream_channel = s1.client_stub.StreamChannel(stream_requests())
-    print("Arbitration initiale envoyée")
+    Members come in the order of the struct in the p4info type_info.
+
+    :param p4info_helper: the P4Info helper
+    :param digest_name: the digest (struct) name
+    :param data: a P4Data from a DigestList
+    """
+    members = p4info_helper.p4info.type_info.structs[digest_name].members
+    return {member.name: int.from_bytes(field.bitstring, 'big')
+            for member, field in zip(members, data.struct.members)}
+
+def handle_stream(s1, p4info_helper, stats=None, on_primary=None):
+    """
+    Handles the digests received on the switch StreamChannel.
+
+    The stream opened by MasterArbitrationUpdate is reused, so digests are
+    received on the primary stream and acked on it. A backup controller
+    only gets arbitration updates until the primary goes away; digests then
+    come to it without any reprovisioning.
+
+    :param s1: the switch connection (ControllerConnection)
+    :param p4info_helper: the P4Info helper
+    :param stats: StatsWriter receiving a "gate" record per digest
+    :param on_primary: called with the switch connection when this
+                       controller becomes primary
+    """
+    print("Initialisation du StreamChannel")
+    digest_id = p4info_helper.get_digests_id("digest_finished_hyperperiod_t")
     try:
-        for response in stream_channel:
+        for response in s1.stream_msg_resp:
             if response.HasField('arbitration'):
                 print("Arbitration response:", response.arbitration.status)
+                was_primary = s1.primary.is_set()
+                if s1.update_role(response.arbitration):
+                    print(f"{s1.name}: now primary with election ID {s1.election_id}")
+                    if stats:
+                        stats.write("role", switch=s1.name, election_id=s1.election_id, primary=True)
+                    if on_primary:
+                        on_primary(s1)
+                elif was_primary and not s1.primary.is_set():
+                    print(f"{s1.name}: now backup, primary election ID {response.arbitration.election_id.low}")
+                    if stats:
+                        stats.write("role", switch=s1.name, election_id=s1.election_id, primary=False)
             elif response.HasField('digest'):
-                print(f"Raw digest: {response.digest}")
                 digest_list = response.digest
                 print(f"Reçu digest ID: {digest_list.digest_id}")
-                digest_id = p4info_helper.get_digests_id("digest_finished_hyperperiod_t")
                 if digest_list.digest_id != digest_id:
                     print(f"Digest ID {digest_list.digest_id} inconnu, attendu {digest_id}")
                     continue
-                for digest_data in digest_list.list.digests:
-                    struct_members = digest_data.struct.members
-                    print(f"Struct members: {len(struct_members)} fields")
+                for digest_data in digest_list.data:
                     try:
-                        stream_gate_id = int.from_bytes(
-                            next(f.bitstring for f in struct_members if f.field_id == p4info_helper.get_member_id("digest_finished_hyperperiod_t", "stream_gate_id")),
-                            'big'
-                        )
-                        ingress_ts = int.from_bytes(
-                            next(f.bitstring for f in struct_members if f.field_id == p4info_helper.get_member_id("digest_finished_hyperperiod_t", "ingress_ts")),
-                            'big'
-                        )
-                        hyperperiod_ts = int.from_bytes(
-                            next(f.bitstring for f in struct_members if f.field_id == p4info_helper.get_member_id("digest_finished_hyperperiod_t", "hyperperiod_ts")),
-                            'big'
-                        )
-                        last_hyperperiod = int.from_bytes(
-                            next(f.bitstring for f in struct_members if f.field_id == p4info_helper.get_member_id("digest_finished_hyperperiod_t", "last_hyperperiod")),
-                            'big'
-                        )
-                        print(f"Digest data: gate_id={stream_gate_id}, ingress_ts={ingress_ts}, hyperperiod_ts={hyperperiod_ts}, last={last_hyperperiod}")
-                        new_last = last_hyperperiod + hyperperiod_ts
+                        digest = decode_digest(p4info_helper, "digest_finished_hyperperiod_t", digest_data)
+                        stream_gate_id = digest["stream_gate_id"]
+                        print(f"Digest data: gate_id={stream_gate_id}, ingress_ts={digest['ingress_ts']}, "
+                              f"hyperperiod_ts={digest['hyperperiod_ts']}, last={digest['last_hyperperiod']}")
+                        new_last = digest["last_hyperperiod"] + digest["hyperperiod_ts"]
+                        if stats:
+                            stats.write("gate", switch=s1.name, gate_id=stream_gate_id,
+                                        ingress_ts=digest["ingress_ts"], hyperperiod_ts=digest["hyperperiod_ts"],
+                                        last_hyperperiod=digest["last_hyperperiod"], new_last_hyperperiod=new_last)
                         write_register(s1, p4info_helper, "IngressImpl.psfp_c.last_hyperperiod_reg", stream_gate_id, new_last)
                         write_register(s1, p4info_helper, "IngressImpl.psfp_c.period_count", stream_gate_id, 0)
                         write_register(s1, p4info_helper, "IngressImpl.psfp_c.hyperperiod_done_reg", stream_gate_id, 0)
-                        ack = p4runtime_pb2.StreamMessageRequest()
-                        ack.digest_ack.digest_id = digest_list.digest_id
-                        ack.digest_ack.list_id = digest_list.list.list_id
-                        yield ack
-                        print("Digest ack envoyé")
                     except Exception as e:
                         print(f"Erreur traitement digest: {e}")
+                ack = p4runtime_pb2.StreamMessageRequest()
+                ack.digest_ack.digest_id = digest_list.digest_id
+                ack.digest_ack.list_id = digest_list.list_id
+                s1.requests_stream.put(ack)
+                print("Digest ack envoyé")
             else:
                 print("Message stream inconnu:", response)
     except grpc.RpcError as e:
         printGrpcError(e)
 
-# Point d'entrée principal du script
-def main(p4info_file_path, bmv2_file_path):
-    # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+def pipeline_cookie(p4info_helper, bmv2_file_path):
+    """
+    Cookie identifying the P4 program and p4info installed by this controller.
+    """
+    digest = hashlib.sha256(p4info_helper.p4info.SerializeToString(deterministic=True))
+    with open(bmv2_file_path, 'rb') as f:
+        digest.update(f.read())
+    return int.from_bytes(digest.digest()[:8], 'big')
 
+
+def pipeline_installed(sw, cookie):
+    """
+    Whether the switch already runs the pipeline with this cookie.
+    """
+    request = p4runtime_pb2.GetForwardingPipelineConfigRequest()
+    request.device_id = sw.device_id
+    request.response_type = p4runtime_pb2.GetForwardingPipelineConfigRequest.COOKIE_ONLY
     try:
-        # Create a switch connection object for s1
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-
-        # Send master arbitration update message
-        s1.MasterArbitrationUpdate()
-        print("Established as master controller for s1")
-
-        # Install the P4 program on the switch
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                      bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-
-        # Configure the meter
-        # configure_meter(
-        #    p4info_helper, s1,
-        #    "IngressImpl.psfp_c.flowMeter_c.flow_meter",
-        #    index=1,
-        #    cir=100000, cburst=8000,  # CIR 100 kbps, CBS 8 KB
-        #    pir=200000, pburst=16000  # PIR 200 kbps, PBS 16 KB
-        #)
-
-        # Configure Direct Meter
+        response = sw.client_stub.GetForwardingPipelineConfig(request)
+    except grpc.RpcError:
+        return False
+    return response.config.HasField('cookie') and response.config.cookie.cookie == cookie
+
+
+def provision(p4info_helper, sw, bmv2_file_path, config=None):
+    """
+    Takes mastership and installs the P4 program and the PSFP configuration.
+
+    :param p4info_helper: the P4Info helper
+    :param sw: the switch connection
+    :param bmv2_file_path: the BMv2 JSON file
+    :param config: runtime configuration (psfp_runtime.load_runtime_config),
+                   the controller defaults when None
+    """
+    # Send master arbitration update message
+    sw.MasterArbitrationUpdate()
+    print(f"Established as master controller for {sw.name}")
+    install(p4info_helper, sw, bmv2_file_path, config)
+
+
+def take_mastership(p4info_helper, sw, bmv2_file_path, config=None, reprovision=False, lock=None):
+    """
+    Makes a controller that is primary ready to handle the switch.
+
+    A switch already running this pipeline (installed by a previous or
+    failed primary) keeps its tables, registers and gate state: it is only
+    provisioned when its pipeline cookie differs or with reprovision.
+
+    :param lock: held while the switch is provisioned, so a takeover does not
+                 interleave with the configuration changes (runtime watch, API)
+    :return: "provisioned" or "joined"
+    """
+    with lock or contextlib.nullcontext():
+        if not reprovision and pipeline_installed(sw, pipeline_cookie(p4info_helper, bmv2_file_path)):
+            print(f"{sw.name} already runs this pipeline, taking over without reprovisioning")
+            sw.shadow = ShadowState(p4info_helper.p4info)
+            sw.shadow.load(sw)
+            return "joined"
+        install(p4info_helper, sw, bmv2_file_path, config)
+        return "provisioned"
+
+
+def start_switch(p4info_helper, sw, bmv2_file_path, config=None, reprovision=False):
+    """
+    Arbitrates for a switch and, when primary, takes mastership.
+
+    :return: "provisioned", "joined" or "backup"
+    """
+    sw.MasterArbitrationUpdate()
+    if not sw.primary.is_set():
+        print(f"Backup controller for {sw.name} (election ID {sw.election_id})")
+        return "backup"
+    print(f"Established as master controller for {sw.name} (election ID {sw.election_id})")
+    return take_mastership(p4info_helper, sw, bmv2_file_path, config, reprovision)
+
+
+def keep_arbitrating(switches, interval):
+    """
+    Resends the arbitration request of the switches this controller is a
+    backup of, so it takes over within interval seconds of the primary
+    going away even when the switch does not announce it.
+
+    :param switches: list of switch connections (ControllerConnection)
+    """
+    while True:
+        sleep(interval)
+        for sw in switches:
+            if not sw.primary.is_set():
+                sw.requests_stream.put(sw.arbitration_request())
+
+
+def keep_verifying(p4info_helper, switches, configs, config_lock, interval, stats=None):
+    """
+    Compares the table entries of the switches this controller is primary
+    of with their configuration every interval seconds (state_verify.py)
+    and prints the drift.
+
+    :param switches: list of switch connections
+    :param configs: {switch name: runtime configuration}, kept up to date by main()
+    :param config_lock: lock held while the configurations are changed
+    """
+    names = p4info_names(p4info_helper.p4info)
+    intended = {sw.name: IntendedState(p4info_helper) for sw in switches}
+    while True:
+        sleep(interval)
+        for sw in switches:
+            if not sw.primary.is_set():
+                continue
+            # No configuration change between the intended digests and the read
+            with config_lock:
+                state = intended[sw.name]
+                state.load(configs[sw.name]["table_entries"])
+                try:
+                    report, seconds = verify(sw, state, names)
+                except grpc.RpcError as e:
+                    print(f"Verifying {sw.name} failed:")
+                    printGrpcError(e)
+                    continue
+            if report:
+                print_report(sw.name, report, seconds, len(state.tables))
+            if stats:
+                stats.write("drift", switch=sw.name, tables=len(state.tables), drifted=len(report),
+                            missing=sum(len(d["missing"]) for d in report.values()),
+                            extra=sum(len(d["extra"]) for d in report.values()),
+                            modified=sum(len(d["modified"]) for d in report.values()), seconds=seconds)
+
+
+def keep_reading_registers(p4info_helper, switches, interval, stats=None):
+    """
+    Reads every register of the switches every interval seconds
+    (register_reader.py) and prints the gates, streams and meters that
+    became blocked or unblocked.
+
+    :param switches: list of switch connections
+    """
+    # NumPy is only needed with --register-interval
+    from register_reader import RegisterReader
+
+    reader = RegisterReader(p4info_helper.p4info)
+    blocked = {sw.name: {} for sw in switches}
+    while True:
+        sleep(interval)
+        for sw in switches:
+            start = time.perf_counter()
+            try:
+                arrays = reader.read(sw)
+            except grpc.RpcError as e:
+                print(f"Reading the registers of {sw.name} failed:")
+                printGrpcError(e)
+                continue
+            seconds = time.perf_counter() - start
+            for name, array in arrays.items():
+                nonzero = array.nonzero()[0]
+                if name.endswith("_blocked"):
+                    indexes = set(nonzero.tolist())
+                    previous = blocked[sw.name].get(name, set())
+                    if indexes != previous:
+                        print(f"[REG] {sw.name} {name}: blocked {sorted(indexes - previous)}, "
+                              f"unblocked {sorted(previous - indexes)}")
+                    blocked[sw.name][name] = indexes
+                if stats:
+                    stats.write("register", switch=sw.name, register=name, size=len(array), nonzero=len(nonzero),
+                                total=int(array.sum()), max=int(array.max()) if len(array) else 0, seconds=seconds)
+
+
+def install(p4info_helper, sw, bmv2_file_path, config=None):
+    """
+    Installs the P4 program and the PSFP configuration (as primary).
+
+    :param config: runtime configuration (psfp_runtime.load_runtime_config),
+                   the controller defaults when None; its table entries get
+                   the hyperperiod_state entries written
+    """
+    if config is None:
+        config = load_runtime_config()
+
+    # Install the P4 program on the switch
+    sw.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
+                                   bmv2_json_file_path=bmv2_file_path,
+                                   cookie=pipeline_cookie(p4info_helper, bmv2_file_path))
+    print(f"Installed P4 Program using SetForwardingPipelineConfig on {sw.name}")
+
+    # Configure the meter
+    # configure_meter(
+    #    p4info_helper, sw,
+    #    "IngressImpl.psfp_c.flowMeter_c.flow_meter",
+    #    index=1,
+    #    cir=100000, cburst=8000,  # CIR 100 kbps, CBS 8 KB
+    #    pir=200000, pburst=16000  # PIR 200 kbps, PBS 16 KB
+    #)
+
+    # Write table rules
+    table_entries = hyperperiod_state_entries(config["table_entries"], {})
+    write_table_entries(p4info_helper, sw, dict(config, table_entries=table_entries))
+
+    # Hyperperiod state of the gates, anchored now; kept in the configuration
+    # so the next changes are diffed against it
+    epoch_us = int(time.time() * 1_000_000)
+    anchor_us = epoch_us & ((1 << TIMESTAMP_BITS) - 1)
+    hyperperiod_entries = hyperperiod_state_entries([], config["hyperperiods"], anchor_us=anchor_us)
+    write_table_updates(p4info_helper, sw, [("INSERT", entry) for entry in hyperperiod_entries])
+    config["table_entries"] = table_entries + hyperperiod_entries
+    print(f"Hyperperiod anchor (last_hyperperiod): {anchor_us} µs (epoch {epoch_us} µs)")
+
+    # Configure Direct Meter, on the flow_meter_instance entries
+    for meter in config["meters"]:
         configure_direct_meter(
-            s1, p4info_helper,
-            "IngressImpl.psfp_c.flowMeter_c.flow_meter",
-            index=1, cir=100000, 
-            cburst=4096, 
-            pir=200000, pburst=8192
+            sw, p4info_helper,
+            meter["meter"],
+            index=meter["index"], cir=meter["cir"],
+            cburst=meter["cburst"],
+            pir=meter["pir"], pburst=meter["pburst"]
         )
 
-        # Write table rules
-        writeTableRules(p4info_helper, s1)
+def load_topology(topology_file_path, base_port=BASE_GRPC_PORT):
+    """
+    Reads the switches of a Mininet topology (pod-topo/topology.json).
+
+    Switches get the P4Runtime address and device ID run_exercise.py gives
+    them, in the order of the file (127.0.0.1:50051 and device 0 for the
+    first one), unless their entry sets "grpc_address" or "device_id". Their
+    "runtime_json" file, when set, replaces the controller's default
+    configuration.
+
+    :param topology_file_path: the topology JSON file
+    :param base_port: gRPC port of the first switch
+    :return: list of dicts with name, address, device_id and runtime (path or None)
+    """
+    with open(topology_file_path) as f:
+        topology = json.load(f)
+    topology_dir = os.path.dirname(topology_file_path)
+    switches = []
+    for i, (name, params) in enumerate(topology["switches"].items()):
+        runtime = params.get("runtime_json")
+        if runtime and not os.path.exists(runtime):
+            # run_exercise.py paths are relative to the exercise directory
+            runtime = os.path.join(topology_dir, os.path.basename(runtime))
+        switches.append({
+            "name": name,
+            "address": params.get("grpc_address", f"127.0.0.1:{base_port + i}"),
+            "device_id": params.get("device_id", i),
+            "runtime": runtime
+        })
+    return switches
+
+
+def provision_all(p4info_helper, switches, bmv2_file_path, pool, reprovision=False):
+    """
+    Starts (start_switch) all switches concurrently.
 
-        # Write register values
-        writeRegisters(p4info_helper, s1)
+    :param switches: list of (switch connection, runtime configuration)
+    :param pool: the ThreadPoolExecutor running the provisioning
+    :param reprovision: reinstall the pipeline of switches already running it
+    :return: list of (switch connection, runtime configuration) started;
+             the switches that failed are printed and left out
+    """
+    start = time.monotonic()
+    roles = {}
+
+    def timed_provision(sw, config):
+        # Roles are counted by the calling thread, from the results
+        role = start_switch(p4info_helper, sw, bmv2_file_path, config, reprovision)
+        return role, time.monotonic() - start
+
+    futures = {pool.submit(timed_provision, sw, config): (sw, config) for sw, config in switches}
+    provisioned = []
+    slowest = (0.0, None)
+    for future in as_completed(futures):
+        sw, config = futures[future]
+        try:
+            role, elapsed = future.result()
+        except grpc.RpcError as e:
+            print(f"Provisioning {sw.name} failed:")
+            printGrpcError(e)
+            continue
+        roles[role] = roles.get(role, 0) + 1
+        provisioned.append((sw, config))
+        slowest = max(slowest, (elapsed, sw.name))
+    print(f"Started {len(provisioned)}/{len(switches)} switches in {time.monotonic() - start:.2f} s"
+          + (f" (last: {slowest[1]} after {slowest[0]:.2f} s)" if slowest[1] else "")
+          + "".join(f", {count} {role}" for role, count in sorted(roles.items())))
+    return provisioned
+
+
+def poll_counters(p4info_helper, sw):
+    """
+    Reads POLLED_COUNTERS from one switch.
 
-        # Read table entries
-        readTableRules(p4info_helper, s1)
+    :return: list of (counter name, list of (index, packet count, byte count))
+    """
+    return [(counter_name, printCounter(p4info_helper, sw, counter_name, 0)) for counter_name in POLLED_COUNTERS]
 
-        # Lancer thread stream
-        stream_thread = threading.Thread(target=handle_stream, args=(s1, p4info_helper))
-        stream_thread.daemon = True
-        stream_thread.start()
-        print("Thread stream pour digests lancé")
 
-        # Read counters periodically
+# Point d'entrée principal du script
+def main(p4info_file_path, bmv2_file_path, stats_log_path=None, poll_interval=10, topology_file_path=None,
+         workers=None, election_id=DEFAULT_ELECTION_ID, reprovision=False, takeover_interval=TAKEOVER_INTERVAL,
+         runtime_file_path=None, watch=False, api_address=None, verify_interval=None, register_interval=None):
+    """
+    Provisions the switches, then handles their digests and polls their counters.
+
+    :param topology_file_path: topology JSON whose switches are all controlled,
+                               s1 at 127.0.0.1:50051 only when None
+    :param workers: threads provisioning and polling the switches (default: one per switch)
+    :param election_id: election ID of this controller; instances with a
+                        lower one are backups
+    :param reprovision: reinstall the pipeline of switches already running it
+    :param takeover_interval: seconds between two arbitration requests of a backup
+    :param runtime_file_path: runtime JSON of s1 without a topology (default:
+                              the psfp_runtime.py configuration)
+    :param watch: push the changes of the runtime JSON files while running
+    :param api_address: serve the stream provisioning API (stream_api.py) on
+                        this "host:port" or Unix socket path
+    :param verify_interval: seconds between two drift checks of the tables
+                            (state_verify.py), None for none
+    :param register_interval: seconds between two reads of the registers
+                              (register_reader.py), None for none
+    """
+    # Instantiate a P4Runtime helper from the p4info file
+    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+    stats = StatsWriter(stats_log_path, "controller") if stats_log_path else None
+    if topology_file_path:
+        topology = load_topology(topology_file_path)
+    else:
+        topology = [{"name": "s1", "address": f"127.0.0.1:{BASE_GRPC_PORT}", "device_id": 0,
+                     "runtime": runtime_file_path}]
+    pool = ThreadPoolExecutor(max_workers=workers or len(topology), thread_name_prefix="switch")
+
+    try:
+        # Create one switch connection object per switch
+        switches = []
+        for switch in topology:
+            # Controllers sharing a host keep their own request log
+            suffix = "" if election_id == DEFAULT_ELECTION_ID else f"-{election_id}"
+            sw = ControllerConnection(
+                election_id=election_id,
+                name=switch["name"],
+                address=switch["address"],
+                device_id=switch["device_id"],
+                proto_dump_file=f'logs/{switch["name"]}-p4runtime-requests{suffix}.txt')
+            config = load_runtime_config(switch["runtime"])
+            config["bundle"] = bundle_path(switch["runtime"])
+            switches.append((sw, config))
+
+        switches = provision_all(p4info_helper, switches, bmv2_file_path, pool, reprovision)
+        configs = {sw.name: config for sw, config in switches}
+
+        # Serializes the configuration changes of the watchers, the API and
+        # the takeovers of a backup
+        config_lock = threading.Lock()
+
+        def on_primary(sw):
+            # Backup taking over: the intended configuration is already loaded
+            take_mastership(p4info_helper, sw, bmv2_file_path, configs[sw.name], lock=config_lock)
+
+        runtime_files = {switch["name"]: switch["runtime"] for switch in topology}
+
+        def on_runtime_change(path, config):
+            with config_lock:
+                for sw, _ in switches:
+                    if runtime_files[sw.name] != path:
+                        continue
+                    switch_config = dict(config, bundle=configs[sw.name]["bundle"])
+                    if sw.primary.is_set():
+                        start = time.perf_counter()
+                        try:
+                            changes = apply_runtime_config(p4info_helper, sw, configs[sw.name], switch_config)
+                        except grpc.RpcError as e:
+                            print(f"Reloading {path} on {sw.name} failed:")
+                            printGrpcError(e)
+                            continue
+                        print(f"Reloaded {path} on {sw.name}: {changes} changes in "
+                              f"{(time.perf_counter() - start) * 1000:.1f} ms")
+                    # A backup only updates its intended configuration
+                    configs[sw.name] = switch_config
+
+        def stream_transaction(name, apply):
+            sw = next(sw for sw, _ in switches if sw.name == name)
+            with config_lock:
+                if not sw.primary.is_set():
+                    raise StreamError(f"backup controller of {name} (election ID {sw.election_id})", 503)
+                config, result = apply(configs[name])
+                start = time.perf_counter()
+                try:
+                    changes = apply_runtime_config(p4info_helper, sw, configs[name], config)
+                except grpc.RpcError as e:
+                    raise StreamError(f"writing to {name} failed, rolled back: {e.details()}", 502)
+                configs[name] = config
+            return result, changes, time.perf_counter() - start
+
+        if api_address:
+            serve_api(api_address, [sw.name for sw, _ in switches], lambda name: configs[name],
+                      stream_transaction, {table.preamble.name: table.size for table in p4info_helper.p4info.tables})
+            print(f"Stream API on {api_address}")
+
+        if watch:
+            for path in sorted({path for path in runtime_files.values() if path}):
+                threading.Thread(target=watch_runtime_config, args=(path, on_runtime_change),
+                                 name=f"watch-{path}", daemon=True).start()
+                print(f"Watching {path}")
+
+        for sw, config in switches:
+            # Read table entries
+            readTableRules(p4info_helper, sw)
+
+            if stats:
+                for meter in config["meters"]:
+                    stats.write("meter", switch=sw.name, **meter)
+
+            # Lancer thread stream
+            stream_thread = threading.Thread(target=handle_stream, args=(sw, p4info_helper, stats, on_primary),
+                                             name=f"stream-{sw.name}")
+            stream_thread.daemon = True
+            stream_thread.start()
+        print(f"Threads stream pour digests lancés ({len(switches)} switches)")
+        threading.Thread(target=keep_arbitrating, args=([sw for sw, _ in switches], takeover_interval),
+                         name="arbitration", daemon=True).start()
+        if verify_interval:
+            threading.Thread(target=keep_verifying, args=(p4info_helper, [sw for sw, _ in switches], configs,
+                                                          config_lock, verify_interval, stats),
+                             name="verify", daemon=True).start()
+        if register_interval:
+            threading.Thread(target=keep_reading_registers, args=(p4info_helper, [sw for sw, _ in switches],
+                                                                  register_interval, stats),
+                             name="registers", daemon=True).start()
+
+        # Read counters periodically, all switches at once
+        previous = {sw.name: {} for sw, _ in switches}
         while True:
-            sleep(10)
+            sleep(poll_interval)
             # print('\n----- Reading direct counters -----')
             # read_direct_counters(p4info_helper, s1, "IngressImpl.ipv4_c.ipv4")
             # read_direct_counters(p4info_helper, s1, "IngressImpl.psfp_c.streamFilter_c.stream_id")
             # read_direct_counters(p4info_helper, s1, "IngressImpl.psfp_c.flowMeter_c.flow_meter_instance")
-            
+
 
             print('\n----- Reading counters -----')
-            for counter_name in [
-                "IngressImpl.psfp_c.streamFilter_c.overall_counter",
-                "IngressImpl.psfp_c.streamFilter_c.missed_max_sdu_filter_counter",
-                "IngressImpl.psfp_c.streamGate_c.not_passed_gate_counter",
-                "IngressImpl.psfp_c.flowMeter_c.marked_red_counter",
-                "IngressImpl.psfp_c.flowMeter_c.marked_yellow_counter",
-                "IngressImpl.psfp_c.flowMeter_c.marked_green_counter"
-            ]:
-                printCounter(p4info_helper, s1, counter_name, 0)
+            futures = {pool.submit(poll_counters, p4info_helper, sw): sw for sw, _ in switches}
+            for future in as_completed(futures):
+                sw = futures[future]
+                try:
+                    counters = future.result()
+                except grpc.RpcError as e:
+                    print(f"Reading counters of {sw.name} failed:")
+                    printGrpcError(e)
+                    continue
+                read_at = time.monotonic()
+                if stats:
+                    for counter_name, values in counters:
+                        log_counters(stats, previous[sw.name], sw, counter_name, values, read_at)
 
     except KeyboardInterrupt:
         print(" Shutting down.")
     except grpc.RpcError as e:
         printGrpcError(e)
 
+    pool.shutdown(wait=False)
     ShutdownAllSwitchConnections()
+    if stats:
+        stats.close()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='P4Runtime Controller for sdn-psfp')
@@ -1039,6 +1218,31 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/sdn-psfp.json')
+    parser.add_argument('--stats-log', help='Write counter, meter and gate records as JSONL to this file',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--poll-interval', help='Seconds between two counter polls',
+                        type=float, action="store", required=False, default=10)
+    parser.add_argument('--topology', help='Control every switch of this topology JSON (e.g. pod-topo/topology.json) '
+                        'instead of s1 only', type=str, action="store", required=False, default=None)
+    parser.add_argument('--workers', help='Threads provisioning and polling the switches (default: one per switch)',
+                        type=int, action="store", required=False, default=None)
+    parser.add_argument('--election-id', help='Election ID of this controller: the highest one connected is primary, '
+                        'the others are backups taking over when it goes away',
+                        type=int, action="store", required=False, default=DEFAULT_ELECTION_ID)
+    parser.add_argument('--reprovision', help='Reinstall the pipeline of switches already running it',
+                        action="store_true")
+    parser.add_argument('--takeover-interval', help='Seconds between two arbitration requests of a backup',
+                        type=float, action="store", required=False, default=TAKEOVER_INTERVAL)
+    parser.add_argument('--runtime', help='Runtime JSON of s1 when no topology is given (default: the '
+                        'psfp_runtime.py configuration)', type=str, action="store", required=False, default=None)
+    parser.add_argument('--watch', help='Watch the runtime JSON files and push their changes without '
+                        'reprovisioning', action="store_true")
+    parser.add_argument('--verify-interval', help='Seconds between two checks of the switch tables against the '
+                        'configuration (default: no check)', type=float, action="store", required=False, default=None)
+    parser.add_argument('--register-interval', help='Seconds between two reads of the registers (default: '
+                        'none, needs NumPy)', type=float, action="store", required=False, default=None)
+    parser.add_argument('--api', help='Serve the stream provisioning API on HOST:PORT or a Unix socket path',
+                        type=str, action="store", required=False, default=None)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -1049,4 +1253,14 @@ if __name__ == '__main__':
         parser.print_help()
         print(f"\nBMv2 JSON file not found: {args.bmv2_json}\nHave you run 'make'?")
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
\ No newline at end of file
+    if args.topology and not os.path.exists(args.topology):
+        parser.print_help()
+        print(f"\nTopology file not found: {args.topology}")
+        parser.exit(1)
+    if args.runtime and not os.path.exists(args.runtime):
+        parser.print_help()
+        print(f"\nRuntime file not found: {args.runtime}")
+        parser.exit(1)
+    main(args.p4info, args.bmv2_json, args.stats_log, args.poll_interval, args.topology, args.workers,
+         args.election_id, args.reprovision, args.takeover_interval, args.runtime, args.watch, args.api,
+         args.verify_interval, args.register_interval)
\ No newline at end of file
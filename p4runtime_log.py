@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Write-rate and gap analysis of the P4Runtime request log.
+
+simple_switch_grpc logs every RPC it receives to
+logs/s1-p4runtime-requests.txt:
+
+    [2025-08-25 08:25:07.475] /p4.v1.P4Runtime/Write
+    ---
+    <request in protobuf text format>
+    ---
+
+The file is read line by line, one request at a time, so its size does not
+matter. Write updates are replayed against a map of entry key (table and
+match fields, or register/meter/counter and index) to the last written
+content, which gives per table or register:
+  - updates by type, active span, mean and peak (busiest second) rate
+  - gaps between the Write RPCs touching it
+  - redundant updates (MODIFY with the content already installed)
+  - INSERTs of an existing key, MODIFYs and DELETEs of a key never inserted
+    in the log, which the switch rejects unless the entry was installed
+    before the log started
+
+and for the whole log the RPC mix, the request sizes (protobuf wire bytes)
+and the longest gaps between Write RPCs:
+
+    ./p4runtime_log.py logs/s1-p4runtime-requests.txt --timeline
+"""
+
+import argparse
+import heapq
+import re
+from datetime import datetime
+
+from google.protobuf import text_format
+
+from fake_p4runtime import load_p4info
+from p4.v1 import p4runtime_pb2
+from rx_latency import LogHistogram
+
+HEADER = re.compile(r"^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d+)\] /\S+/(\w+)$")
+SKIPPED = re.compile(r"^Message too long \((\d+) bytes\)")
+SEPARATOR = "---"
+
+REQUESTS = {
+    "Write": p4runtime_pb2.WriteRequest,
+    "Read": p4runtime_pb2.ReadRequest,
+    "SetForwardingPipelineConfig": p4runtime_pb2.SetForwardingPipelineConfigRequest,
+    "GetForwardingPipelineConfig": p4runtime_pb2.GetForwardingPipelineConfigRequest,
+    "Capabilities": p4runtime_pb2.CapabilitiesRequest,
+}
+UPDATE_TYPES = ("INSERT", "MODIFY", "DELETE")
+LONGEST_GAPS = 5
+# Parsed requests kept by text: the controller repeats the same counter
+# reads and register writes, and the text format parser is slow
+PARSE_CACHE_SIZE = 4096
+
+# Fields of an entity that are written, the others identify the entry
+CONTENT_FIELDS = {
+    "table_entry": ("action", "meter_config", "counter_data", "meter_counter_data", "idle_timeout_ns",
+                    "metadata", "time_since_last_hit"),
+    "register_entry": ("data",),
+    "meter_entry": ("config", "counter_data"),
+    "direct_meter_entry": ("config", "counter_data"),
+    "counter_entry": ("data",),
+    "direct_counter_entry": ("data",),
+    "value_set_entry": ("members",),
+}
+ID_FIELDS = {
+    "register_entry": "register_id",
+    "meter_entry": "meter_id",
+    "counter_entry": "counter_id",
+    "value_set_entry": "value_set_id",
+}
+
+
+def read_requests(path):
+    """
+    Reads the RPCs of a request log.
+
+    :return: generator of (epoch seconds, method name, request text or
+             None when simple_switch_grpc skipped it as too long, size of
+             a skipped request or None)
+    """
+    header = None
+    body = None
+    with open(path, buffering=1 << 20) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if body is not None:
+                if line != SEPARATOR:
+                    body.append(line)
+                    continue
+                ts, method = header
+                skipped = SKIPPED.match(body[0]) if len(body) == 1 else None
+                if skipped:
+                    yield ts, method, None, int(skipped.group(1))
+                else:
+                    yield ts, method, "\n".join(body), None
+                header = body = None
+            elif line == SEPARATOR and header is not None:
+                body = []
+            else:
+                match = HEADER.match(line)
+                if match:
+                    if header is not None:
+                        # Previous RPC without a body
+                        yield header[0], header[1], None, None
+                    header = (datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S.%f").timestamp(),
+                              match.group(2))
+    if header is not None:
+        yield header[0], header[1], None, None
+
+
+def p4info_names(p4info):
+    """
+    ID to name of every table, action and extern of a p4info.
+    """
+    names = {}
+    for kind in ("tables", "actions", "registers", "counters", "direct_counters", "meters", "direct_meters",
+                 "digests", "value_sets"):
+        for item in getattr(p4info, kind, ()):
+            names[item.preamble.id] = item.preamble.name
+    return names
+
+
+def entry_key(entity):
+    """
+    Identity and content of the entry an update writes.
+
+    :return: (object ID, key string, hash of the written content, is
+             default action)
+    """
+    kind = entity.WhichOneof("entity")
+    message = getattr(entity, kind)
+    key = type(message)()
+    key.CopyFrom(message)
+    if kind in ("table_entry", "direct_meter_entry", "direct_counter_entry"):
+        table_entry = key if kind == "table_entry" else key.table_entry
+        # The match fields may come in any order
+        matches = sorted(table_entry.match, key=lambda m: m.field_id)
+        del table_entry.match[:]
+        table_entry.match.extend(matches)
+        object_id = table_entry.table_id
+        default = table_entry.is_default_action
+    else:
+        object_id = getattr(message, ID_FIELDS.get(kind, ""), 0) if kind in ID_FIELDS else 0
+        default = False
+    content = key.SerializeToString(deterministic=True)
+    for field in CONTENT_FIELDS.get(kind, ()):
+        key.ClearField(field)
+    return object_id, kind + ":" + key.SerializeToString(deterministic=True).hex(), hash(content), default
+
+
+def describe_entry(entity, names):
+    """
+    Short text of the key of an entry.
+    """
+    kind = entity.WhichOneof("entity")
+    message = getattr(entity, kind)
+    if kind in ("direct_meter_entry", "direct_counter_entry"):
+        message = message.table_entry
+        kind = "table_entry"
+    if kind != "table_entry":
+        index = message.index.index if message.HasField("index") else "*"
+        name = names.get(getattr(message, ID_FIELDS.get(kind, ""), 0), kind) if kind in ID_FIELDS else kind
+        return f"{name}[{index}]"
+    if message.is_default_action:
+        return f"{names.get(message.table_id, message.table_id)} (default)"
+    fields = []
+    for m in sorted(message.match, key=lambda m: m.field_id):
+        which = m.WhichOneof("field_match_type")
+        value = getattr(m, which)
+        if which == "exact":
+            fields.append(f"{m.field_id}={value.value.hex() or '0'}")
+        elif which == "lpm":
+            fields.append(f"{m.field_id}={value.value.hex()}/{value.prefix_len}")
+        elif which == "ternary":
+            fields.append(f"{m.field_id}={value.value.hex()}&&&{value.mask.hex()}")
+        elif which == "range":
+            fields.append(f"{m.field_id}={value.low.hex() or '0'}..{value.high.hex()}")
+        else:
+            fields.append(f"{m.field_id}={text_format.MessageToString(value, as_one_line=True)}")
+    priority = f" prio {message.priority}" if message.priority else ""
+    return f"{names.get(message.table_id, message.table_id)} {' '.join(fields)}{priority}"
+
+
+class ObjectStats:
+    """
+    Writes to one table, register, meter or counter.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.updates = dict.fromkeys(UPDATE_TYPES, 0)
+        self.redundant = 0
+        self.duplicate_inserts = 0
+        self.unknown_modifies = 0
+        self.unknown_deletes = 0
+        self.first = None
+        self.last = None
+        self.per_second = {}
+        self.gaps = LogHistogram()
+
+    def add(self, ts, update_type):
+        if self.last is not None and ts > self.last:
+            self.gaps.add(int(round((ts - self.last) * 1e6)))
+        if self.first is None:
+            self.first = ts
+        if self.last is None or ts != self.last:
+            self.last = ts
+        self.updates[update_type] += 1
+        second = int(ts)
+        self.per_second[second] = self.per_second.get(second, 0) + 1
+
+    def total(self):
+        return sum(self.updates.values())
+
+
+class RequestLogStats:
+    """
+    Replays the requests of a log.
+
+    :param names: ID to name map (p4info_names()), IDs are printed when None
+    """
+
+    def __init__(self, names=None):
+        self.names = names or {}
+        self.rpcs = {}
+        self.sizes = {}
+        self.updates_per_write = LogHistogram()
+        self.write_gaps = LogHistogram()
+        self.longest_gaps = []
+        self.last_write = None
+        self.first = None
+        self.last = None
+        self.objects = {}
+        self.entries = {}
+        self.rewrites = {}
+        self.per_second = {}
+        self.parse_errors = 0
+        self.parsed = {}
+
+    def add(self, ts, method, text, skipped_size):
+        if self.first is None:
+            self.first = ts
+        self.last = ts
+        self.rpcs[method] = self.rpcs.get(method, 0) + 1
+        if method not in self.sizes:
+            self.sizes[method] = LogHistogram()
+        request_class = REQUESTS.get(method)
+        if text is None or request_class is None:
+            if skipped_size is not None:
+                self.sizes[method].add(skipped_size)
+            return
+        parsed = self.parsed.get(text)
+        if parsed is None:
+            parsed = self.parse(request_class, text)
+            if len(self.parsed) >= PARSE_CACHE_SIZE:
+                self.parsed.clear()
+            self.parsed[text] = parsed
+        size, updates = parsed
+        if size is None:
+            self.parse_errors += 1
+            return
+        self.sizes[method].add(size)
+        if method == "Write":
+            self.add_write(ts, updates)
+
+    @staticmethod
+    def parse(request_class, text):
+        """
+        :return: (wire size, list of (update type, entry_key() fields,
+                  entity) for a Write), size None when not parsed
+        """
+        request = request_class()
+        try:
+            text_format.Parse(text, request)
+        except text_format.ParseError:
+            return None, None
+        updates = []
+        if request_class is p4runtime_pb2.WriteRequest:
+            for update in request.updates:
+                update_type = p4runtime_pb2.Update.Type.Name(update.type)
+                if update_type in UPDATE_TYPES:
+                    updates.append((update_type, *entry_key(update.entity), update.entity))
+        return request.ByteSize(), updates
+
+    def add_write(self, ts, updates):
+        if self.last_write is not None:
+            # Clamped: the clock may step back (NTP) between two lines
+            gap = max(0, int(round((ts - self.last_write) * 1e6)))
+            self.write_gaps.add(gap)
+            item = (gap, self.last_write, ts)
+            if len(self.longest_gaps) < LONGEST_GAPS:
+                heapq.heappush(self.longest_gaps, item)
+            else:
+                heapq.heappushpop(self.longest_gaps, item)
+        self.last_write = ts
+        self.updates_per_write.add(len(updates))
+        second = int(ts)
+        self.per_second[second] = self.per_second.get(second, 0) + len(updates)
+        for update_type, object_id, key, content, default, entity in updates:
+            stats = self.objects.get(object_id)
+            if stats is None:
+                kind = entity.WhichOneof("entity")
+                stats = self.objects[object_id] = ObjectStats(self.names.get(object_id, f"{kind} {object_id}"))
+            stats.add(ts, update_type)
+            installed = self.entries.get(key)
+            if update_type == "DELETE":
+                if installed is None and not default:
+                    stats.unknown_deletes += 1
+                self.entries.pop(key, None)
+                continue
+            if update_type == "INSERT" and installed is not None:
+                stats.duplicate_inserts += 1
+                continue
+            if update_type == "MODIFY" and installed is None and not default:
+                stats.unknown_modifies += 1
+            elif update_type == "MODIFY" and installed == content:
+                stats.redundant += 1
+                rewrite = self.rewrites.get(key)
+                if rewrite is None:
+                    self.rewrites[key] = [1, describe_entry(entity, self.names)]
+                else:
+                    rewrite[0] += 1
+            self.entries[key] = content
+
+    def report(self, top=10):
+        span = (self.last - self.first) if self.first is not None else 0.0
+        print(f"{sum(self.rpcs.values())} RPCs over {span:.3f} s"
+              + (f", {self.parse_errors} requests not parsed" if self.parse_errors else ""))
+        print(f"\n{'rpc':30s} {'count':>7s} {'per s':>8s} {'bytes p50':>10s} {'p99':>9s} {'max':>9s} "
+              f"{'total':>10s}")
+        for method in sorted(self.rpcs, key=lambda m: -self.rpcs[m]):
+            sizes = self.sizes[method]
+            rate = self.rpcs[method] / span if span else 0.0
+            print(f"{method:30s} {self.rpcs[method]:7d} {rate:8.2f} {format_value(sizes.percentile(50)):>10s} "
+                  f"{format_value(sizes.percentile(99)):>9s} {format_value(sizes.max):>9s} {sizes.sum:10d}")
+
+        if self.updates_per_write.total:
+            per_write = self.updates_per_write
+            print(f"\nWrite: {per_write.sum} updates in {per_write.total} RPCs, "
+                  f"{per_write.mean():.1f} per RPC (max {per_write.max})")
+            gaps = self.write_gaps
+            if gaps.total:
+                print(f"gap between Write RPCs (ms): p50 {format_ms(gaps.percentile(50))} "
+                      f"p99 {format_ms(gaps.percentile(99))} max {format_ms(gaps.max)}")
+                print("longest gaps:")
+                for gap, start, end in sorted(self.longest_gaps, reverse=True):
+                    print(f"  {format_ms(gap):>10s} ms  {format_time(start)} -> {format_time(end)}")
+
+        print(f"\n{'table / extern':58s} {'ins':>5s} {'mod':>5s} {'del':>5s} {'span s':>8s} {'per s':>8s} "
+              f"{'peak/s':>7s} {'gap p50 ms':>10s} {'max':>8s} {'redund':>6s} {'dup ins':>7s}")
+        for stats in sorted(self.objects.values(), key=lambda s: -s.total()):
+            span = stats.last - stats.first
+            rate = stats.total() / span if span else 0.0
+            print(f"{stats.name:58s} {stats.updates['INSERT']:5d} {stats.updates['MODIFY']:5d} "
+                  f"{stats.updates['DELETE']:5d} {span:8.3f} {rate:8.1f} {max(stats.per_second.values()):7d} "
+                  f"{format_ms(stats.gaps.percentile(50)):>10s} {format_ms(stats.gaps.max):>8s} "
+                  f"{stats.redundant:6d} {stats.duplicate_inserts:7d}")
+            if stats.unknown_modifies or stats.unknown_deletes:
+                print(f"  {stats.unknown_modifies} MODIFYs and {stats.unknown_deletes} DELETEs of entries not "
+                      f"inserted in this log")
+
+        if self.rewrites:
+            print("\nmost redundantly rewritten entries (MODIFY with the installed content):")
+            for count, entry in heapq.nlargest(top, self.rewrites.values()):
+                print(f"  {count:6d}  {entry}")
+
+    def print_timeline(self):
+        """
+        Updates written in every second of the log.
+        """
+        print(f"\n{'time':12s} {'updates':>8s}  tables")
+        by_second = {}
+        for stats in self.objects.values():
+            for second, count in stats.per_second.items():
+                by_second.setdefault(second, []).append((count, stats.name))
+        for second in sorted(self.per_second):
+            tables = ", ".join(f"{name.rsplit('.', 1)[-1]} {count}"
+                               for count, name in sorted(by_second.get(second, []), reverse=True))
+            print(f"{format_time(second)[:8]:12s} {self.per_second[second]:8d}  {tables}")
+
+
+def format_value(value):
+    return "-" if value is None else f"{value:.0f}"
+
+
+def format_ms(value_us):
+    return "-" if value_us is None else f"{value_us / 1000:.1f}"
+
+
+def format_time(ts):
+    return datetime.fromtimestamp(ts).strftime("%H:%M:%S.%f")[:12]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write rates, gaps and redundant writes of a P4Runtime request log')
+    parser.add_argument('log', help='P4Runtime request log', nargs='?', default='logs/s1-p4runtime-requests.txt')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c (for the table names)',
+                        type=str, action="store", required=False, default='./build/sdn-psfp.p4.p4info.txtpb')
+    parser.add_argument('--timeline', help='Print the updates written in every second',
+                        action="store_true")
+    parser.add_argument('--top', help='Redundantly rewritten entries shown',
+                        type=int, action="store", required=False, default=10)
+    args = parser.parse_args()
+
+    stats = RequestLogStats(p4info_names(load_p4info(args.p4info)) if args.p4info else None)
+    for request in read_requests(args.log):
+        stats.add(*request)
+    if not stats.rpcs:
+        print(f"No RPCs in {args.log}")
+        return
+    stats.report(args.top)
+    if args.timeline:
+        stats.print_timeline()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Streaming pcap reader and writer.
+
+Only the classic libpcap format written by BMv2 and tcpdump is handled. Both
+keep a fixed-size buffer, so captures of any size are processed in bounded
+memory without going through scapy.
+"""
+
+import struct
+
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+LINKTYPE_ETHERNET = 1
+
+_GLOBAL_HEADER = struct.Struct("<IHHiIII")
+_RECORD_HEADER_LE = struct.Struct("<IIII")
+_RECORD_HEADER_BE = struct.Struct(">IIII")
+_pack_record = _RECORD_HEADER_LE.pack
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+def read_pcap(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Iterates over the frames of a pcap file.
+
+    :param path: the pcap file
+    :param chunk_size: size of the read buffer in bytes
+    :return: generator of (timestamp in microseconds, frame bytes)
+    """
+    with open(path, "rb") as f:
+        header = f.read(_GLOBAL_HEADER.size)
+        if len(header) < _GLOBAL_HEADER.size:
+            # Empty capture (e.g. an interface that never sent anything)
+            return
+        magic = struct.unpack("<I", header[:4])[0]
+        if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+            record = _RECORD_HEADER_LE
+        else:
+            magic = struct.unpack(">I", header[:4])[0]
+            if magic not in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+                raise ValueError(f"{path}: not a pcap file (magic 0x{magic:08x})")
+            record = _RECORD_HEADER_BE
+        nanoseconds = magic == PCAP_MAGIC_NS
+
+        buf = b""
+        pos = 0
+        while True:
+            if len(buf) - pos < record.size:
+                buf = buf[pos:] + f.read(chunk_size)
+                pos = 0
+                if len(buf) < record.size:
+                    return
+            ts_sec, ts_frac, incl_len, _ = record.unpack_from(buf, pos)
+            end = pos + record.size + incl_len
+            if end > len(buf):
+                buf = buf[pos:] + f.read(max(chunk_size, incl_len + record.size))
+                pos = 0
+                end = record.size + incl_len
+                if end > len(buf):
+                    # Truncated last record
+                    return
+            if nanoseconds:
+                ts_frac //= 1000
+            yield ts_sec * 1_000_000 + ts_frac, buf[pos + record.size:end]
+            pos = end
+
+
+class PcapWriter:
+    """
+    Buffered pcap writer with microsecond (or nanosecond) timestamps.
+
+    Frames are appended to an in-memory buffer that is flushed to disk once it
+    exceeds the chunk size, so writing costs one syscall per chunk.
+
+    :param path: the pcap file
+    :param snaplen: snapshot length written in the global header
+    :param chunk_size: buffer size in bytes before a flush
+    :param nanoseconds: write a nanosecond pcap; timestamps passed to write()
+                        are then in nanoseconds
+    """
+
+    def __init__(self, path, snaplen=65535, chunk_size=DEFAULT_CHUNK_SIZE, nanoseconds=False):
+        self.f = open(path, "wb")
+        self.chunk_size = chunk_size
+        self.units = 1_000_000_000 if nanoseconds else 1_000_000
+        magic = PCAP_MAGIC_NS if nanoseconds else PCAP_MAGIC_US
+        self.buf = bytearray(_GLOBAL_HEADER.pack(magic, 2, 4, 0, 0, snaplen, LINKTYPE_ETHERNET))
+        self.count = 0
+
+    def write(self, ts_us, frame):
+        """
+        Appends one frame.
+
+        :param ts_us: timestamp in microseconds (nanoseconds for a nanosecond pcap)
+        :param frame: the frame bytes
+        """
+        length = len(frame)
+        buf = self.buf
+        buf += _pack_record(ts_us // self.units, ts_us % self.units, length, length)
+        buf += frame
+        self.count += 1
+        if len(buf) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.f.write(self.buf)
+        self.buf = bytearray()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,317 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Pre-rendered frame templates and a raw AF_PACKET sender.
+
+Each flow class is rendered once to Ethernet/802.1Q/IPv4/UDP|TCP bytes. Per
+packet, only the varying fields (IPv4 identification used as a sequence
+number, TCP sequence number, source port) are patched in place and the IPv4
+and L4 checksums are updated incrementally (RFC 1624), so the send loop does
+no packet building at all.
+
+Templates given a Probe also carry a probe header at the start of the
+payload, read back by rx_latency.py for one-way latency and loss:
+    magic "PSFP" | probe id (32 bits) | sequence (32 bits) | send time (64 bits, ns)
+The sequence counts the frames of the probe, shared by all the templates
+given the same Probe, and the send time is the CLOCK_REALTIME at patch().
+"""
+
+import os
+import socket
+import struct
+import time
+from struct import pack_into
+
+# Flow classes (same profiles as gen_pkts.py)
+FLOWS = {
+    "1": {"pcp": 5, "vid": 100, "dscp": 46, "ecn": 0, "protocol": 17, "ttl": 64},   # Audio
+    "2": {"pcp": 4, "vid": 200, "dscp": 34, "ecn": 0, "protocol": 17, "ttl": 64},   # Video
+    "3": {"pcp": 0, "vid": 300, "dscp": 0, "ecn": 0, "protocol": 6, "ttl": 128},    # Text
+    "4": {"pcp": 3, "vid": 400, "dscp": 26, "ecn": 0, "protocol": 17, "ttl": 64},   # Streaming
+    "5": {"pcp": 2, "vid": 500, "dscp": 18, "ecn": 0, "protocol": 6, "ttl": 128},   # Varied
+}
+
+FLOW_NAMES = {"1": "audio", "2": "video", "3": "text", "4": "streaming", "5": "varied"}
+
+DEFAULT_DST_MAC = '08:00:00:00:02:22'  # Host 2
+DPORT = 1234
+SPORT_MIN = 49152
+SPORT_MAX = 65535
+
+ETH_P_ALL = 0x0003
+ETH_P_8021Q = 0x8100
+ETH_P_IP = 0x0800
+SOL_PACKET = 263
+PACKET_QDISC_BYPASS = 20
+
+ETH_HLEN = 14
+VLAN_HLEN = 4
+IPV4_HLEN = 20
+UDP_HLEN = 8
+TCP_HLEN = 20
+MAX_FRAME = 1518
+
+PROBE_MAGIC = 0x50534650  # "PSFP"
+PROBE = struct.Struct("!IIIQ")
+PROBE_LEN = PROBE.size
+
+
+def get_if():
+    """
+    Returns the first eth0 interface, as the scapy scripts do.
+    """
+    for iface in sorted(os.listdir('/sys/class/net/')):
+        if "eth0" in iface:
+            return iface
+    print("Cannot find eth0 interface")
+    exit(1)
+
+
+def iface_mac(iface):
+    with open(f'/sys/class/net/{iface}/address') as f:
+        return f.read().strip()
+
+
+def source_ip(dst_ip):
+    """
+    Source address the kernel would use to reach dst_ip.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.connect((dst_ip, DPORT))
+        return s.getsockname()[0]
+
+
+def header_len(flow):
+    """
+    Bytes of a FlowTemplate frame before the payload.
+    """
+    return ETH_HLEN + VLAN_HLEN + IPV4_HLEN + (UDP_HLEN if flow["protocol"] == 17 else TCP_HLEN)
+
+
+def internet_checksum(data):
+    if len(data) % 2:
+        data = bytes(data) + b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def csum_update(csum, old, new):
+    """
+    Incremental checksum update for one 16-bit word (RFC 1624, eqn. 3).
+    """
+    total = (~csum & 0xffff) + (~old & 0xffff) + new
+    total = (total & 0xffff) + (total >> 16)
+    total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+class Probe:
+    """
+    Probe stream: an ID and the sequence counter of its frames.
+
+    :param probe_id: 32-bit ID, unique among the probes sent to a receiver
+    """
+
+    def __init__(self, probe_id):
+        self.probe_id = probe_id & 0xffffffff
+        self.seq = 0
+
+
+class FlowTemplate:
+    """
+    Frame template for one flow class.
+
+    :param flow: a FLOWS profile (pcp, vid, dscp, ecn, protocol, ttl)
+    :param src_mac: source MAC address
+    :param dst_mac: destination MAC address
+    :param src_ip: source IPv4 address
+    :param dst_ip: destination IPv4 address
+    :param payload: payload bytes
+    :param dport: destination port
+    :param sport: source port of the rendered template
+    :param probe: a Probe to stamp in the first PROBE_LEN payload bytes
+                  (shorter payloads are padded to PROBE_LEN)
+    """
+
+    def __init__(self, flow, src_mac, dst_mac, src_ip, dst_ip, payload, dport=DPORT, sport=SPORT_MIN,
+                 probe=None):
+        self.flow = flow
+        self.protocol = flow["protocol"]
+        self.probe = probe
+        if probe is not None:
+            payload = PROBE.pack(PROBE_MAGIC, probe.probe_id, 0, 0) + bytes(payload[PROBE_LEN:])
+        l4_len = (UDP_HLEN if self.protocol == 17 else TCP_HLEN) + len(payload)
+
+        eth = bytes.fromhex(dst_mac.replace(":", "")) + bytes.fromhex(src_mac.replace(":", ""))
+        eth += struct.pack("!HHH", ETH_P_8021Q, (flow["pcp"] << 13) | flow["vid"], ETH_P_IP)
+        ip = bytearray(struct.pack("!BBHHHBBH4s4s", 0x45, (flow["dscp"] << 2) | flow["ecn"],
+                                   IPV4_HLEN + l4_len, 0, 0, flow["ttl"], self.protocol, 0,
+                                   socket.inet_aton(src_ip), socket.inet_aton(dst_ip)))
+        struct.pack_into("!H", ip, 10, internet_checksum(ip))
+
+        if self.protocol == 17:
+            l4 = bytearray(struct.pack("!HHHH", sport, dport, l4_len, 0))
+        else:
+            # Same defaults as scapy's TCP(): seq 0, SYN, window 8192
+            l4 = bytearray(struct.pack("!HHIIBBHHH", sport, dport, 0, 0, 5 << 4, 0x02, 8192, 0, 0))
+        pseudo = socket.inet_aton(src_ip) + socket.inet_aton(dst_ip) + struct.pack("!BBH", 0, self.protocol, l4_len)
+        l4_csum = internet_checksum(pseudo + l4 + payload)
+        if self.protocol == 17 and l4_csum == 0:
+            l4_csum = 0xffff
+
+        self.ip_offset = len(eth)
+        self.l4_offset = self.ip_offset + IPV4_HLEN
+        self.payload_offset = self.l4_offset + len(l4)
+        self.l4_csum_offset = self.l4_offset + (6 if self.protocol == 17 else 16)
+        self.frame = bytearray(eth + ip) + l4 + payload
+        self.base_sport = sport
+        self.base_ip_csum = struct.unpack_from("!H", ip, 10)[0]
+        self.base_l4_csum = l4_csum
+        struct.pack_into("!H", self.frame, self.l4_csum_offset, l4_csum)
+        # csum_update() with the base values folded in: the patched fields are
+        # 0 in the template (and ~0 is -0 in one's complement), so only the new
+        # values are added to these sums
+        self._ip_sum = ~self.base_ip_csum & 0xffff
+        self._l4_sum = (~l4_csum & 0xffff) + (~sport & 0xffff)
+        self._ip_id = self.ip_offset + 4
+        self._ip_csum = self.ip_offset + 10
+        self._tcp_seq = self.l4_offset + 4 if self.protocol == 6 else None
+        self._probe_seq = self.payload_offset + 8
+
+    def __len__(self):
+        return len(self.frame)
+
+    def patch(self, seq, sport, sent_ns=None):
+        """
+        Patches the sequence number and source port in place.
+
+        The 16 low bits of seq go in the IPv4 identification; TCP frames also
+        carry the full 32-bit seq in the TCP sequence number. With a probe,
+        the probe sequence and the send time are stamped too.
+
+        :param sent_ns: send time to stamp, for frames patched ahead of a
+                        send deadline (default: time.time_ns())
+        :return: the patched frame (the template buffer itself)
+        """
+        frame = self.frame
+        ip_id = seq & 0xffff
+        total = self._ip_sum + ip_id
+        total = (total & 0xffff) + (total >> 16)
+        pack_into("!H", frame, self._ip_id, ip_id)
+        pack_into("!H", frame, self._ip_csum, ~total & 0xffff)
+
+        total = self._l4_sum + sport
+        pack_into("!H", frame, self.l4_offset, sport)
+        if self._tcp_seq is not None:
+            seq &= 0xffffffff
+            pack_into("!I", frame, self._tcp_seq, seq)
+            total += (seq >> 16) + (seq & 0xffff)
+        probe = self.probe
+        if probe is not None:
+            probe_seq = probe.seq
+            probe.seq = (probe_seq + 1) & 0xffffffff
+            now = time.time_ns() if sent_ns is None else sent_ns
+            pack_into("!IQ", frame, self._probe_seq, probe_seq, now)
+            total += ((probe_seq >> 16) + (probe_seq & 0xffff) + (now >> 48) + ((now >> 32) & 0xffff)
+                      + ((now >> 16) & 0xffff) + (now & 0xffff))
+        total = (total & 0xffff) + (total >> 16)
+        total = (total & 0xffff) + (total >> 16)
+        # 0 means "no checksum" in UDP, send -0 instead
+        pack_into("!H", frame, self.l4_csum_offset, (~total & 0xffff) or 0xffff)
+        return frame
+
+
+class RawSender:
+    """
+    AF_PACKET raw socket bound to one interface.
+
+    :param iface: the interface name
+    :param qdisc_bypass: skip the kernel qdisc layer (PACKET_QDISC_BYPASS)
+    """
+
+    def __init__(self, iface, qdisc_bypass=True):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.sock.bind((iface, 0))
+        if qdisc_bypass:
+            try:
+                self.sock.setsockopt(SOL_PACKET, PACKET_QDISC_BYPASS, 1)
+            except OSError:
+                pass
+        self.sent = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def send(self, frame):
+        try:
+            self.sock.send(frame)
+        except OSError:
+            # ENOBUFS when the NIC queue is full: count and keep going
+            self.errors += 1
+            return
+        self.sent += 1
+        self.bytes += len(frame)
+
+    def close(self):
+        self.sock.close()
+
+
+def send_flows(sender, templates, rate=0.0, count=0, duration=0.0, batch=64, sport_range=(SPORT_MIN, SPORT_MAX)):
+    """
+    Sends the templates round-robin in batches at a target packet rate.
+
+    Pacing is done once per batch: the loop sleeps until the batch deadline
+    derived from the target rate instead of sleeping per packet.
+
+    :param sender: a RawSender
+    :param templates: list of FlowTemplate
+    :param rate: target packets per second (0: as fast as possible)
+    :param count: stop after this many packets (0: no limit)
+    :param duration: stop after this many seconds (0: no limit)
+    :param batch: packets sent between two pacing checks
+    :param sport_range: source ports cycled through (inclusive)
+    :return: dict with sent packets, bytes, errors and elapsed seconds
+    """
+    sport_min, sport_max = sport_range
+    sport_span = sport_max - sport_min + 1
+    n_templates = len(templates)
+    send = sender.send
+    seq = 0
+    start = time.perf_counter()
+    end = start + duration if duration else float("inf")
+    while True:
+        n = batch if not count else min(batch, count - seq)
+        if n <= 0:
+            break
+        for i in range(seq, seq + n):
+            send(templates[i % n_templates].patch(i, sport_min + i % sport_span))
+        seq += n
+        now = time.perf_counter()
+        if now >= end:
+            break
+        if rate:
+            delay = start + seq / rate - now
+            if delay > 0:
+                time.sleep(delay)
+    return {"packets": sender.sent, "bytes": sender.bytes, "errors": sender.errors,
+            "seconds": time.perf_counter() - start}
+
+
+def wait_until(deadline_ns, spin_ns=200000):
+    """
+    Waits until an absolute CLOCK_REALTIME deadline.
+
+    Sleeps until spin_ns before the deadline, then busy-waits the rest, which
+    keeps the wake-up error well under the scheduler's sleep granularity.
+
+    :param deadline_ns: deadline as time.time_ns()
+    :param spin_ns: busy-wait budget before the deadline
+    :return: time.time_ns() on return
+    """
+    remaining = deadline_ns - time.time_ns()
+    if remaining > spin_ns:
+        time.sleep((remaining - spin_ns) / 1e9)
+    now = time.time_ns()
+    while now < deadline_ns:
+        now = time.time_ns()
+    return now
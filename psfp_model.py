@@ -0,0 +1,411 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Reference model of the sdn-psfp.p4 ingress pipeline.
+
+The model replays the decisions of IngressImpl (StreamFilter, hyperperiod
+state, StreamGate, FlowMeter and IPv4) for one frame at a time, using the
+same table entries the controller installs. Register and meter state is
+kept between frames so a whole capture can be replayed in order.
+
+BMv2 behaviours are reproduced on purpose, even where they differ from the
+802.1Qci intent:
+  - out-of-range register reads return 0 and writes are ignored,
+  - the direct meter returns 0/1/2 (GREEN/YELLOW/RED), so RED lands in the
+    "yellow" branch of FlowMeter.p4,
+  - hyperperiod_state rewrites the hyperperiod registers on every hit.
+"""
+
+import socket
+
+MASK_48 = (1 << 48) - 1
+MASK_64 = (1 << 64) - 1
+
+ETH_802_1Q = 0x8100
+ETH_IPV4 = 0x0800
+
+STAGE_FILTER = "filter"
+STAGE_GATE = "gate"
+STAGE_METER = "meter"
+STAGE_IPV4 = "ipv4"
+STAGES = (STAGE_FILTER, STAGE_GATE, STAGE_METER, STAGE_IPV4)
+
+METER_GREEN = 0
+METER_YELLOW = 1
+METER_RED = 2
+
+T_STREAM_ID = "IngressImpl.psfp_c.streamFilter_c.stream_id"
+T_STREAM_ID_ACTIVE = "IngressImpl.psfp_c.streamFilter_c.stream_id_active"
+T_STREAM_FILTER = "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance"
+T_MAX_SDU = "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter"
+T_GATE = "IngressImpl.psfp_c.streamGate_c.stream_gate_instance"
+T_METER_CONFIG = "IngressImpl.psfp_c.flowMeter_c.flow_meter_config"
+T_METER_INSTANCE = "IngressImpl.psfp_c.flowMeter_c.flow_meter_instance"
+T_IPV4 = "IngressImpl.ipv4_c.ipv4"
+
+# Register sizes from headers.p4 / the p4info
+STREAM_ID_SIZE = 5
+STREAM_GATE_SIZE = 4
+FLOW_METER_SIZE = 2
+OCTETS_PER_INTERVAL_SIZE = 256
+
+
+def mac_to_int(mac):
+    return int(mac.replace(":", ""), 16)
+
+
+def ipv4_to_int(addr):
+    return int.from_bytes(socket.inet_aton(addr), "big")
+
+
+class Register:
+    """
+    BMv2 register array: out-of-range reads return 0, writes are dropped.
+    """
+
+    __slots__ = ("values", "mask")
+
+    def __init__(self, size, bitwidth):
+        self.values = [0] * size
+        self.mask = (1 << bitwidth) - 1
+
+    def read(self, index):
+        if 0 <= index < len(self.values):
+            return self.values[index]
+        return 0
+
+    def write(self, index, value):
+        if 0 <= index < len(self.values):
+            self.values[index] = value & self.mask
+
+
+class TwoRateMeter:
+    """
+    BMv2 two rate three color meter in bytes (color-blind).
+
+    :param cir: committed rate in bytes per second
+    :param cburst: committed burst in bytes
+    :param pir: peak rate in bytes per second
+    :param pburst: peak burst in bytes
+    """
+
+    __slots__ = ("cir", "cburst", "pir", "pburst", "c_tokens", "p_tokens", "last_us")
+
+    def __init__(self, cir, cburst, pir, pburst):
+        self.cir = cir / 1_000_000
+        self.cburst = cburst
+        self.pir = pir / 1_000_000
+        self.pburst = pburst
+        self.c_tokens = cburst
+        self.p_tokens = pburst
+        self.last_us = None
+
+    def execute(self, ts_us, length):
+        if self.last_us is not None and ts_us > self.last_us:
+            elapsed = ts_us - self.last_us
+            self.c_tokens = min(self.cburst, self.c_tokens + elapsed * self.cir)
+            self.p_tokens = min(self.pburst, self.p_tokens + elapsed * self.pir)
+        self.last_us = ts_us if self.last_us is None else max(ts_us, self.last_us)
+
+        if self.p_tokens < length:
+            return METER_RED
+        if self.c_tokens < length:
+            self.p_tokens -= length
+            return METER_YELLOW
+        self.p_tokens -= length
+        self.c_tokens -= length
+        return METER_GREEN
+
+
+class Verdict:
+    """
+    Outcome of one frame through the pipeline.
+
+    ``stage`` is the stage that dropped the frame, or None when it was
+    forwarded out of ``egress_port``.
+    """
+
+    __slots__ = ("stage", "reason", "egress_port", "stream_handle", "gate_id",
+                 "diff_ts", "color", "boundary_us", "frame")
+
+    def __init__(self):
+        self.stage = None
+        self.reason = None
+        self.egress_port = None
+        self.stream_handle = 0
+        self.gate_id = 0
+        self.diff_ts = None
+        self.color = None
+        self.boundary_us = None
+        self.frame = None
+
+    @property
+    def forwarded(self):
+        return self.stage is None and self.egress_port is not None
+
+    def drop(self, stage, reason):
+        if self.stage is None:
+            self.stage = stage
+            self.reason = reason
+
+
+class PSFPModel:
+    """
+    Replays IngressImpl on raw Ethernet frames.
+
+    :param table_entries: table entries in s1-runtime.json format
+    :param hyperperiods: {gate_id: hyperperiod in seconds}
+    :param meters: direct meter configs (psfp_runtime.DIRECT_METERS format)
+    :param anchor_us: last_hyperperiod value programmed by the controller,
+                      in switch time (microseconds)
+    :param rollover: emulate the controller register writes on each
+                     hyperperiod digest (see handle_stream)
+    """
+
+    def __init__(self, table_entries, hyperperiods, meters, anchor_us=0, rollover=False):
+        self.rollover = rollover
+        self.digests = 0
+
+        self.stream_id = {}
+        self.stream_id_active = {}
+        self.stream_filter = {}
+        self.max_sdu = {}
+        self.gates = {}
+        self.meter_config = {}
+        self.meter_instances = {}
+        self.ipv4_routes = []
+
+        meter_bands = {m["index"]: m for m in meters}
+        meter_order = []
+
+        for entry in table_entries:
+            table = entry["table"]
+            match = entry.get("match", {})
+            params = entry.get("action_params", {})
+            if entry.get("default_action"):
+                continue
+            if table == T_STREAM_ID:
+                key = (mac_to_int(match["hdr.ethernet.dst_addr"]), match["hdr.eth_802_1q.vid"])
+                self.stream_id[key] = (params["stream_handle"], params["active"],
+                                       params["stream_blocked_due_to_oversize_frame_enable"])
+            elif table == T_STREAM_ID_ACTIVE:
+                self.stream_id_active[match["meta.ingress_md.stream_filter.stream_handle"]] = (
+                    mac_to_int(params["eth_dst_addr"]), params["vid"], params["pcp"])
+            elif table == T_STREAM_FILTER:
+                self.stream_filter[match["meta.ingress_md.stream_filter.stream_handle"]] = (
+                    params["stream_gate_id"], params["flow_meter_instance_id"],
+                    params["gate_closed_due_to_invalid_rx_enable"],
+                    params["gate_closed_due_to_octets_exceeded_enable"])
+            elif table == T_MAX_SDU:
+                pcp_value, pcp_mask = match["hdr.eth_802_1q.pcp"]
+                low, high = match["std_md.packet_length"]
+                self.max_sdu.setdefault(match["meta.ingress_md.stream_filter.stream_handle"], []).append(
+                    (entry.get("priority", 0), pcp_value & pcp_mask, pcp_mask, low, high))
+            elif table == T_GATE:
+                low, high = match["meta.ingress_md.diff_ts"]
+                self.gates.setdefault(match["meta.ingress_md.stream_filter.stream_gate_id"], []).append(
+                    (entry.get("priority", 0), low, high, params["gate_state"],
+                     params["interval_identifier"], params["max_octects_interval"]))
+            elif table == T_METER_CONFIG:
+                self.meter_config[match["meta.ingress_md.stream_filter.flow_meter_instance_id"]] = (
+                    params["dropOnYellow"], params["markAllFramesRedEnable"], params["colorAware"])
+            elif table == T_METER_INSTANCE:
+                meter_order.append(match["meta.ingress_md.stream_filter.flow_meter_instance_id"])
+            elif table == T_IPV4:
+                prefix, prefix_len = match["hdr.ipv4.dstAddr"]
+                mask = ((1 << prefix_len) - 1) << (32 - prefix_len) if prefix_len else 0
+                self.ipv4_routes.append((prefix_len, ipv4_to_int(prefix) & mask, mask,
+                                         mac_to_int(params["eth_dst_addr"]), params["port"]))
+
+        # Highest priority first, as BMv2 resolves ternary/range overlaps
+        for candidates in self.max_sdu.values():
+            candidates.sort(key=lambda c: -c[0])
+        for candidates in self.gates.values():
+            candidates.sort(key=lambda c: -c[0])
+        self.ipv4_routes.sort(key=lambda r: -r[0])
+
+        # Direct meter bands are configured per table entry; entries without
+        # a configuration never color (BMv2 default is an unconfigured meter).
+        for fm_id in meter_order:
+            band = meter_bands.get(fm_id)
+            self.meter_instances[fm_id] = TwoRateMeter(
+                band["cir"], band["cburst"], band["pir"], band["pburst"]) if band else None
+
+        self.hyperperiod_state = {
+            gate_id: (secs * 1_000_000, anchor_us & MASK_48)
+            for gate_id, secs in hyperperiods.items()
+        }
+
+        self.hyperperiod_duration_reg = Register(STREAM_ID_SIZE, 48)
+        self.last_hyperperiod_reg = Register(STREAM_ID_SIZE, 48)
+        self.reg_filter_blocked = Register(STREAM_ID_SIZE, 1)
+        self.reg_gate_blocked = Register(STREAM_GATE_SIZE, 1)
+        self.octets_per_interval = Register(OCTETS_PER_INTERVAL_SIZE, 32)
+        self.state_reset_octets = Register(STREAM_GATE_SIZE, 12)
+        self.reg_meter_blocked = Register(FLOW_METER_SIZE, 1)
+
+    def _max_sdu_hit(self, handle, pcp, length):
+        for _, value, mask, low, high in self.max_sdu.get(handle, ()):
+            if pcp & mask == value and low <= length <= high:
+                return True
+        return False
+
+    def _gate_lookup(self, gate_id, diff_ts):
+        for candidate in self.gates.get(gate_id, ()):
+            if candidate[1] <= diff_ts <= candidate[2]:
+                return candidate
+        return None
+
+    def process(self, ts_us, frame):
+        """
+        Runs one frame through the ingress pipeline.
+
+        :param ts_us: ingress timestamp in switch time (microseconds)
+        :param frame: the frame bytes as received on the ingress port
+        :return: a Verdict; ``verdict.frame`` holds the rewritten frame when
+                 the frame is forwarded
+        """
+        v = Verdict()
+        length = len(frame)
+        if length < 14:
+            v.drop(STAGE_IPV4, "runt")
+            return v
+
+        ether_type = int.from_bytes(frame[12:14], "big")
+        dst_mac = int.from_bytes(frame[0:6], "big")
+        vlan = None
+        ip_offset = None
+        if ether_type == ETH_802_1Q and length >= 18:
+            tci = int.from_bytes(frame[14:16], "big")
+            vlan = [tci >> 13, (tci >> 12) & 1, tci & 0xfff]
+            if int.from_bytes(frame[16:18], "big") == ETH_IPV4:
+                ip_offset = 18
+        elif ether_type == ETH_IPV4:
+            ip_offset = 14
+        if ip_offset is not None and length < ip_offset + 20:
+            ip_offset = None
+
+        if vlan is not None:
+            dst_mac = self._psfp(v, ts_us, length, dst_mac, vlan)
+
+        if ip_offset is None:
+            v.drop(STAGE_IPV4, "no ipv4")
+            return v
+        if v.stage is not None:
+            return v
+
+        ip_dst = int.from_bytes(frame[ip_offset + 16:ip_offset + 20], "big")
+        for _, prefix, mask, eth_dst, port in self.ipv4_routes:
+            if ip_dst & mask == prefix:
+                break
+        else:
+            v.drop(STAGE_IPV4, "no route")
+            return v
+
+        out = bytearray(frame)
+        out[6:12] = dst_mac.to_bytes(6, "big")
+        out[0:6] = eth_dst.to_bytes(6, "big")
+        if vlan is not None:
+            out[14:16] = ((vlan[0] << 13) | (vlan[1] << 12) | vlan[2]).to_bytes(2, "big")
+        out[ip_offset + 8] = (out[ip_offset + 8] - 1) & 0xff
+        v.egress_port = port
+        v.frame = bytes(out)
+        return v
+
+    def _psfp(self, v, ts_us, length, dst_mac, vlan):
+        pcp, _, vid = vlan
+        gate_id = 0
+        fm_id = 0
+        invalid_rx_enable = 0
+        octets_enable = 0
+
+        # 1. StreamFilter
+        sid = self.stream_id.get((dst_mac, vid))
+        if sid is not None:
+            handle, active, oversize_enable = sid
+            v.stream_handle = handle
+            if not self._max_sdu_hit(handle, pcp, length):
+                if oversize_enable:
+                    self.reg_filter_blocked.write(handle, 1)
+                v.drop(STAGE_FILTER, "max sdu exceeded")
+            else:
+                blocked = self.reg_filter_blocked.read(handle)
+                sfi = self.stream_filter.get(handle)
+                if sfi is not None:
+                    gate_id, fm_id, invalid_rx_enable, octets_enable = sfi
+                    if oversize_enable and blocked:
+                        v.drop(STAGE_FILTER, "stream blocked (oversize)")
+                    elif active:
+                        overwrite = self.stream_id_active.get(handle)
+                        if overwrite is not None:
+                            dst_mac, vlan[2], vlan[0] = overwrite
+        v.gate_id = gate_id
+
+        # Hyperperiod state (table action rewrites the registers)
+        hp_state = self.hyperperiod_state.get(gate_id)
+        if hp_state is not None:
+            self.hyperperiod_duration_reg.write(gate_id, hp_state[0])
+            self.last_hyperperiod_reg.write(gate_id, hp_state[1])
+        hyperperiod = self.hyperperiod_duration_reg.read(gate_id)
+        last = self.last_hyperperiod_reg.read(gate_id)
+
+        if (ts_us & MASK_48) > ((last + hyperperiod) & MASK_48):
+            self.digests += 1
+            if self.rollover:
+                self.last_hyperperiod_reg.write(gate_id, last + hyperperiod)
+            return dst_mac
+
+        diff_ts = ((ts_us & MASK_48) - last) & MASK_64
+        v.diff_ts = diff_ts
+
+        # 2. StreamGate
+        if v.stage is None:
+            interval = self._gate_lookup(gate_id, diff_ts)
+            if interval is None:
+                v.drop(STAGE_GATE, "no interval")
+                if invalid_rx_enable:
+                    self.reg_gate_blocked.write(gate_id, 1)
+            else:
+                _, low, high, gate_state, iid, max_octets = interval
+                v.boundary_us = min(diff_ts - low, high - diff_ts)
+                if self.state_reset_octets.read(gate_id) != iid:
+                    self.octets_per_interval.write(iid, max_octets)
+                    self.state_reset_octets.write(gate_id, iid)
+                if self.reg_gate_blocked.read(gate_id):
+                    v.drop(STAGE_GATE, "gate blocked")
+                elif gate_state == 1:
+                    v.drop(STAGE_GATE, "gate closed")
+                    if invalid_rx_enable:
+                        self.reg_gate_blocked.write(gate_id, 1)
+                else:
+                    remaining = self.octets_per_interval.read(iid)
+                    if remaining >= length:
+                        self.octets_per_interval.write(iid, remaining - length)
+                    else:
+                        v.drop(STAGE_GATE, "octets exceeded")
+                        if octets_enable:
+                            self.reg_gate_blocked.write(gate_id, 1)
+
+        # 3. FlowMeter
+        drop_on_yellow, mark_red, _ = self.meter_config.get(fm_id, (0, 0, 0))
+        color = METER_GREEN
+        if v.stage is None and fm_id in self.meter_instances:
+            meter = self.meter_instances[fm_id]
+            if meter is not None:
+                color = meter.execute(ts_us, length)
+        v.color = color
+
+        if color in (METER_YELLOW, METER_RED):
+            if drop_on_yellow or self.reg_meter_blocked.read(fm_id):
+                v.drop(STAGE_METER, "yellow dropped" if color == METER_YELLOW else "red")
+            else:
+                vlan[1] = 1
+        elif color == 3:
+            v.drop(STAGE_METER, "red")
+            if mark_red:
+                self.reg_meter_blocked.write(fm_id, 1)
+        elif v.stage is None:
+            if self.reg_meter_blocked.read(fm_id):
+                v.drop(STAGE_METER, "meter blocked")
+            else:
+                vlan[1] = 0
+        return dst_mac
@@ -0,0 +1,907 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Runtime configuration installed by mycontroller.py on s1.
+
+Kept free of any P4Runtime/gRPC import so the traffic tools and the
+reference model can read the exact same entries the controller installs.
+"""
+
+import heapq
+import json
+import time
+
+# Table entries (same format as s1-runtime.json)
+TABLE_ENTRIES = [
+    # Default action for ipv4_c.ipv4
+    {
+        "table": "IngressImpl.ipv4_c.ipv4",
+        "default_action": True,
+        "action_name": "IngressImpl.ipv4_c.drop",
+        "action_params": {}
+    },
+    # IPv4 forwarding rule for 10.0.1.1
+    {
+        "table": "IngressImpl.ipv4_c.ipv4",
+        "match": {
+            "hdr.ipv4.dstAddr": ["10.0.1.1", 32]
+        },
+        "action_name": "IngressImpl.ipv4_c.ipv4_forward",
+        "action_params": {
+            "eth_dst_addr": "08:00:00:00:01:11",
+            "port": 1
+        }
+    },
+    # IPv4 forwarding rule for 10.0.2.2
+    {
+        "table": "IngressImpl.ipv4_c.ipv4",
+        "match": {
+            "hdr.ipv4.dstAddr": ["10.0.2.2", 32]
+        },
+        "action_name": "IngressImpl.ipv4_c.ipv4_forward",
+        "action_params": {
+            "eth_dst_addr": "08:00:00:00:02:22",
+            "port": 2
+        }
+    },
+    ############################### Stream ID rules ###############################
+    # Assigning stream handles based on Ethernet destination address and VLAN ID
+    ## Voice stream (stream_handle 1)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_id",
+        "match": {
+            "hdr.ethernet.dst_addr": "08:00:00:00:02:22",
+            "hdr.eth_802_1q.vid": 1
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_stream_handle",
+        "action_params": {
+            "stream_handle": 1,
+            "active": 1,
+            "stream_blocked_due_to_oversize_frame_enable": 0
+        }
+    },
+    ## Video stream (stream_handle 2)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_id",
+        "match": {
+            "hdr.ethernet.dst_addr": "08:00:00:00:02:22",
+            "hdr.eth_802_1q.vid": 2
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_stream_handle",
+        "action_params": {
+            "stream_handle": 2,
+            "active": 1, # Stream identification is active
+            "stream_blocked_due_to_oversize_frame_enable": 0
+        }
+    },
+    ## Data (Text) stream (stream_handle 3)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_id",
+        "match": {
+            "hdr.ethernet.dst_addr": "08:00:00:00:02:22",
+            "hdr.eth_802_1q.vid": 3
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_stream_handle",
+        "action_params": {
+            "stream_handle": 3,
+            "active": 0,  # Stream identification is inactive
+            "stream_blocked_due_to_oversize_frame_enable": 1
+        }
+    },
+    ## Streaming service Stream (stream_handle 4)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_id",
+        "match": {
+            "hdr.ethernet.dst_addr": "08:00:00:00:01:11",
+            "hdr.eth_802_1q.vid": 4
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_stream_handle",
+        "action_params": {
+            "stream_handle": 4,
+            "active": 1,
+            "stream_blocked_due_to_oversize_frame_enable": 0
+        }
+    },
+    ## Varied Services Stream (stream_handle 5)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_id",
+        "match": {
+            "hdr.ethernet.dst_addr": "08:00:00:00:01:11",
+            "hdr.eth_802_1q.vid": 5
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_stream_handle",
+        "action_params": {
+            "stream_handle": 5,
+            "active": 0,  # Stream identification is inactive
+            "stream_blocked_due_to_oversize_frame_enable": 1
+        }
+    },
+    ############################### Stream filter instance rules ###############################
+    # Assigning stream gates and flow meters based on stream handles
+    # Stream handle 1 (Audio)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 1
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_gate_and_meter",
+        "action_params": {
+            "stream_gate_id": 1,
+            "flow_meter_instance_id": 1,
+            "gate_closed_due_to_invalid_rx_enable": 1,
+            "gate_closed_due_to_octets_exceeded_enable": 1
+        }
+    },
+    # Stream handle 2 (Video)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 2
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_gate_and_meter",
+        "action_params": {
+            "stream_gate_id": 2,
+            "flow_meter_instance_id": 2,
+            "gate_closed_due_to_invalid_rx_enable": 1,
+            "gate_closed_due_to_octets_exceeded_enable": 0
+        }
+    },
+    # Stream handle 3 (Data/Text)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 3
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_gate_and_meter",
+        "action_params": {
+            "stream_gate_id": 3,
+            "flow_meter_instance_id": 1,
+            "gate_closed_due_to_invalid_rx_enable": 0,
+            "gate_closed_due_to_octets_exceeded_enable": 1
+        }
+    },
+    # Stream handle 4 (Streaming service)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 4
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_gate_and_meter",
+        "action_params": {
+            "stream_gate_id": 4,
+            "flow_meter_instance_id": 2,
+            "gate_closed_due_to_invalid_rx_enable": 0,
+            "gate_closed_due_to_octets_exceeded_enable": 0
+        }
+    },
+    # Stream handle 5 (Varied services)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 5
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.assign_gate_and_meter",
+        "action_params": {
+            "stream_gate_id": 1,
+            "flow_meter_instance_id": 1,
+            "gate_closed_due_to_invalid_rx_enable": 1,
+            "gate_closed_due_to_octets_exceeded_enable": 1
+        }
+    },
+    ############################# Stream ID active rules #############################
+    # Audio stream (stream_handle 1)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_id_active",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 1
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.overwrite_stream_active",
+        "action_params": {
+            "eth_dst_addr": "08:00:00:00:02:22",
+            "vid": 1,
+            "pcp": 5
+        }
+    },
+    # Video stream (stream_handle 2)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_id_active",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 2
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.overwrite_stream_active",
+        "action_params": {
+            "eth_dst_addr": "08:00:00:00:02:22",
+            "vid": 2,
+            "pcp": 4
+        }
+    },
+    # Data (Text) stream (stream_handle 3)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_id_active",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 3
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.overwrite_stream_active",
+        "action_params": {
+            "eth_dst_addr": "08:00:00:00:02:22",
+            "vid": 3,
+            "pcp": 0
+        }
+    },
+    # Streaming service Stream (stream_handle 4)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_id_active",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 4
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.overwrite_stream_active",
+        "action_params": {
+            "eth_dst_addr": "08:00:00:00:01:11",
+            "vid": 4,
+            "pcp": 3
+        }
+    },
+    # Varied Services Stream (stream_handle 5)
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.stream_id_active",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 5
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.overwrite_stream_active",
+        "action_params": {
+            "eth_dst_addr": "08:00:00:00:01:11",
+            "vid": 5,
+            "pcp": 2
+        }
+    },
+    ############################# Max SDU filter rules (TERNARY and RANGE) #############################
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 1,
+            "hdr.eth_802_1q.pcp": (5, 0x7),  # TERNARY: value, mask # PCP 5 for video
+            "std_md.packet_length": (1, 1500)  # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.none",
+        "action_params": {},
+        "priority": 100
+    },
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 2,
+            "hdr.eth_802_1q.pcp": (4, 0x7), # PCP 4 for video
+            "std_md.packet_length": (1, 1400)
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.none",
+        "action_params": {},
+        "priority": 99
+    },
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 3,
+            "hdr.eth_802_1q.pcp": (0, 0x7), # PCP 0 for data (text)
+            "std_md.packet_length": (1, 1250)
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.none",
+        "action_params": {},
+        "priority": 98
+    },
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 4,
+            "hdr.eth_802_1q.pcp": (3, 0x7), # PCP 3 for streaming service
+            "std_md.packet_length": (1, 1490)
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.none",
+        "action_params": {},
+        "priority": 97
+    },
+    {
+        "table": "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_handle": 5,
+            "hdr.eth_802_1q.pcp": (2, 0x7), # PCP 2 for varied services
+            "std_md.packet_length": (1, 1500)
+        },
+        "action_name": "IngressImpl.psfp_c.streamFilter_c.none",
+        "action_params": {},
+        "priority": 96
+    },
+    ############################# Stream gate instance rules #############################
+    # Assigning inetrval specifications to the frame based on stream gate ID and time difference (arrival time relative to the hyperperiod)
+    # Interval 1 for stream gate ID 1 ([0, 2000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 1,
+            "meta.ingress_md.diff_ts": (0, 2000000) # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 0,
+            "ipv": 2,
+            "interval_identifier": 1,
+            "max_octects_interval": 180000
+        },
+        "priority": 99
+    },
+    # Interval 2 for stream gate ID 1 ([2000000, 8000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 1,
+            "meta.ingress_md.diff_ts": (2000000, 8000000)  # RANGE: min, max , Time in microseconds
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 1,
+            "ipv": 2,
+            "interval_identifier": 2,
+            "max_octects_interval": 0
+        },
+        "priority": 98
+    },
+    # Interval 3 for stream gate ID 1 ([8000000, 16000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 1,
+            "meta.ingress_md.diff_ts": (8000000, 16000000)  # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 0,
+            "ipv": 2,
+            "interval_identifier": 3,
+            "max_octects_interval": 300000
+        },
+        "priority": 97
+    },
+    # Interval 4 for stream gate ID 1 ([16000000, 20000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 1,
+            "meta.ingress_md.diff_ts": (16000000, 20000000)
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 1,
+            "ipv": 2,
+            "interval_identifier": 4,
+            "max_octects_interval": 0
+        },
+        "priority": 96
+    },
+    # Interval 1 for stream gate ID 2 ([0, 6000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 2,
+            "meta.ingress_md.diff_ts": (0, 6000000)  # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 0,
+            "ipv": 9,
+            "interval_identifier": 1,
+            "max_octects_interval": 55000
+        },
+        "priority": 100
+    },
+    # Interval 2 for stream gate ID 2 ([6000000, 10000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 2,
+            "meta.ingress_md.diff_ts": (6000000, 10000000)  # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 1,
+            "ipv": 9,
+            "interval_identifier": 2,
+            "max_octects_interval": 0
+        },
+        "priority": 99
+    },
+    # Interval 3 for stream gate ID 2 ([10000000, 16000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 2,
+            "meta.ingress_md.diff_ts": (10000000, 16000000)  # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 0,
+            "ipv": 9,
+            "interval_identifier": 3,
+            "max_octects_interval": 150000
+        },
+        "priority": 98
+    },
+    # Interval 1 for stream gate ID 3 ([0, 2000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 3,
+            "meta.ingress_md.diff_ts": (0, 2000000)
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 1,
+            "ipv": 12,
+            "interval_identifier": 1,
+            "max_octects_interval": 0
+        },
+        "priority": 99
+    },
+    # Interval 2 for stream gate ID 3 ([2000000, 12000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 3,
+            "meta.ingress_md.diff_ts": (2000000, 12000000)  # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 0,
+            "ipv": 12,
+            "interval_identifier": 2,
+            "max_octects_interval": 40000
+        },
+        "priority": 98
+    },
+    # Interval 3 for stream gate ID 3 ([12000000, 14000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 3,
+            "meta.ingress_md.diff_ts": (12000000, 14000000)  # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 1,
+            "ipv": 12,
+            "interval_identifier": 3,
+            "max_octects_interval": 0
+        },
+        "priority": 97
+    },
+    # Interval 4 for stream gate ID 3 ([14000000, 18000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 3,
+            "meta.ingress_md.diff_ts": (14000000, 18000000)  # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 0,
+            "ipv": 12,
+            "interval_identifier": 4,
+            "max_octects_interval": 260000
+        },
+        "priority": 96
+    },
+    # Interval 5 for stream gate ID 3 ([18000000, 22000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 3,
+            "meta.ingress_md.diff_ts": (18000000, 22000000)  # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 1,
+            "ipv": 12,
+            "interval_identifier": 5,
+            "max_octects_interval": 0
+        },
+        "priority": 95
+    },
+    # Interval 1 for stream gate ID 4 ([0, 10000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 4,
+            "meta.ingress_md.diff_ts": (0, 10000000)  # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 0,
+            "ipv": 12,
+            "interval_identifier": 1,
+            "max_octects_interval": 100000
+        },
+        "priority": 101
+    },
+    # Interval 2 for stream gate ID 4 ([10000000, 20000000 (microseconds)])
+    {
+        "table": "IngressImpl.psfp_c.streamGate_c.stream_gate_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.stream_gate_id": 4,
+            "meta.ingress_md.diff_ts": (10000000, 20000000)  # RANGE: min, max
+        },
+        "action_name": "IngressImpl.psfp_c.streamGate_c.set_gate_and_ipv",
+        "action_params": {
+            "gate_state": 1,
+            "ipv": 12,
+            "interval_identifier": 2,
+            "max_octects_interval": 0
+        },
+        "priority": 100
+    },
+    ############################# Flow meter config rules #############################
+    # Assigning flow meter configurations based on flow meter instance IDs
+    # Flow meter instance ID 1
+    {
+        "table": "IngressImpl.psfp_c.flowMeter_c.flow_meter_config",
+        "match": {
+            "meta.ingress_md.stream_filter.flow_meter_instance_id": 1
+        },
+        "action_name": "IngressImpl.psfp_c.flowMeter_c.set_flow_meter_config",
+        "action_params": {
+            "dropOnYellow": 1,
+            "markAllFramesRedEnable": 1,
+            "colorAware": 1
+        }
+    },
+    # Flow meter instance ID 2
+    {
+        "table": "IngressImpl.psfp_c.flowMeter_c.flow_meter_config",
+        "match": {
+            "meta.ingress_md.stream_filter.flow_meter_instance_id": 2
+        },
+        "action_name": "IngressImpl.psfp_c.flowMeter_c.set_flow_meter_config",
+        "action_params": {
+            "dropOnYellow": 1,
+            "markAllFramesRedEnable": 0,
+            "colorAware": 1
+        }
+    },
+    ############################# Flow meter instance rules #############################
+    # Applying flow meter instances coloring based on stream filter instance IDs
+    # Flow meter instance ID 1 (used by stream handle 1, 3 and 5)
+    {
+        "table": "IngressImpl.psfp_c.flowMeter_c.flow_meter_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.flow_meter_instance_id": 1
+        },
+        "action_name": "IngressImpl.psfp_c.flowMeter_c.set_color_direct",
+        "action_params": {}
+    },
+    # Flow meter instance ID 2 (used by stream handle 2 and 4)
+    {
+        "table": "IngressImpl.psfp_c.flowMeter_c.flow_meter_instance",
+        "match": {
+            "meta.ingress_md.stream_filter.flow_meter_instance_id": 2
+        },
+        "action_name": "IngressImpl.psfp_c.flowMeter_c.set_color_direct",
+        "action_params": {}
+    }
+]
+
+# Hyperperiod per stream gate, in SECONDS (see program_hyperperiods)
+HYPERPERIOD_SECONDS = {
+    1: 20,   # Stream Gate 1: 20 seconds
+    2: 16,   # Stream Gate 2: 16 seconds
+    3: 26,   # Stream Gate 3: 26 seconds
+    4: 20    # Stream Gate 4: 20 seconds
+}
+
+# Direct meter bands (CIR/PIR in bytes per second, bursts in bytes)
+DIRECT_METERS = [
+    {
+        "meter": "IngressImpl.psfp_c.flowMeter_c.flow_meter",
+        "index": 1,
+        "cir": 100000,
+        "cburst": 4096,
+        "pir": 200000,
+        "pburst": 8192
+    }
+]
+
+GATE_TABLE = "IngressImpl.psfp_c.streamGate_c.stream_gate_instance"
+STREAM_ID_TABLE = "IngressImpl.psfp_c.streamFilter_c.stream_id"
+STREAM_FILTER_TABLE = "IngressImpl.psfp_c.streamFilter_c.stream_filter_instance"
+MAX_SDU_TABLE = "IngressImpl.psfp_c.streamFilter_c.max_sdu_filter"
+STREAM_ID_ACTIVE_TABLE = "IngressImpl.psfp_c.streamFilter_c.stream_id_active"
+FLOW_METER_CONFIG_TABLE = "IngressImpl.psfp_c.flowMeter_c.flow_meter_config"
+FLOW_METER_INSTANCE_TABLE = "IngressImpl.psfp_c.flowMeter_c.flow_meter_instance"
+FLOW_METER = "IngressImpl.psfp_c.flowMeter_c.flow_meter"
+IPV4_TABLE = "IngressImpl.ipv4_c.ipv4"
+HYPERPERIOD_TABLE = "IngressImpl.psfp_c.hyperperiod_state"
+HYPERPERIOD_ACTION = "IngressImpl.psfp_c.set_hyperperiod_state"
+GATE_ID_FIELD = "meta.ingress_md.stream_filter.stream_gate_id"
+# The switch timestamps (ingress_global_timestamp) are 48-bit microseconds
+TIMESTAMP_BITS = 48
+
+# Tables in dependency order: a table only matches on metadata set by the
+# tables after it (stream_id assigns the stream handle the filter tables
+# match, stream_filter_instance the gate and flow meter IDs), so entries are
+# added from the first table to the last and removed from the last to the
+# first, and a stream never hits an entry whose targets are missing
+TABLE_ORDER = [
+    IPV4_TABLE,
+    FLOW_METER_CONFIG_TABLE,
+    FLOW_METER_INSTANCE_TABLE,
+    GATE_TABLE,
+    MAX_SDU_TABLE,
+    STREAM_FILTER_TABLE,
+    STREAM_ID_ACTIVE_TABLE,
+    STREAM_ID_TABLE
+]
+
+GATE_OPEN = 0
+GATE_CLOSED = 1
+
+
+def load_runtime_config(path=None):
+    """
+    Loads a runtime configuration.
+
+    Without a path, the configuration installed by mycontroller.py is returned.
+    A runtime JSON file (s1-runtime.json format) may carry the optional
+    "hyperperiods" ({gate_id: seconds}) and "meters" keys; missing keys fall
+    back to the controller defaults.
+
+    :param path: optional runtime JSON file
+    :return: dict with "table_entries", "hyperperiods" and "meters"
+    """
+    if path is None:
+        return {
+            "table_entries": TABLE_ENTRIES,
+            "hyperperiods": dict(HYPERPERIOD_SECONDS),
+            "meters": DIRECT_METERS
+        }
+
+    with open(path) as f:
+        runtime = json.load(f)
+    hyperperiods = runtime.get("hyperperiods")
+    if hyperperiods is None:
+        hyperperiods = HYPERPERIOD_SECONDS
+    return {
+        "table_entries": runtime.get("table_entries", []),
+        "hyperperiods": {int(gate_id): secs for gate_id, secs in hyperperiods.items()},
+        "meters": runtime.get("meters", DIRECT_METERS)
+    }
+
+
+def entry_key(entry):
+    """
+    Identity of a table entry: its table and match fields (and priority),
+    or its table only for the default action.
+    """
+    if entry.get("default_action"):
+        return entry["table"], None, None
+    return entry["table"], json.dumps(entry.get("match", {}), sort_keys=True), entry.get("priority")
+
+
+def diff_table_entries(old_entries, new_entries):
+    """
+    Updates turning one list of table entries into another.
+
+    Entries are compared by entry_key(): new keys are inserted, keys whose
+    action or parameters changed are modified and missing keys deleted
+    (default actions are never deleted, a removed one keeps its last value).
+    Deletions come first, from the last table of TABLE_ORDER to the first,
+    then insertions and modifications from the first table to the last.
+
+    :param old_entries: entries installed, in s1-runtime.json format
+    :param new_entries: entries wanted
+    :return: list of ("INSERT" | "MODIFY" | "DELETE", entry)
+    """
+    old = {entry_key(entry): entry for entry in old_entries}
+    new = {entry_key(entry): entry for entry in new_entries}
+    rank = {table: i for i, table in enumerate(TABLE_ORDER)}
+
+    def order(key):
+        # Tables outside TABLE_ORDER first: nothing is known to depend on them
+        return rank.get(key[0], -1)
+
+    deletes = [key for key in old if key not in new and key[1] is not None]
+    changes = []
+    for key, entry in new.items():
+        if key not in old:
+            changes.append(("MODIFY" if key[1] is None else "INSERT", key))
+        elif (entry["action_name"], entry["action_params"]) != (old[key]["action_name"], old[key]["action_params"]):
+            changes.append(("MODIFY", key))
+    updates = [("DELETE", old[key]) for key in sorted(deletes, key=order, reverse=True)]
+    updates += [(update_type, new[key]) for update_type, key in sorted(changes, key=lambda c: order(c[1]))]
+    return updates
+
+
+def revert_updates(old_entries, updates):
+    """
+    Updates undoing a list of updates applied over a list of table entries:
+    the inverse of every update, last first.
+
+    :param old_entries: entries installed before the updates
+    :param updates: list of (update type, entry) as from diff_table_entries
+    :return: list of ("INSERT" | "MODIFY" | "DELETE", entry)
+    """
+    old = {entry_key(entry): entry for entry in old_entries}
+    reverts = []
+    for update_type, entry in reversed(updates):
+        if update_type == "INSERT":
+            reverts.append(("DELETE", entry))
+        elif update_type == "DELETE":
+            reverts.append(("INSERT", entry))
+        elif entry_key(entry) in old:
+            reverts.append(("MODIFY", old[entry_key(entry)]))
+    return reverts
+
+
+def hyperperiod_anchor():
+    """
+    Start of the current hyperperiods: now, in microseconds since the
+    epoch truncated to the 48 bits of the switch timestamps.
+    """
+    return int(time.time() * 1_000_000) & ((1 << TIMESTAMP_BITS) - 1)
+
+
+def hyperperiod_state_entries(table_entries, hyperperiods, installed=(), anchor_us=None):
+    """
+    Table entries with one hyperperiod_state entry per gate of hyperperiods.
+
+    The hyperperiod_state entry of a gate found in table_entries or
+    installed is kept, with its anchor, while its hyperperiod is the same;
+    new gates and changed hyperperiods get an entry anchored at anchor_us,
+    and the entries of the other gates are left out.
+
+    :param table_entries: table entries in s1-runtime.json format
+    :param hyperperiods: {gate_id: seconds}
+    :param installed: entries installed on the switch
+    :param anchor_us: anchor of the new entries, hyperperiod_anchor() by default
+    :return: new list of table entries
+    """
+    current = {}
+    for entry in list(installed) + list(table_entries):
+        if entry["table"] == HYPERPERIOD_TABLE and not entry.get("default_action"):
+            current[entry["match"][GATE_ID_FIELD]] = entry
+    entries = [entry for entry in table_entries
+               if entry["table"] != HYPERPERIOD_TABLE or entry.get("default_action")]
+    for gate_id, secs in sorted(hyperperiods.items()):
+        entry = current.get(gate_id)
+        if entry is None or entry["action_params"]["hyperperiod_ts"] != secs * 1_000_000:
+            if anchor_us is None:
+                anchor_us = hyperperiod_anchor()
+            entry = {
+                "table": HYPERPERIOD_TABLE,
+                "match": {GATE_ID_FIELD: gate_id},
+                "action_name": HYPERPERIOD_ACTION,
+                "action_params": {
+                    "gate_id": gate_id,
+                    "hyperperiod_ts": secs * 1_000_000,
+                    "last_hyperperiod": anchor_us
+                }
+            }
+        entries.append(entry)
+    return entries
+
+
+def gate_schedule(table_entries):
+    """
+    Extracts the stream gate intervals from a list of table entries.
+
+    :param table_entries: table entries in s1-runtime.json format
+    :return: {gate_id: [interval, ...]} sorted by start, where each interval is
+             a dict with start_us, end_us, gate_state, ipv, interval_identifier,
+             max_octets and priority (of the entry, 0 when it has none)
+    """
+    schedule = {}
+    for entry in table_entries:
+        if entry["table"] != GATE_TABLE or entry.get("default_action"):
+            continue
+        match = entry["match"]
+        params = entry["action_params"]
+        start, end = match["meta.ingress_md.diff_ts"]
+        schedule.setdefault(match["meta.ingress_md.stream_filter.stream_gate_id"], []).append({
+            "start_us": start,
+            "end_us": end,
+            "gate_state": params["gate_state"],
+            "ipv": params["ipv"],
+            "interval_identifier": params["interval_identifier"],
+            "max_octets": params["max_octects_interval"],
+            "priority": entry.get("priority") or 0
+        })
+    for intervals in schedule.values():
+        intervals.sort(key=lambda i: i["start_us"])
+    return schedule
+
+
+def gate_windows(intervals, hyperperiod_us):
+    """
+    Splits one hyperperiod into open and closed windows.
+
+    Where intervals overlap, the switch applies the one of highest priority
+    (the first of the list between equal priorities), so each part of the
+    hyperperiod takes the state of that interval. Parts not covered by any
+    interval miss the gate table and are dropped by the switch; they are
+    returned as closed windows with no interval_identifier.
+
+    :param intervals: intervals of one gate, as returned by gate_schedule
+    :param hyperperiod_us: hyperperiod of the gate in microseconds
+    :return: list of (start_us, end_us, gate_state, interval_identifier)
+    """
+    limit = hyperperiod_us + 1
+    ordered = sorted(range(len(intervals)), key=lambda i: intervals[i]["start_us"])
+    bounds = {0, limit}
+    for interval in intervals:
+        bounds.update(min(max(b, 0), limit) for b in (interval["start_us"], interval["end_us"] + 1))
+    bounds = sorted(bounds)
+
+    windows = []
+    active = []
+    pending = 0
+    for start, next_start in zip(bounds, bounds[1:]):
+        while pending < len(ordered) and intervals[ordered[pending]]["start_us"] <= start:
+            i = ordered[pending]
+            heapq.heappush(active, (-(intervals[i].get("priority") or 0), i))
+            pending += 1
+        # Intervals ended before this part leave the heap when they surface
+        while active and intervals[active[0][1]]["end_us"] < start:
+            heapq.heappop(active)
+        if active:
+            interval = intervals[active[0][1]]
+            state = (interval["gate_state"], interval["interval_identifier"])
+        else:
+            state = (GATE_CLOSED, None)
+        if windows and windows[-1][2:] == state and windows[-1][1] == start - 1:
+            windows[-1] = (windows[-1][0], next_start - 1) + state
+        else:
+            windows.append((start, next_start - 1) + state)
+    return windows
+
+
+def gate_streams(table_entries):
+    """
+    Resolves the streams that go through each stream gate.
+
+    :param table_entries: table entries in s1-runtime.json format
+    :return: {gate_id: [stream, ...]}, where each stream is a dict with
+             stream_handle, dst_mac, vid, pcp, max_sdu, flow_meter_instance_id
+             and dst_ip (None when no IPv4 route forwards to dst_mac)
+    """
+    streams = {}
+    filters = {}
+    routes = {}
+    for entry in table_entries:
+        if entry.get("default_action"):
+            continue
+        match = entry["match"]
+        params = entry["action_params"]
+        if entry["table"] == STREAM_ID_TABLE:
+            streams[params["stream_handle"]] = {
+                "stream_handle": params["stream_handle"],
+                "dst_mac": match["hdr.ethernet.dst_addr"],
+                "vid": match["hdr.eth_802_1q.vid"],
+                "pcp": 0,
+                "max_sdu": None,
+                "flow_meter_instance_id": None,
+                "dst_ip": None
+            }
+        elif entry["table"] == STREAM_FILTER_TABLE:
+            filters[match["meta.ingress_md.stream_filter.stream_handle"]] = params
+        elif entry["table"] == IPV4_TABLE:
+            routes.setdefault(params["eth_dst_addr"], match["hdr.ipv4.dstAddr"][0])
+
+    for entry in table_entries:
+        if entry["table"] == MAX_SDU_TABLE and not entry.get("default_action"):
+            match = entry["match"]
+            stream = streams.get(match["meta.ingress_md.stream_filter.stream_handle"])
+            if stream is not None:
+                stream["pcp"] = match["hdr.eth_802_1q.pcp"][0]
+                stream["max_sdu"] = match["std_md.packet_length"][1]
+
+    result = {}
+    for handle, stream in sorted(streams.items()):
+        stream["dst_ip"] = routes.get(stream["dst_mac"])
+        if handle in filters:
+            stream["flow_meter_instance_id"] = filters[handle]["flow_meter_instance_id"]
+            result.setdefault(filters[handle]["stream_gate_id"], []).append(stream)
+    return result
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: GPL-2.0-only
 # Reason-GPL: import-scapy
+import argparse
 import os
 import sys
 
@@ -50,10 +51,62 @@ def handle_pkt(pkt):
 
 
 def main():
-    ifaces = [i for i in os.listdir('/sys/class/net/') if 'eth' in i]
-    iface = ifaces[0]
+    parser = argparse.ArgumentParser(description='Receive the PSFP test traffic')
+    parser.add_argument('--fast', help='High-rate mode: BPF-filtered raw socket and per-stream summaries '
+                        'instead of per-packet dumps', action="store_true")
+    parser.add_argument('--latency', help='Fast mode plus one-way latency, jitter, loss and reordering of '
+                        'the generators\' probe streams', action="store_true")
+    parser.add_argument('--iface', help='Interface (default: the first eth interface)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--port', help='Destination port to receive (UDP and TCP, fast mode)',
+                        type=int, action="store", required=False, default=1234)
+    parser.add_argument('--interval', help='Seconds between summaries (fast mode)',
+                        type=float, action="store", required=False, default=1.0)
+    parser.add_argument('--snaplen', help='Bytes of each frame copied to user space (fast mode)',
+                        type=int, action="store", required=False, default=128)
+    parser.add_argument('--duration', help='Stop after this many seconds (fast mode, 0: run until Ctrl-C)',
+                        type=float, action="store", required=False, default=0.0)
+    parser.add_argument('--stats-log', help='Also write the summaries as JSONL records to this file (fast mode)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--ring', help='Fast mode on a zero-copy TPACKET_V3 mmap ring instead of recvmsg',
+                        action="store_true")
+    parser.add_argument('--block-kb', help='Ring block size in KiB (ring mode)',
+                        type=int, action="store", required=False, default=1024)
+    parser.add_argument('--blocks', help='Number of ring blocks (ring mode)',
+                        type=int, action="store", required=False, default=64)
+    parser.add_argument('--block-timeout-ms', help='Ring block retire timeout in ms (ring mode)',
+                        type=int, action="store", required=False, default=10)
+    args = parser.parse_args()
+
+    iface = args.iface
+    if iface is None:
+        ifaces = [i for i in os.listdir('/sys/class/net/') if 'eth' in i]
+        iface = ifaces[0]
     print("sniffing on %s" % iface)
     sys.stdout.flush()
+    if args.fast or args.latency or args.ring:
+        import rx_stats
+        handlers = []
+        report = None
+        writer = None
+        if args.stats_log:
+            import stats_log
+            writer = stats_log.StatsWriter(args.stats_log, "receiver")
+        if args.latency:
+            import rx_latency
+            latency = rx_latency.LatencyStats(writer)
+            handlers.append(latency)
+            report = latency.report
+        ring = None
+        if args.ring:
+            ring = {"block_size": args.block_kb << 10, "blocks": args.blocks, "timeout_ms": args.block_timeout_ms}
+        rx_stats.run(iface, port=args.port, interval=args.interval, snaplen=args.snaplen,
+                     duration=args.duration, handlers=handlers, report=report, ring=ring, writer=writer)
+        if args.latency:
+            latency.print_total()
+        if writer:
+            writer.close()
+        return
     sniff(iface = iface,
           prn = lambda x: handle_pkt(x))
 
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Bulk reader of the PSFP registers as NumPy arrays.
+
+The whole arrays are read with one Read request holding a wildcard
+RegisterEntry (no index) per register, and decoded straight from the
+response bytes into one array per register, typed after the p4info
+bitwidth (uint8 up to uint64, object above):
+
+    reader = RegisterReader(p4info_helper.p4info, ["reg_gate_blocked", "octets_per_interval"])
+    arrays = reader.read(sw)
+    np.flatnonzero(arrays["IngressImpl.psfp_c.streamGate_c.reg_gate_blocked"])   # gates closed for good
+
+Registers are selected by full name or last name component. From the
+command line, once or every --interval seconds, with the latest snapshot
+kept in an .npz file (load_snapshot):
+
+    ./register_reader.py                                        # all registers of s1
+    ./register_reader.py reg_gate_blocked reg_filter_blocked --interval 5 --output logs/registers.npz
+
+mycontroller.py --register-interval reads them while controlling the
+switches and logs a "register" record per register (stats_log.py).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Import P4Runtime lib from parent utils dir
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
+
+import grpc
+import p4runtime_lib.bmv2
+import p4runtime_lib.helper
+from p4runtime_lib.error_utils import printGrpcError
+from p4runtime_lib.switch import ShutdownAllSwitchConnections
+
+from p4.v1 import p4runtime_pb2
+
+from state_verify import ENTITIES_TAG, READ_METHOD, read_varint
+
+# Wire tags: Entity.register_entry, RegisterEntry.register_id / index / data,
+# Index.index, P4Data.bitstring
+REGISTER_ENTRY_TAG = 0x5a
+REGISTER_ID_TAG = 0x08
+INDEX_TAG = 0x12
+DATA_TAG = 0x1a
+INDEX_VALUE_TAG = 0x08
+BITSTRING_TAG = 0x0a
+# Indices printed per register
+SUMMARY_LIMIT = 16
+
+
+def register_dtype(width):
+    for bits, dtype in ((8, np.uint8), (16, np.uint16), (32, np.uint32), (64, np.uint64)):
+        if width <= bits:
+            return dtype
+    return object
+
+
+def fields(data):
+    """
+    (tag, value) of the fields of a serialized message: varints as int,
+    length-delimited fields as bytes.
+    """
+    pos = 0
+    while pos < len(data):
+        tag, pos = read_varint(data, pos)
+        wire_type = tag & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"unsupported wire type {wire_type}")
+        yield tag, value
+
+
+def decode_register_entry(data):
+    """
+    :return: (register ID, index, value) of a serialized RegisterEntry
+    """
+    register_id = index = value = 0
+    for tag, field in fields(data):
+        if tag == REGISTER_ID_TAG:
+            register_id = field
+        elif tag == INDEX_TAG:
+            for inner_tag, inner in fields(field):
+                if inner_tag == INDEX_VALUE_TAG:
+                    index = inner
+        elif tag == DATA_TAG:
+            for inner_tag, inner in fields(field):
+                if inner_tag == BITSTRING_TAG:
+                    value = int.from_bytes(inner, "big")
+    return register_id, index, value
+
+
+class RegisterReader:
+    """
+    Reads whole register arrays of a switch.
+
+    :param p4info: the p4info of the pipeline
+    :param names: registers to read, by full name or last name component
+                  (all of them when None)
+    :raise ValueError: a name matches no register
+    """
+
+    def __init__(self, p4info, names=None):
+        self.registers = {}
+        for reg in p4info.registers:
+            name = reg.preamble.name
+            if names is None or name in names or name.rsplit(".", 1)[-1] in names:
+                width = reg.type_spec.bitstring.bit.bitwidth
+                self.registers[reg.preamble.id] = (name, width, reg.size, register_dtype(width))
+        known = {name for name, _, _, _ in self.registers.values()}
+        unknown = [n for n in names or () if not any(n == name or n == name.rsplit(".", 1)[-1] for name in known)]
+        if unknown:
+            raise ValueError(f"unknown registers: {', '.join(unknown)}")
+
+    def request(self, device_id):
+        request = p4runtime_pb2.ReadRequest()
+        request.device_id = device_id
+        for register_id in self.registers:
+            request.entities.add().register_entry.register_id = register_id
+        return request
+
+    def decode(self, responses):
+        """
+        Arrays of serialized ReadResponses.
+
+        :return: {register name: array}, zero where the switch sent no value
+        """
+        values = {register_id: ([], []) for register_id in self.registers}
+        for response in responses:
+            pos = 0
+            while pos < len(response):
+                tag, pos = read_varint(response, pos)
+                length, pos = read_varint(response, pos)
+                entity = response[pos:pos + length]
+                pos += length
+                if tag != ENTITIES_TAG:
+                    continue
+                for entity_tag, register_entry in fields(entity):
+                    if entity_tag != REGISTER_ENTRY_TAG:
+                        continue
+                    register_id, index, value = decode_register_entry(register_entry)
+                    if register_id in values:
+                        values[register_id][0].append(index)
+                        values[register_id][1].append(value)
+        arrays = {}
+        for register_id, (name, _, size, dtype) in self.registers.items():
+            indexes, data = values[register_id]
+            array = np.zeros(size, dtype=dtype)
+            if indexes:
+                indexes = np.array(indexes, dtype=np.int64)
+                valid = (indexes >= 0) & (indexes < size)
+                array[indexes[valid]] = np.array(data, dtype=dtype)[valid]
+            arrays[name] = array
+        return arrays
+
+    def read(self, sw):
+        """
+        Reads the registers of a switch with one Read.
+
+        :return: {register name: array}
+        :raise grpc.RpcError: the Read failed
+        """
+        read = sw.channel.unary_stream(READ_METHOD, request_serializer=p4runtime_pb2.ReadRequest.SerializeToString,
+                                       response_deserializer=None)
+        return self.decode(read(self.request(sw.device_id)))
+
+
+def save_snapshot(path, arrays, taken=None):
+    """
+    Writes arrays (RegisterReader.read) to a compressed .npz file, with
+    the time they were read ("taken", epoch seconds).
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, taken=np.float64(time.time() if taken is None else taken), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    """
+    :return: (taken, {register name: array})
+    """
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files if name != "taken"}
+        return float(data["taken"]), arrays
+
+
+def summarize(arrays, limit=SUMMARY_LIMIT):
+    """
+    One line per register: size, non-zero entries and the first of them.
+    """
+    lines = []
+    for name, array in arrays.items():
+        nonzero = np.flatnonzero(array)
+        shown = ", ".join(f"{i}={array[i]}" for i in nonzero[:limit])
+        more = f", ... ({len(nonzero) - limit} more)" if len(nonzero) > limit else ""
+        lines.append(f"{name}[{len(array)}]: {len(nonzero)} non-zero" + (f": {shown}{more}" if shown else ""))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read whole register arrays of a switch')
+    parser.add_argument('registers', help='Registers, by full name or last name component (default: all)',
+                        nargs='*')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False, default='./build/sdn-psfp.p4.p4info.txtpb')
+    parser.add_argument('--address', help='P4Runtime address of the switch',
+                        type=str, action="store", required=False, default='127.0.0.1:50051')
+    parser.add_argument('--device-id', help='Device ID of the switch',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--interval', help='Seconds between two reads (default: read once)',
+                        type=float, action="store", required=False, default=None)
+    parser.add_argument('--output', help='Keep the latest read in this .npz file',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--limit', help='Non-zero indices printed per register',
+                        type=int, action="store", required=False, default=SUMMARY_LIMIT)
+    args = parser.parse_args()
+
+    p4info_helper = p4runtime_lib.helper.P4InfoHelper(args.p4info)
+    try:
+        reader = RegisterReader(p4info_helper.p4info, args.registers or None)
+    except ValueError as e:
+        parser.error(str(e))
+    sw = p4runtime_lib.bmv2.Bmv2SwitchConnection(name="switch", address=args.address, device_id=args.device_id)
+    try:
+        while True:
+            start = time.perf_counter()
+            taken = time.time()
+            arrays = reader.read(sw)
+            print(f"{len(arrays)} registers of {args.address} in {(time.perf_counter() - start) * 1000:.1f} ms")
+            for line in summarize(arrays, args.limit):
+                print(f"  {line}")
+            if args.output:
+                save_snapshot(args.output, arrays, taken)
+            if args.interval is None:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    except grpc.RpcError as e:
+        printGrpcError(e)
+        sys.exit(1)
+    finally:
+        ShutdownAllSwitchConnections()
+
+
+if __name__ == '__main__':
+    main()
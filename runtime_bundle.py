@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Precompiled WriteRequest bundles of a runtime configuration.
+
+Building the table entries of a runtime config (buildTableEntry encoding
+every MAC, IP and range) dominates the provisioning time of large tables.
+The compile step does it once and stores the updates as serialized
+WriteRequest chunks:
+
+    ./runtime_bundle.py pod-topo/s1-runtime.json     # -> build/s1-runtime.bundle
+    ./runtime_bundle.py                              # controller defaults -> build/psfp-runtime.bundle
+
+File layout (integers big endian):
+
+    magic "PSFPWRB1" | SHA-256 of the p4info | SHA-256 of the table entries
+    | u32 chunk count | chunk count x (u32 update count, u32 length,
+    serialized "updates" fields of a WriteRequest)
+
+A chunk holds only the updates, so the controller memory-maps the file and
+sends every chunk as the device ID and election ID of its switch followed
+by the chunk bytes, without building or encoding any message. The bundle
+is only used when both hashes match the p4info and the table entries the
+controller is about to install; otherwise the entries are built as before.
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from datetime import datetime
+
+# Import P4Runtime lib from parent utils dir
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
+
+import grpc
+import p4runtime_lib.helper
+
+from p4.v1 import p4runtime_pb2
+
+from psfp_runtime import load_runtime_config
+
+MAGIC = b"PSFPWRB1"
+HEADER = struct.Struct(">8s32s32sI")
+CHUNK = struct.Struct(">II")
+BUILD_DIR = "build"
+DEFAULT_NAME = "psfp-runtime"
+# Updates per WriteRequest, well below the 4 MB gRPC message limit
+DEFAULT_CHUNK_UPDATES = 1000
+WRITE_METHOD = "/p4.v1.P4Runtime/Write"
+
+
+def bundle_path(runtime_path=None, build_dir=BUILD_DIR):
+    """
+    Bundle file of a runtime JSON (build/<name>.bundle), or of the
+    controller defaults when runtime_path is None.
+    """
+    name = os.path.splitext(os.path.basename(runtime_path))[0] if runtime_path else DEFAULT_NAME
+    return os.path.join(build_dir, name + ".bundle")
+
+
+def p4info_hash(p4info):
+    return hashlib.sha256(p4info.SerializeToString(deterministic=True)).digest()
+
+
+def entries_hash(table_entries):
+    """
+    Hash of table entries in s1-runtime.json format, independent of the
+    key order of the JSON objects.
+    """
+    return hashlib.sha256(json.dumps(table_entries, sort_keys=True, separators=(",", ":")).encode()).digest()
+
+
+def build_update(p4info_helper, entry, update_type=None):
+    """
+    Update writing one table entry.
+
+    :param update_type: "INSERT", "MODIFY" or "DELETE"; by default the
+                        entry is installed as SwitchConnection.WriteTableEntry
+                        does (MODIFY for a default action, INSERT otherwise)
+    """
+    update = p4runtime_pb2.Update()
+    table_entry = p4info_helper.buildTableEntry(
+        table_name=entry["table"],
+        match_fields=entry.get("match", {}),
+        default_action=entry.get("default_action", False),
+        action_name=entry["action_name"],
+        action_params=entry["action_params"],
+        priority=entry.get("priority")
+    )
+    if update_type is None:
+        update_type = "MODIFY" if table_entry.is_default_action else "INSERT"
+    update.type = p4runtime_pb2.Update.Type.Value(update_type)
+    update.entity.table_entry.CopyFrom(table_entry)
+    return update
+
+
+def log_write(path, request):
+    """
+    Appends a Write to a request log (the proto_dump_file of a switch
+    connection) as p4runtime_lib.switch.GrpcRequestLogger does, but in
+    full however long it is, so p4runtime_log.py sees every update.
+    """
+    with open(path, "a") as f:
+        ts = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        f.write(f"\n[{ts}] {WRITE_METHOD}\n---\n{request}---\n")
+
+
+def compile_bundle(p4info_helper, table_entries, path, chunk_updates=DEFAULT_CHUNK_UPDATES):
+    """
+    Writes the bundle of a list of table entries.
+
+    :param table_entries: table entries in s1-runtime.json format
+    :param chunk_updates: updates per WriteRequest
+    :return: number of chunks written
+    """
+    chunks = []
+    request = p4runtime_pb2.WriteRequest()
+    for entry in table_entries:
+        request.updates.append(build_update(p4info_helper, entry))
+        if len(request.updates) == chunk_updates:
+            chunks.append((len(request.updates), request.SerializeToString()))
+            request = p4runtime_pb2.WriteRequest()
+    if request.updates:
+        chunks.append((len(request.updates), request.SerializeToString()))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, p4info_hash(p4info_helper.p4info), entries_hash(table_entries), len(chunks)))
+        for count, data in chunks:
+            f.write(CHUNK.pack(count, len(data)))
+            f.write(data)
+    os.replace(tmp_path, path)
+    return len(chunks)
+
+
+class Bundle:
+    """
+    Memory-mapped bundle file.
+
+    :param path: the bundle file
+    :raise ValueError: the file is not a bundle
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            self.close()
+            raise ValueError(f"{path}: truncated bundle")
+        magic, self.p4info_hash, self.entries_hash, count = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path}: not a bundle")
+        self.chunks = []
+        offset = HEADER.size
+        for _ in range(count):
+            updates, length = CHUNK.unpack_from(self.map, offset)
+            offset += CHUNK.size
+            if offset + length > len(self.map):
+                self.close()
+                raise ValueError(f"{path}: truncated bundle")
+            self.chunks.append((updates, offset, length))
+            offset += length
+
+    def matches(self, p4info, table_entries):
+        """
+        Whether the bundle was compiled from this p4info and these entries.
+        """
+        return self.p4info_hash == p4info_hash(p4info) and self.entries_hash == entries_hash(table_entries)
+
+    def updates(self):
+        return sum(updates for updates, _, _ in self.chunks)
+
+    def send(self, sw):
+        """
+        Sends every chunk as one Write RPC to a switch.
+
+        The chunks are only decoded to be logged when the connection has a
+        request log (proto_dump_file).
+
+        :param sw: the switch connection (its device_id and election_id are used)
+        :raise grpc.RpcError: a Write failed
+        """
+        prefix = p4runtime_pb2.WriteRequest()
+        prefix.device_id = sw.device_id
+        prefix.election_id.low = sw.election_id
+        prefix = prefix.SerializeToString()
+        # Raw bytes in, parsed response out, bypassing the request logger
+        # interceptor of the connection (mycontroller.ControllerConnection)
+        channel = getattr(sw, "raw_channel", sw.channel)
+        log_file = getattr(sw, "proto_dump_file", None) if channel is not sw.channel else None
+        write = channel.unary_unary(WRITE_METHOD, request_serializer=None,
+                                    response_deserializer=p4runtime_pb2.WriteResponse.FromString)
+        # The raw channel bypasses the recording stub: keep the shadow state
+        # (shadow_state.py) of the switch up to date here
+        shadow = getattr(sw, "shadow", None)
+        for _, offset, length in self.chunks:
+            chunk = self.map[offset:offset + length]
+            if log_file:
+                log_write(log_file, p4runtime_pb2.WriteRequest.FromString(prefix + chunk))
+            try:
+                write(prefix + chunk)
+            except grpc.RpcError:
+                if shadow is not None:
+                    shadow.record_failure()
+                raise
+            if shadow is not None:
+                shadow.record_serialized(chunk)
+
+    def close(self):
+        self.map.close()
+
+
+def open_bundle(path, p4info, table_entries):
+    """
+    Opens the bundle of a runtime configuration if it is up to date.
+
+    :return: (Bundle or None, why an existing bundle is not used or None)
+    """
+    if not path or not os.path.exists(path):
+        return None, None
+    try:
+        bundle = Bundle(path)
+    except ValueError as e:
+        return None, str(e)
+    if not bundle.matches(p4info, table_entries):
+        bundle.close()
+        return None, f"{path} was compiled for another p4info or runtime config"
+    return bundle, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile a runtime config into WriteRequest bundles')
+    parser.add_argument('runtime', help='Runtime JSON (default: the entries installed by mycontroller.py)',
+                        nargs='?', default=None)
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False, default='./build/sdn-psfp.p4.p4info.txtpb')
+    parser.add_argument('--output', help='Bundle file (default: build/<runtime name>.bundle)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--chunk-updates', help='Updates per WriteRequest',
+                        type=int, action="store", required=False, default=DEFAULT_CHUNK_UPDATES)
+    args = parser.parse_args()
+
+    p4info_helper = p4runtime_lib.helper.P4InfoHelper(args.p4info)
+    table_entries = load_runtime_config(args.runtime)["table_entries"]
+    path = args.output or bundle_path(args.runtime)
+    chunks = compile_bundle(p4info_helper, table_entries, path, args.chunk_updates)
+    print(f"{len(table_entries)} entries in {chunks} WriteRequests: {path} ({os.path.getsize(path)} bytes)")
+
+
+if __name__ == '__main__':
+    main()
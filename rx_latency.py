@@ -0,0 +1,272 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+One-way latency, jitter, loss and reordering of probe streams.
+
+The generators stamp a probe header (pkt_templates.PROBE: probe ID,
+sequence number, send time) at the start of the payload. LatencyStats is a
+rx_stats.Receiver handler that finds it behind the L4 header and tracks,
+per probe ID:
+  - latency: kernel receive time - send time, so the sender and receiver
+    clocks must agree (same host in Mininet, PTP-synchronized otherwise)
+  - jitter: the RFC 3550 interarrival jitter of the latencies
+  - loss: sequence numbers spanned minus frames received
+  - reordering: frames arriving after a higher sequence number
+
+Latencies are recorded in a LogHistogram, whose memory does not grow with
+the number of samples, and the percentiles are reported per interval and
+for the whole run:
+
+    ./receive.py --latency --interval 1
+"""
+
+import math
+
+from pkt_templates import ETH_P_8021Q, PROBE, PROBE_LEN, PROBE_MAGIC, UDP_HLEN
+
+SEQ_MASK = 0xffffffff
+SEQ_HALF = 1 << 31
+# An arrival this far behind the highest sequence is a restarted sender
+RESTART_GAP = 1 << 20
+PERCENTILES = (50, 99, 99.9)
+
+
+class LogHistogram:
+    """
+    Histogram with logarithmic buckets of bounded relative error.
+
+    Values below 2^sub_bits get their own bucket; above, every power of two
+    is split in 2^sub_bits buckets (about 6% wide with the default 4 bits).
+
+    :param sub_bits: log2 of the buckets per power of two
+    :param max_bits: values of 2^max_bits or more go in the last bucket
+    """
+
+    def __init__(self, sub_bits=4, max_bits=40):
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.counts = [0] * ((max_bits - sub_bits + 1) << sub_bits)
+        self.last = len(self.counts) - 1
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bits - 1
+        return min(((shift + 1) << self.sub_bits) + (value >> shift) - self.sub_count, self.last)
+
+    def lower(self, index):
+        """
+        Smallest value of a bucket.
+        """
+        if index < self.sub_count:
+            return index
+        shift = (index >> self.sub_bits) - 1
+        return (self.sub_count + (index & (self.sub_count - 1))) << shift
+
+    def add(self, value):
+        """
+        :param value: a non-negative integer
+        """
+        self.counts[self.index(value)] += 1
+        self.total += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            if count:
+                self.counts[i] += count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, q):
+        """
+        Value below which q percent of the samples fall (bucket midpoint,
+        clamped to the observed min and max).
+        """
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(self.total * q / 100))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                middle = (self.lower(i) + self.lower(i + 1) - 1) / 2 if i < self.last else self.max
+                return min(max(middle, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.total if self.total else None
+
+
+class ProbeStream:
+    """
+    Receive state of one probe ID.
+    """
+
+    def __init__(self, probe_id):
+        self.probe_id = probe_id
+        self.tci = None
+        self.received = 0
+        self.bytes = 0
+        self.first_seq = None
+        self.max_seq = None
+        self.reordered = 0
+        self.restarts = 0
+        self.negative = 0
+        self.last_latency = None
+        self.jitter = 0.0
+        self.interval = LogHistogram()
+        self.total = LogHistogram()
+        self.mark = (0, 0, 0)
+
+    def add(self, seq, latency, length, tci):
+        """
+        :param seq: 32-bit probe sequence number
+        :param latency: receive time - send time in ns
+        :param length: frame length on the wire
+        :param tci: 802.1Q TCI, or None
+        """
+        if self.max_seq is None:
+            self.first_seq = self.max_seq = seq
+        else:
+            delta = ((seq - self.max_seq + SEQ_HALF) & SEQ_MASK) - SEQ_HALF
+            if delta > 0:
+                self.max_seq += delta
+            elif delta > -RESTART_GAP:
+                self.reordered += 1
+            else:
+                # Restarted sender: keep the counters, restart the sequence
+                self.restarts += 1
+                self.first_seq -= self.max_seq - seq + 1
+                self.max_seq = seq
+        self.received += 1
+        self.bytes += length
+        self.tci = tci
+        if latency < 0:
+            self.negative += 1
+            latency = 0
+        if self.last_latency is not None:
+            self.jitter += (abs(latency - self.last_latency) - self.jitter) / 16
+        self.last_latency = latency
+        self.interval.add(latency)
+
+    def expected(self):
+        return self.max_seq - self.first_seq + 1 if self.max_seq is not None else 0
+
+    def interval_counts(self):
+        """
+        Frames received, lost and reordered since the previous call.
+        """
+        current = (self.received, self.expected(), self.reordered)
+        received, expected, reordered = (c - m for c, m in zip(current, self.mark))
+        self.mark = current
+        return received, expected - received, reordered
+
+    def close_interval(self):
+        self.total.merge(self.interval)
+        self.interval.reset()
+
+
+def format_us(value):
+    return "-" if value is None else f"{value / 1000:.1f}"
+
+
+def format_stream(stream, received, lost, reordered, histogram):
+    """
+    One line of latency statistics.
+    """
+    tci = stream.tci
+    tag = "untagged    " if tci is None else f"VID {tci & 0xfff:4d} PCP {tci >> 13}"
+    expected = received + lost
+    loss = 100 * lost / expected if expected > 0 else 0.0
+    percentiles = "/".join(format_us(histogram.percentile(q)) for q in PERCENTILES)
+    return (f"probe {stream.probe_id:#010x} {tag} {received:9d} rx {lost:7d} lost ({loss:6.2f}%) "
+            f"{reordered:6d} reord  latency min {format_us(histogram.min)} "
+            f"p{'/p'.join(f'{q:g}' for q in PERCENTILES)} {percentiles} max {format_us(histogram.max)} "
+            f"jitter {format_us(stream.jitter)} us")
+
+
+def write_stream(writer, stream, received, lost, reordered, histogram, interval):
+    """
+    Writes one "latency" record to a stats_log.StatsWriter (times in ns).
+    """
+    tci = stream.tci
+    percentiles = {f"p{q:g}".replace(".", "_"): histogram.percentile(q) for q in PERCENTILES}
+    writer.write("latency", probe_id=stream.probe_id, vid=None if tci is None else tci & 0xfff,
+                 pcp=None if tci is None else tci >> 13, received=received, lost=lost, reordered=reordered,
+                 min=histogram.min, mean=histogram.mean(), max=histogram.max, jitter=stream.jitter,
+                 interval=interval, **percentiles)
+
+
+class LatencyStats:
+    """
+    rx_stats.Receiver handler collecting the probe streams.
+
+    :param writer: stats_log.StatsWriter receiving the interval reports
+    """
+
+    def __init__(self, writer=None):
+        self.streams = {}
+        self.writer = writer
+
+    def __call__(self, frame, captured, length, tci, now):
+        offset = 18 if (frame[12] << 8 | frame[13]) == ETH_P_8021Q else 14
+        l4 = offset + (frame[offset] & 0x0f) * 4
+        if l4 + 13 > captured:
+            return
+        payload = l4 + (UDP_HLEN if frame[offset + 9] == 17 else (frame[l4 + 12] >> 4) * 4)
+        if payload + PROBE_LEN > captured:
+            return
+        magic, probe_id, seq, sent_ns = PROBE.unpack_from(frame, payload)
+        if magic != PROBE_MAGIC:
+            return
+        stream = self.streams.get(probe_id)
+        if stream is None:
+            stream = self.streams[probe_id] = ProbeStream(probe_id)
+        stream.add(seq, now - sent_ns, length, tci)
+
+    def report(self, seconds=None):
+        """
+        Prints the statistics since the previous report and starts a new
+        interval.
+        """
+        print("----- latency (us) -----")
+        for probe_id in sorted(self.streams):
+            stream = self.streams[probe_id]
+            received, lost, reordered = stream.interval_counts()
+            if received:
+                print(format_stream(stream, received, lost, reordered, stream.interval))
+                if self.writer:
+                    write_stream(self.writer, stream, received, lost, reordered, stream.interval, seconds)
+            stream.close_interval()
+
+    def print_total(self):
+        """
+        Prints the statistics of the whole run.
+        """
+        print("----- latency (us), total -----")
+        for probe_id in sorted(self.streams):
+            stream = self.streams[probe_id]
+            stream.close_interval()
+            print(format_stream(stream, stream.received, stream.expected() - stream.received,
+                                stream.reordered, stream.total))
+            if stream.negative:
+                print(f"  {stream.negative} frames received before their send time: check the clock sync")
+            if stream.restarts:
+                print(f"  sender restarted {stream.restarts} times")
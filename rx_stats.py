@@ -0,0 +1,473 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+High-rate receive path: AF_PACKET socket with a kernel BPF filter, bulk
+non-blocking reads and per-stream counters classified from raw bytes.
+
+The BPF program keeps only IPv4 UDP/TCP frames to the test port (802.1Q
+tagged or not) and truncates them to a snap length, so uninteresting traffic
+never reaches user space and accepted frames are only copied up to the
+headers. veth and most NICs strip the VLAN tag into the packet metadata, so
+the tag is read from PACKET_AUXDATA when present, from the frame otherwise.
+Receive times are the kernel timestamps (SO_TIMESTAMPNS) of the frames.
+
+RingReceiver is the zero-copy variant: the socket gets a TPACKET_V3
+PACKET_RX_RING mapped in memory, the kernel fills blocks of frames, and the
+handlers are given memoryview slices of the frames in place, with no
+syscall or copy per frame. A block goes back to the kernel once walked, so
+handlers must not keep the slices.
+"""
+
+import ctypes
+import mmap
+import select
+import socket
+import struct
+import time
+
+from pkt_templates import DPORT, ETH_P_ALL, ETH_P_8021Q, ETH_P_IP
+
+SOL_PACKET = 263
+PACKET_AUXDATA = 8
+PACKET_STATISTICS = 6
+SO_ATTACH_FILTER = 26
+SO_RCVBUFFORCE = 33
+PACKET_OUTGOING = 4
+TP_STATUS_VLAN_VALID = 0x10
+SO_TIMESTAMPNS = 35
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+_AUXDATA = struct.Struct("=IIIHHHH")
+_TCI = struct.Struct("!H")
+_TIMESPEC = struct.Struct("=qq")
+# struct tpacket_req3
+_TPACKET_REQ3 = struct.Struct("=7I")
+# struct tpacket_block_desc: version, offset_to_priv, then tpacket_hdr_v1
+# block_status, num_pkts, offset_to_first_pkt
+_BLOCK_DESC = struct.Struct("=IIIII")
+BLOCK_STATUS_OFFSET = 8
+# struct tpacket3_hdr up to hv1.tp_vlan_tpid: next_offset, sec, nsec,
+# snaplen, len, status, mac, net, rxhash, vlan_tci, vlan_tpid
+_TPACKET3_HDR = struct.Struct("=IIIIIIHHIIH")
+# sll_pkttype in the sockaddr_ll following the (16-byte aligned) header
+TPACKET3_PKTTYPE_OFFSET = 48 + 10
+_TPACKET_STATS_V3 = struct.Struct("=III")
+
+DEFAULT_BLOCK_SIZE = 1 << 20
+DEFAULT_BLOCKS = 64
+DEFAULT_BLOCK_TIMEOUT_MS = 10
+RING_FRAME_SIZE = 2048
+
+# Classic BPF opcodes
+BPF_LDH_ABS = 0x28
+BPF_LDB_ABS = 0x30
+BPF_LDH_IND = 0x48
+BPF_LDXB_MSH = 0xb1
+BPF_JEQ_K = 0x15
+BPF_RET_K = 0x06
+
+DEFAULT_SNAPLEN = 128
+
+
+class SockFilter(ctypes.Structure):
+    _fields_ = [("code", ctypes.c_uint16), ("jt", ctypes.c_uint8),
+                ("jf", ctypes.c_uint8), ("k", ctypes.c_uint32)]
+
+
+class SockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_uint16), ("filter", ctypes.POINTER(SockFilter))]
+
+
+def assemble(program):
+    """
+    Resolves label jumps of a BPF program.
+
+    :param program: list of (label or None, code, jt label, jf label, k);
+                    jump labels may be None (next instruction)
+    :return: list of (code, jt, jf, k)
+    """
+    labels = {label: i for i, (label, *_) in enumerate(program) if label}
+    result = []
+    for i, (_, code, jt, jf, k) in enumerate(program):
+        jt = labels[jt] - i - 1 if jt else 0
+        jf = labels[jf] - i - 1 if jf else 0
+        result.append((code, jt, jf, k))
+    return result
+
+
+def bpf_program(port=DPORT, snaplen=DEFAULT_SNAPLEN):
+    """
+    BPF program accepting IPv4 UDP/TCP frames to a destination port.
+
+    :param port: destination port (None: any port)
+    :param snaplen: bytes of each accepted frame passed to user space
+    :return: list of (code, jt, jf, k)
+    """
+    program = [
+        (None, BPF_LDH_ABS, None, None, 12),
+        (None, BPF_JEQ_K, "tagged", None, ETH_P_8021Q),
+        (None, BPF_JEQ_K, None, "reject", ETH_P_IP),
+    ]
+    for name, offset in (("plain", 14), ("tagged", 18)):
+        if name == "tagged":
+            program += [("tagged", BPF_LDH_ABS, None, None, 16),
+                        (None, BPF_JEQ_K, None, "reject", ETH_P_IP)]
+        program += [
+            (name if name == "plain" else None, BPF_LDB_ABS, None, None, offset + 9),
+            (None, BPF_JEQ_K, f"l4_{name}", None, 17),
+            (None, BPF_JEQ_K, f"l4_{name}", "reject", 6),
+            (f"l4_{name}", BPF_LDXB_MSH, None, None, offset),
+        ]
+        if port is None:
+            program.append((None, BPF_RET_K, None, None, snaplen))
+        else:
+            program += [(None, BPF_LDH_IND, None, None, offset + 2),
+                        (None, BPF_JEQ_K, "accept", "reject", port)]
+    program += [("accept", BPF_RET_K, None, None, snaplen),
+                ("reject", BPF_RET_K, None, None, 0)]
+    return assemble(program)
+
+
+def attach_filter(sock, program):
+    filters = (SockFilter * len(program))(*[SockFilter(*insn) for insn in program])
+    fprog = SockFprog(len(program), filters)
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, bytes(fprog))
+
+
+def open_socket(iface, port=DPORT, snaplen=DEFAULT_SNAPLEN, rcvbuf=32 << 20):
+    """
+    Opens a filtered, non-blocking AF_PACKET socket on an interface.
+    """
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    attach_filter(sock, bpf_program(port, snaplen))
+    sock.bind((iface, 0))
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, rcvbuf)
+    except OSError:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.setsockopt(SOL_PACKET, PACKET_AUXDATA, 1)
+    sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    sock.setblocking(False)
+    return sock
+
+
+def open_ring(iface, port=DPORT, snaplen=DEFAULT_SNAPLEN, block_size=DEFAULT_BLOCK_SIZE,
+              blocks=DEFAULT_BLOCKS, timeout_ms=DEFAULT_BLOCK_TIMEOUT_MS):
+    """
+    Opens a filtered AF_PACKET socket with a TPACKET_V3 receive ring.
+
+    :param block_size: ring block size in bytes (a power of two multiple of
+                       the page size)
+    :param blocks: number of blocks in the ring
+    :param timeout_ms: time after which the kernel hands over a block that
+                       is not full
+    :return: (socket, mmap of the ring)
+    """
+    if block_size % mmap.PAGESIZE or block_size & (block_size - 1):
+        raise ValueError(f"Ring block size {block_size} is not a power of two multiple of {mmap.PAGESIZE}")
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    attach_filter(sock, bpf_program(port, snaplen))
+    sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+    frames = block_size // RING_FRAME_SIZE * blocks
+    sock.setsockopt(SOL_PACKET, PACKET_RX_RING,
+                    _TPACKET_REQ3.pack(block_size, blocks, RING_FRAME_SIZE, frames, timeout_ms, 0, 0))
+    ring = mmap.mmap(sock.fileno(), block_size * blocks, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+    sock.bind((iface, 0))
+    return sock, ring
+
+
+def kernel_stats(sock):
+    """
+    Packets received and dropped by the kernel since the last call.
+    """
+    packets, drops = struct.unpack("II", sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8))
+    return packets, drops
+
+
+class StreamStats:
+    """
+    Per-stream counters, keyed by (VID, PCP); untagged frames use (None, None).
+    """
+
+    def __init__(self):
+        self.streams = {}
+
+    def add(self, tci, length):
+        """
+        :param tci: 802.1Q TCI, or None for an untagged frame
+        :param length: frame length on the wire
+        """
+        if tci is None:
+            key = (None, None)
+            dei = 0
+        else:
+            key = (tci & 0xfff, tci >> 13)
+            dei = (tci >> 12) & 1
+        counters = self.streams.get(key)
+        if counters is None:
+            counters = self.streams[key] = [0, 0, 0]
+        counters[0] += 1
+        counters[1] += length
+        counters[2] += dei
+
+    def snapshot(self):
+        return {key: list(counters) for key, counters in self.streams.items()}
+
+
+def frame_meta(frame, ancdata):
+    """
+    802.1Q TCI, wire length and kernel receive time of a received frame.
+
+    The TCI comes from the aux data, or the frame bytes if the tag was not
+    stripped. The wire length is tp_len of the aux data: the BPF filter
+    trims the frame to the snap length before recvmsg sees it, so the
+    length recvmsg returns is at most the snap length.
+
+    :return: (TCI or None, wire length or None, receive time in ns or None)
+    """
+    tci = None
+    wire_length = None
+    rx_ns = None
+    for level, kind, data in ancdata:
+        if level == SOL_PACKET and kind == PACKET_AUXDATA:
+            status, wire_length, _, _, _, vlan_tci, _ = _AUXDATA.unpack_from(data)
+            if status & TP_STATUS_VLAN_VALID:
+                tci = vlan_tci
+        elif level == socket.SOL_SOCKET and kind == SCM_TIMESTAMPNS:
+            seconds, nanoseconds = _TIMESPEC.unpack_from(data)
+            rx_ns = seconds * 1_000_000_000 + nanoseconds
+    if tci is None and frame[12] == 0x81 and frame[13] == 0x00:
+        tci = _TCI.unpack_from(frame, 14)[0]
+    return tci, wire_length, rx_ns
+
+
+class Receiver:
+    """
+    Bulk reader: drains the socket on each wake-up and feeds the handlers.
+
+    :param sock: a socket from open_socket
+    :param handlers: callables (frame memoryview, captured length, wire
+                     length, TCI or None, receive time in ns)
+    :param snaplen: size of the receive buffer
+    """
+
+    def __init__(self, sock, handlers, snaplen=DEFAULT_SNAPLEN):
+        self.sock = sock
+        self.handlers = handlers
+        self.buf = bytearray(snaplen)
+        self.view = memoryview(self.buf)
+        self.ancbufsize = socket.CMSG_SPACE(_AUXDATA.size) + socket.CMSG_SPACE(_TIMESPEC.size)
+        self.poller = select.poll()
+        self.poller.register(sock, select.POLLIN)
+        self.received = 0
+        self.kernel_drops = 0
+        kernel_stats(sock)  # reset the kernel counters
+
+    def poll(self, timeout_ms):
+        """
+        Waits up to timeout_ms for frames and processes all queued frames.
+
+        :return: number of frames processed
+        """
+        if not self.poller.poll(timeout_ms):
+            return 0
+        recvmsg_into = self.sock.recvmsg_into
+        buffers = [self.buf]
+        view = self.view
+        handlers = self.handlers
+        count = 0
+        while True:
+            try:
+                length, ancdata, _, address = recvmsg_into(buffers, self.ancbufsize, socket.MSG_TRUNC)
+            except BlockingIOError:
+                break
+            if address[2] == PACKET_OUTGOING:
+                continue
+            tci, wire_length, now = frame_meta(view, ancdata)
+            if now is None:
+                now = time.time_ns()
+            captured = min(length, len(view))
+            if wire_length is not None:
+                length = wire_length
+            for handler in handlers:
+                handler(view, captured, length, tci, now)
+            count += 1
+        self.received += count
+        return count
+
+    def drops(self):
+        _, drops = kernel_stats(self.sock)
+        self.kernel_drops += drops
+        return self.kernel_drops
+
+    def close(self):
+        self.sock.close()
+
+
+class RingReceiver:
+    """
+    Zero-copy reader of a TPACKET_V3 ring: walks the blocks the kernel
+    handed over and feeds the handlers, as Receiver does.
+
+    :param sock: a socket from open_ring
+    :param ring: the ring mmap from open_ring
+    :param handlers: callables (frame memoryview, captured length, wire
+                     length, TCI or None, receive time in ns)
+    :param block_size: ring block size, as given to open_ring
+    :param blocks: number of blocks, as given to open_ring
+    """
+
+    def __init__(self, sock, ring, handlers, block_size=DEFAULT_BLOCK_SIZE, blocks=DEFAULT_BLOCKS):
+        self.sock = sock
+        self.ring = ring
+        self.view = memoryview(ring)
+        self.handlers = handlers
+        self.block_size = block_size
+        self.blocks = blocks
+        self.block = 0
+        self.poller = select.poll()
+        self.poller.register(sock, select.POLLIN | select.POLLERR)
+        self.received = 0
+        self.kernel_drops = 0
+        self.freezes = 0
+        self.drops()  # reset the kernel counters
+        self.kernel_drops = self.freezes = 0
+
+    def poll(self, timeout_ms):
+        """
+        Waits up to timeout_ms for a block and processes all ready blocks.
+
+        :return: number of frames processed
+        """
+        view = self.view
+        ring = self.ring
+        handlers = self.handlers
+        unpack_header = _TPACKET3_HDR.unpack_from
+        count = 0
+        base = self.block * self.block_size
+        _, _, status, _, _ = _BLOCK_DESC.unpack_from(ring, base)
+        if not status & TP_STATUS_USER:
+            if not self.poller.poll(timeout_ms):
+                return 0
+        while True:
+            _, _, status, frames, offset = _BLOCK_DESC.unpack_from(ring, base)
+            if not status & TP_STATUS_USER:
+                break
+            offset += base
+            for _ in range(frames):
+                (next_offset, sec, nsec, captured, length, frame_status, mac, _, _, vlan_tci,
+                 _) = unpack_header(ring, offset)
+                if ring[offset + TPACKET3_PKTTYPE_OFFSET] != PACKET_OUTGOING:
+                    start = offset + mac
+                    frame = view[start:start + captured]
+                    if frame_status & TP_STATUS_VLAN_VALID:
+                        tci = vlan_tci
+                    elif frame[12] == 0x81 and frame[13] == 0x00:
+                        tci = _TCI.unpack_from(frame, 14)[0]
+                    else:
+                        tci = None
+                    now = sec * 1_000_000_000 + nsec
+                    for handler in handlers:
+                        handler(frame, captured, length, tci, now)
+                    frame.release()
+                    count += 1
+                offset += next_offset
+            # Hand the block back to the kernel
+            struct.pack_into("=I", ring, base + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+            self.block = (self.block + 1) % self.blocks
+            base = self.block * self.block_size
+        self.received += count
+        return count
+
+    def drops(self):
+        _, drops, freezes = _TPACKET_STATS_V3.unpack(
+            self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, _TPACKET_STATS_V3.size))
+        self.kernel_drops += drops
+        self.freezes += freezes
+        return self.kernel_drops
+
+    def close(self):
+        self.view.release()
+        self.ring.close()
+        self.sock.close()
+
+
+def format_key(key):
+    vid, pcp = key
+    return "untagged" if vid is None else f"VID {vid:4d} PCP {pcp}"
+
+
+def print_summary(current, previous, seconds, drops, title=None):
+    """
+    Prints one line per stream with the rates since the previous snapshot.
+    """
+    print(f"----- {title or time.strftime('%H:%M:%S')} ({drops} kernel drops) -----")
+    for key in sorted(current, key=lambda k: (k[0] is None, k)):
+        packets, nbytes, dei = current[key]
+        last = previous.get(key, (0, 0, 0))
+        delta_packets = packets - last[0]
+        print(f"{format_key(key):18s} {packets:10d} pkts {delta_packets / seconds:10.0f} pps "
+              f"{(nbytes - last[1]) * 8 / seconds / 1e6:9.2f} Mbit/s  "
+              f"DEI {dei:8d} ({100 * dei / packets if packets else 0:5.1f}%)")
+
+
+def write_stats(writer, current, previous, seconds, drops):
+    """
+    Writes one "stream" record per stream to a stats_log.StatsWriter.
+    """
+    for (vid, pcp), (packets, nbytes, dei) in current.items():
+        last = previous.get((vid, pcp), (0, 0, 0))
+        writer.write("stream", vid=vid, pcp=pcp, packets=packets, bytes=nbytes, dei=dei,
+                     pps=(packets - last[0]) / seconds, bps=(nbytes - last[1]) * 8 / seconds,
+                     interval=seconds, kernel_drops=drops)
+
+
+def run(iface, port=DPORT, interval=1.0, snaplen=DEFAULT_SNAPLEN, duration=0.0, handlers=(), report=None,
+        ring=None, writer=None):
+    """
+    Receives on iface and prints per-stream summaries every interval seconds.
+
+    :param handlers: extra frame handlers, see Receiver
+    :param report: called as report(seconds) after each summary
+    :param ring: None for the recvmsg backend, or a dict of open_ring
+                 arguments (block_size, blocks, timeout_ms) for the
+                 TPACKET_V3 ring backend
+    :param writer: stats_log.StatsWriter receiving the interval summaries
+    :return: final StreamStats
+    """
+    stats = StreamStats()
+    handlers = [lambda frame, captured, length, tci, now: stats.add(tci, length)] + list(handlers)
+    if ring is None:
+        sock = open_socket(iface, port, snaplen)
+        receiver = Receiver(sock, handlers, snaplen)
+    else:
+        sock, ring_map = open_ring(iface, port, snaplen, **ring)
+        receiver = RingReceiver(sock, ring_map, handlers, ring.get("block_size", DEFAULT_BLOCK_SIZE),
+                                ring.get("blocks", DEFAULT_BLOCKS))
+    start = last = time.monotonic()
+    previous = {}
+    try:
+        while not duration or time.monotonic() - start < duration:
+            receiver.poll(100)
+            now = time.monotonic()
+            if now - last >= interval:
+                current = stats.snapshot()
+                drops = receiver.drops()
+                print_summary(current, previous, now - last, drops)
+                if writer:
+                    write_stats(writer, current, previous, now - last, drops)
+                if report:
+                    report(now - last)
+                previous, last = current, now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print_summary(stats.snapshot(), {}, max(time.monotonic() - start, 1e-9), receiver.drops(), "Total")
+        if ring is not None and receiver.freezes:
+            print(f"Ring full {receiver.freezes} times (queue frozen), consider more or larger blocks")
+        receiver.close()
+    return stats
@@ -0,0 +1,353 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+In-memory shadow of the entities the controller writes to a switch.
+
+Every Write the controller sends (mycontroller.ControllerConnection) is
+recorded once the switch accepted it; the updates a partially failed Write
+rejected are left out. The shadow holds:
+  - table entries, per table, as TableRecord keyed by the canonical match
+    (state_verify.canonical_entry) and priority, plus the default actions
+  - register values, one array per register (RegisterMirror)
+  - meter configurations, as MeterRecord per meter and index
+
+so the controller answers queries (printing the tables, diffs, UIs) without
+a Read RPC. A pipeline installed by the controller starts from an empty
+shadow with zeroed registers; a switch joined without reinstalling it is
+loaded with one wildcard Read, which is also how a shadow marked stale (a
+failed Write that did not say which updates went through) is refreshed by
+the next query.
+
+Table updates are decoded lazily: bundles (runtime_bundle.py) and batched
+writes are queued as they are and canonicalized on the first table query,
+so recording costs nothing on the provisioning path. Registers the data
+plane changes (last_hyperperiod_reg, period_count, ...) only hold the
+last value the controller wrote; register_reader.py reads their current
+values.
+"""
+
+import threading
+from array import array
+
+from p4.config.v1 import p4info_pb2
+from p4.v1 import p4runtime_pb2
+
+from state_verify import canonical_entry, match_widths
+
+REGISTER_TYPECODE = "Q"
+REGISTER_MAX_BITS = 64
+
+
+class StaleShadowError(RuntimeError):
+    """
+    Query of a stale shadow that has no switch connection to reload from.
+    """
+
+
+class TableRecord:
+    """
+    One table entry: canonical match fields, priority, action and parameters.
+    """
+    __slots__ = ("match", "priority", "action_id", "params")
+
+    def __init__(self, match, priority, action_id, params):
+        self.match = match
+        self.priority = priority
+        self.action_id = action_id
+        self.params = params
+
+
+class MeterRecord:
+    __slots__ = ("cir", "cburst", "pir", "pburst")
+
+    def __init__(self, cir, cburst, pir, pburst):
+        self.cir = cir
+        self.cburst = cburst
+        self.pir = pir
+        self.pburst = pburst
+
+
+class RegisterMirror:
+    """
+    Values of one register array: an array of unsigned 64-bit integers, or
+    a list for registers wider than 64 bits.
+    """
+    __slots__ = ("name", "width", "values")
+
+    def __init__(self, name, width, size):
+        self.name = name
+        self.width = width
+        self.values = array(REGISTER_TYPECODE, bytes(8 * size)) if width <= REGISTER_MAX_BITS else [0] * size
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+
+class ShadowState:
+    """
+    Shadow of one switch.
+
+    :param p4info: the p4info of the pipeline the switch runs
+    :param sw: the switch connection, a stale shadow is reloaded from it
+    """
+
+    def __init__(self, p4info, sw=None):
+        self.p4info = p4info
+        self.sw = sw
+        self.widths = match_widths(p4info)
+        self.match_types = {(table.preamble.id, field.id): field.match_type
+                            for table in p4info.tables for field in table.match_fields}
+        self.ids = {}
+        for kind in ("tables", "actions", "registers", "meters"):
+            for item in getattr(p4info, kind):
+                self.ids[item.preamble.name] = item.preamble.id
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """
+        State of a freshly installed pipeline: no entries, zeroed registers.
+        """
+        with self.lock:
+            self.tables = {table.preamble.id: {} for table in self.p4info.tables}
+            self.defaults = {}
+            self.registers = {reg.preamble.id: RegisterMirror(reg.preamble.name,
+                                                              reg.type_spec.bitstring.bit.bitwidth, reg.size)
+                              for reg in self.p4info.registers}
+            self.meters = {}
+            # Table updates not canonicalized yet: lists of Update or
+            # serialized WriteRequest.updates
+            self.pending = []
+            self.stale = False
+
+    # ------------------------------------------------------------------
+    # Recording
+
+    def record(self, request, failed=None):
+        """
+        Records the updates of a WriteRequest the switch processed.
+
+        :param failed: indices of the updates it rejected (mycontroller.failed_updates),
+                       None when it accepted them all
+        """
+        with self.lock:
+            if failed is None:
+                updates = request.updates
+            elif len(failed) == len(request.updates):
+                return
+            else:
+                updates = [update for i, update in enumerate(request.updates) if i not in failed]
+            tables = []
+            for update in updates:
+                kind = update.entity.WhichOneof("entity")
+                if kind == "table_entry":
+                    tables.append(update)
+                elif kind == "register_entry":
+                    self.record_register(update.entity.register_entry)
+                elif kind == "meter_entry":
+                    self.record_meter(update.type, update.entity.meter_entry)
+            if tables:
+                self.pending.append(tables)
+
+    def record_failure(self):
+        """
+        A Write failed without saying which updates went through: the
+        shadow is marked stale, the next query reloads it from the switch.
+        """
+        with self.lock:
+            self.stale = True
+
+    def record_serialized(self, updates):
+        """
+        Records a Write the switch accepted, as its serialized updates
+        (the chunks of a runtime_bundle.Bundle).
+        """
+        with self.lock:
+            self.pending.append(updates)
+
+    def record_register(self, register_entry):
+        mirror = self.registers.get(register_entry.register_id)
+        if mirror is None:
+            return
+        value = int.from_bytes(register_entry.data.bitstring, "big")
+        if mirror.width <= REGISTER_MAX_BITS:
+            value &= (1 << REGISTER_MAX_BITS) - 1
+        indexes = [register_entry.index.index] if register_entry.HasField("index") else range(len(mirror))
+        for index in indexes:
+            if 0 <= index < len(mirror):
+                mirror.values[index] = value
+
+    def record_meter(self, update_type, meter_entry):
+        key = (meter_entry.meter_id, meter_entry.index.index)
+        if update_type == p4runtime_pb2.Update.DELETE:
+            self.meters.pop(key, None)
+        else:
+            config = meter_entry.config
+            self.meters[key] = MeterRecord(config.cir, config.cburst, config.pir, config.pburst)
+
+    def record_table_entry(self, update_type, table_entry):
+        key, (action_id, params) = canonical_entry(table_entry, self.widths)
+        table_id, match, priority = key
+        if table_entry.is_default_action:
+            self.defaults[table_id] = TableRecord((), 0, action_id, params)
+            return
+        entries = self.tables.setdefault(table_id, {})
+        if update_type == p4runtime_pb2.Update.DELETE:
+            entries.pop(key, None)
+        else:
+            entries[key] = TableRecord(match, priority, action_id, params)
+
+    def refresh(self):
+        """
+        Reloads the shadow from the switch if it is stale.
+
+        :raise StaleShadowError: stale without a switch connection
+        :raise grpc.RpcError: the Read failed
+        """
+        with self.lock:
+            if not self.stale:
+                return
+            if self.sw is None:
+                raise StaleShadowError("shadow state is stale and has no switch to reload from")
+            self.load(self.sw)
+
+    def sync(self):
+        """
+        Canonicalizes the queued table updates, after reloading a stale shadow.
+        """
+        with self.lock:
+            self.refresh()
+            pending, self.pending = self.pending, []
+            for updates in pending:
+                if isinstance(updates, (bytes, bytearray, memoryview)):
+                    updates = p4runtime_pb2.WriteRequest.FromString(bytes(updates)).updates
+                for update in updates:
+                    self.record_table_entry(update.type, update.entity.table_entry)
+
+    def load(self, sw):
+        """
+        Replaces the shadow with the tables, registers and meters read
+        from the switch (one wildcard Read); the shadow reloads from sw
+        when stale from then on.
+        """
+        self.sw = sw
+        request = p4runtime_pb2.ReadRequest()
+        request.device_id = sw.device_id
+        request.entities.add().table_entry.table_id = 0
+        request.entities.add().register_entry.register_id = 0
+        request.entities.add().meter_entry.meter_id = 0
+        with self.lock:
+            self.reset()
+            for response in sw.client_stub.Read(request):
+                for entity in response.entities:
+                    kind = entity.WhichOneof("entity")
+                    if kind == "table_entry":
+                        self.record_table_entry(p4runtime_pb2.Update.INSERT, entity.table_entry)
+                    elif kind == "register_entry":
+                        self.record_register(entity.register_entry)
+                    elif kind == "meter_entry" and entity.meter_entry.HasField("config"):
+                        self.record_meter(p4runtime_pb2.Update.MODIFY, entity.meter_entry)
+
+    # ------------------------------------------------------------------
+    # Queries
+
+    def table(self, name):
+        """
+        Entries of a table: {canonical key: TableRecord}, keyed as
+        state_verify.canonical_entry.
+        """
+        self.sync()
+        return self.tables.get(self.ids[name], {})
+
+    def table_entries(self, table_id=None):
+        """
+        Entries of one table, or of all of them, as p4.v1.TableEntry
+        (default actions first).
+        """
+        self.sync()
+        with self.lock:
+            table_ids = [table_id] if table_id is not None else list(self.tables)
+            result = []
+            for tid in table_ids:
+                if tid in self.defaults:
+                    result.append(self.to_table_entry(tid, self.defaults[tid], default=True))
+                result += [self.to_table_entry(tid, record) for record in self.tables.get(tid, {}).values()]
+            return result
+
+    def to_table_entry(self, table_id, record, default=False):
+        table_entry = p4runtime_pb2.TableEntry()
+        table_entry.table_id = table_id
+        table_entry.is_default_action = default
+        for field in record.match:
+            m = table_entry.match.add()
+            m.field_id = field[0]
+            match_type = self.match_types.get((table_id, field[0]))
+            if match_type == p4info_pb2.MatchField.LPM:
+                m.lpm.value = field[1] or b"\0"
+                m.lpm.prefix_len = field[2]
+            elif match_type == p4info_pb2.MatchField.TERNARY:
+                m.ternary.value = field[1] or b"\0"
+                m.ternary.mask = field[2]
+            elif match_type == p4info_pb2.MatchField.RANGE:
+                m.range.low = field[1] or b"\0"
+                m.range.high = field[2] or b"\0"
+            elif match_type == p4info_pb2.MatchField.OPTIONAL:
+                m.optional.value = field[1] or b"\0"
+            else:
+                m.exact.value = field[1] or b"\0"
+        if record.priority:
+            table_entry.priority = record.priority
+        action = table_entry.action.action
+        action.action_id = record.action_id
+        for param_id, value in record.params:
+            param = action.params.add()
+            param.param_id = param_id
+            param.value = value or b"\0"
+        return table_entry
+
+    def register(self, name):
+        """
+        RegisterMirror of a register (values the controller wrote).
+        """
+        self.refresh()
+        return self.registers[self.ids[name]]
+
+    def meter(self, name, index):
+        """
+        MeterRecord of a meter index, or None when never configured.
+        """
+        self.refresh()
+        return self.meters.get((self.ids[name], index))
+
+    def counts(self):
+        """
+        {table ID: number of entries}.
+        """
+        self.sync()
+        with self.lock:
+            return {table_id: len(entries) for table_id, entries in self.tables.items()}
+
+    def diff(self, intended):
+        """
+        Table entries written differently from their intended state,
+        without reading the switch (a failed or rolled back write, or a
+        configuration not applied yet).
+
+        :param intended: state_verify.IntendedState loaded with the intended entries
+        :return: {table ID: {"missing": [keys], "extra": [keys], "modified": [keys]}}
+                 of the differing tables, keys as state_verify.canonical_entry
+        """
+        self.sync()
+        result = {}
+        with self.lock:
+            for table_id, want in intended.tables.items():
+                have = self.tables.get(table_id, {})
+                modified = [key for key in want.keys() & have.keys()
+                            if want[key][0] != (have[key].action_id, have[key].params)]
+                missing = list(want.keys() - have.keys())
+                extra = list(have.keys() - want.keys())
+                if missing or extra or modified:
+                    result[table_id] = {"missing": missing, "extra": extra, "modified": modified}
+        return result
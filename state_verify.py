@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Drift detection between the intended table entries and a switch.
+
+The tables the controller manages (psfp_runtime.TABLE_ORDER and every
+table of the runtime config) are read with one wildcard Read. Every entry
+is reduced to a canonical key (table, match fields sorted by ID with
+leading zero bytes stripped and don't-care ternary and range fields left
+out, priority) and value (action and parameters), so the encoding chosen
+by the controller or the switch does not matter. A table's digest is the
+number of entries and the sum of their hashes, which does not depend on
+the order the switch returns them in, and is compared with the digest of
+the intended entries computed once per configuration. Only the tables
+whose digest differs are compared entry by entry, which gives the missing,
+extra and modified entries.
+
+Decoding the entries is most of the cost of a check, so once a table has
+matched, the digest of the entry bytes the switch sent is remembered: the
+next checks only split the Read responses into entities and hash their
+bytes, and decode a table again only when those bytes change:
+
+    ./state_verify.py                                   # s1 against the controller defaults
+    ./state_verify.py --runtime pod-topo/s1-runtime.json --address 127.0.0.1:50052 --device-id 1
+    ./mycontroller.py --verify-interval 30              # every 30 s, while controlling
+
+Default actions are not compared: a wildcard read does not return them.
+The hashes are Python's, only meaningful inside one process.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Import P4Runtime lib from parent utils dir
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
+
+import p4runtime_lib.bmv2
+import p4runtime_lib.helper
+
+from p4.v1 import p4runtime_pb2
+
+from p4runtime_log import describe_entry, p4info_names
+from psfp_runtime import TABLE_ORDER, load_runtime_config
+
+HASH_MASK = (1 << 64) - 1
+READ_METHOD = "/p4.v1.P4Runtime/Read"
+# Wire tags: ReadResponse.entities, Entity.table_entry, TableEntry.table_id
+ENTITIES_TAG = 0x0a
+TABLE_ENTRY_TAG = 0x12
+TABLE_ID_TAG = 0x08
+# Differences printed per table and kind
+REPORT_LIMIT = 10
+
+
+def match_widths(p4info):
+    """
+    Bit width of every match field: {(table ID, field ID): bits}.
+    """
+    return {(table.preamble.id, field.id): field.bitwidth for table in p4info.tables for field in table.match_fields}
+
+
+def canonical_entry(table_entry, widths):
+    """
+    Canonical key and value of a p4.v1.TableEntry, as hashable tuples.
+    """
+    table_id = table_entry.table_id
+    fields = []
+    for m in table_entry.match:
+        which = m.WhichOneof("field_match_type")
+        if which == "exact":
+            fields.append((m.field_id, m.exact.value.lstrip(b"\0")))
+        elif which == "lpm":
+            fields.append((m.field_id, m.lpm.value.lstrip(b"\0"), m.lpm.prefix_len))
+        elif which == "ternary":
+            mask = m.ternary.mask.lstrip(b"\0")
+            if mask:
+                fields.append((m.field_id, m.ternary.value.lstrip(b"\0"), mask))
+        elif which == "range":
+            low = m.range.low.lstrip(b"\0")
+            high = m.range.high.lstrip(b"\0")
+            bits = widths.get((table_id, m.field_id))
+            if low or bits is None or int.from_bytes(high, "big") != (1 << bits) - 1:
+                fields.append((m.field_id, low, high))
+        elif which == "optional":
+            fields.append((m.field_id, m.optional.value.lstrip(b"\0")))
+    fields.sort()
+    action = table_entry.action.action
+    params = sorted((p.param_id, p.value.lstrip(b"\0")) for p in action.params)
+    return (table_id, tuple(fields), table_entry.priority), (action.action_id, tuple(params))
+
+
+def table_digest(entries):
+    """
+    (entry count, order-independent hash) of a {key: value} map.
+    """
+    return len(entries), sum(hash(item) for item in entries.items()) & HASH_MASK
+
+
+class IntendedState:
+    """
+    Canonical intended entries of one switch, per table.
+
+    Rebuilding after a configuration change only encodes the entries that
+    are new objects: unchanged entry dicts keep their canonical form.
+
+    :param p4info_helper: the P4Info helper
+    """
+
+    def __init__(self, p4info_helper):
+        self.p4info_helper = p4info_helper
+        self.widths = match_widths(p4info_helper.p4info)
+        self.source = None
+        self.cache = {}
+        self.tables = {}
+        self.digests = {}
+        # Digest of the entry bytes of the tables last found matching
+        self.raw_digests = {}
+        for name in TABLE_ORDER:
+            try:
+                self.tables[p4info_helper.get_tables_id(name)] = {}
+            except AttributeError:
+                pass
+
+    def load(self, table_entries):
+        """
+        :param table_entries: intended entries in s1-runtime.json format
+        """
+        if table_entries is self.source:
+            return
+        cache = {}
+        tables = {table_id: {} for table_id in self.tables}
+        for entry in table_entries:
+            if entry.get("default_action"):
+                continue
+            cached = self.cache.get(id(entry))
+            if cached is None or cached[0] is not entry:
+                table_entry = self.p4info_helper.buildTableEntry(
+                    table_name=entry["table"],
+                    match_fields=entry.get("match", {}),
+                    action_name=entry["action_name"],
+                    action_params=entry["action_params"],
+                    priority=entry.get("priority")
+                )
+                cached = (entry,) + canonical_entry(table_entry, self.widths)
+            cache[id(entry)] = cached
+            _, key, value = cached
+            tables.setdefault(key[0], {})[key] = (value, entry)
+        self.source = table_entries
+        self.cache = cache
+        self.tables = tables
+        digests = {table_id: table_digest({key: value for key, (value, _) in entries.items()})
+                   for table_id, entries in tables.items()}
+        self.raw_digests = {table_id: raw for table_id, raw in self.raw_digests.items()
+                            if digests.get(table_id) == self.digests.get(table_id)}
+        self.digests = digests
+
+
+def read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def read_entities(sw, table_ids):
+    """
+    Reads tables with one wildcard Read, without decoding the responses.
+
+    :return: generator of (table ID, serialized p4.v1.Entity)
+    """
+    request = p4runtime_pb2.ReadRequest()
+    request.device_id = sw.device_id
+    for table_id in table_ids:
+        request.entities.add().table_entry.table_id = table_id
+    read = sw.channel.unary_stream(READ_METHOD, request_serializer=p4runtime_pb2.ReadRequest.SerializeToString,
+                                   response_deserializer=None)
+    for response in read(request):
+        pos = 0
+        while pos < len(response):
+            tag, pos = read_varint(response, pos)
+            length, pos = read_varint(response, pos)
+            entity = response[pos:pos + length]
+            pos += length
+            if tag != ENTITIES_TAG:
+                continue
+            # Entity { table_entry { table_id ... } }: fields are serialized in order
+            tag, inner = read_varint(entity, 0)
+            if tag == TABLE_ENTRY_TAG:
+                _, inner = read_varint(entity, inner)
+                tag, inner = read_varint(entity, inner)
+                if tag == TABLE_ID_TAG:
+                    yield read_varint(entity, inner)[0], entity
+                    continue
+            yield p4runtime_pb2.Entity.FromString(entity).table_entry.table_id, entity
+
+
+def raw_digests(sw, table_ids):
+    """
+    {table ID: (count, digest of the entry bytes)} of tables.
+    """
+    counts = dict.fromkeys(table_ids, 0)
+    sums = dict.fromkeys(table_ids, 0)
+    for table_id, entity in read_entities(sw, table_ids):
+        if table_id in counts:
+            counts[table_id] += 1
+            sums[table_id] += hash(entity)
+    return {table_id: (counts[table_id], sums[table_id] & HASH_MASK) for table_id in table_ids}
+
+
+def read_tables(sw, table_ids, widths):
+    """
+    Reads and decodes tables.
+
+    :return: ({table ID: (count, digest of the entry bytes)},
+              {table ID: {canonical key: (canonical value, TableEntry)}})
+    """
+    counts = dict.fromkeys(table_ids, 0)
+    sums = dict.fromkeys(table_ids, 0)
+    entries = {table_id: {} for table_id in table_ids}
+    for table_id, entity in read_entities(sw, table_ids):
+        if table_id not in counts:
+            continue
+        counts[table_id] += 1
+        sums[table_id] += hash(entity)
+        table_entry = p4runtime_pb2.Entity.FromString(entity).table_entry
+        if not table_entry.is_default_action:
+            key, value = canonical_entry(table_entry, widths)
+            entries[table_id][key] = (value, table_entry)
+    return {table_id: (counts[table_id], sums[table_id] & HASH_MASK) for table_id in table_ids}, entries
+
+
+def describe_intended(entry):
+    match = " ".join(f"{field}={value}" for field, value in entry.get("match", {}).items())
+    priority = f" prio {entry['priority']}" if entry.get("priority") is not None else ""
+    return f"{entry['table']} {match}{priority}"
+
+
+def verify(sw, intended, names):
+    """
+    Compares a switch with its intended entries.
+
+    :param intended: IntendedState loaded with the intended entries
+    :param names: p4runtime_log.p4info_names() of the p4info
+    :return: (report, seconds): report is {table name: {"missing": [...],
+             "extra": [...], "modified": [...]}} with a description of
+             every differing entry, empty without drift
+    """
+    start = time.perf_counter()
+    table_ids = sorted(intended.tables)
+    known = [table_id for table_id in table_ids if table_id in intended.raw_digests]
+    suspects = [table_id for table_id in table_ids if table_id not in intended.raw_digests]
+    if known:
+        digests = raw_digests(sw, known)
+        suspects += [table_id for table_id in known if digests[table_id] != intended.raw_digests[table_id]]
+    report = {}
+    if suspects:
+        digests, actual = read_tables(sw, suspects, intended.widths)
+        for table_id in suspects:
+            have = actual[table_id]
+            if table_digest({key: value for key, (value, _) in have.items()}) == intended.digests[table_id]:
+                intended.raw_digests[table_id] = digests[table_id]
+                continue
+            intended.raw_digests.pop(table_id, None)
+            want = intended.tables[table_id]
+            entity = p4runtime_pb2.Entity()
+            extra = []
+            for key in have.keys() - want.keys():
+                entity.table_entry.CopyFrom(have[key][1])
+                extra.append(describe_entry(entity, names))
+            report[names.get(table_id, str(table_id))] = {
+                "missing": [describe_intended(want[key][1]) for key in want.keys() - have.keys()],
+                "extra": extra,
+                "modified": [describe_intended(want[key][1]) for key in want.keys() & have.keys()
+                             if want[key][0] != have[key][0]]
+            }
+    return report, time.perf_counter() - start
+
+
+def print_report(sw_name, report, seconds, tables, limit=REPORT_LIMIT):
+    if not report:
+        print(f"{sw_name}: no drift in {tables} tables ({seconds * 1000:.1f} ms)")
+        return
+    print(f"{sw_name}: drift in {len(report)}/{tables} tables ({seconds * 1000:.1f} ms)")
+    for table, drift in sorted(report.items()):
+        print(f"  {table}: " + ", ".join(f"{len(drift[kind])} {kind}" for kind in ("missing", "extra", "modified")))
+        for kind in ("missing", "extra", "modified"):
+            for description in sorted(drift[kind])[:limit]:
+                print(f"    {kind:8s} {description}")
+            if len(drift[kind]) > limit:
+                print(f"    ... {len(drift[kind]) - limit} more {kind}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the table entries of a switch with a runtime config')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False, default='./build/sdn-psfp.p4.p4info.txtpb')
+    parser.add_argument('--runtime', help='Runtime JSON (default: the entries installed by mycontroller.py)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--address', help='P4Runtime address of the switch',
+                        type=str, action="store", required=False, default='127.0.0.1:50051')
+    parser.add_argument('--device-id', help='Device ID of the switch',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--limit', help='Differences printed per table and kind',
+                        type=int, action="store", required=False, default=REPORT_LIMIT)
+    args = parser.parse_args()
+
+    p4info_helper = p4runtime_lib.helper.P4InfoHelper(args.p4info)
+    intended = IntendedState(p4info_helper)
+    intended.load(load_runtime_config(args.runtime)["table_entries"])
+    sw = p4runtime_lib.bmv2.Bmv2SwitchConnection(name="switch", address=args.address, device_id=args.device_id)
+    try:
+        report, seconds = verify(sw, intended, p4info_names(p4info_helper.p4info))
+    finally:
+        sw.shutdown()
+    print_report(args.address, report, seconds, len(intended.tables), args.limit)
+    sys.exit(1 if report else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Streaming JSONL statistics records.
+
+StatsWriter appends one JSON object per line from a background thread, so
+the controller and receiver loops only enqueue dicts. Lines are buffered and
+flushed every flush_interval seconds, and the file is rotated when it
+exceeds max_bytes (stats.jsonl -> stats.jsonl.1 -> stats.jsonl.2 ...).
+
+Every record has "ts" (epoch seconds), "source" and "kind":
+  receiver    stream   per (VID, PCP) counters and rates (rx_stats.py)
+              latency  per probe latency percentiles, loss, reordering
+                       (rx_latency.py, times in ns)
+  controller  counter  indexed counter value and rate (mycontroller.py)
+              meter    configured meter band
+              gate     hyperperiod digest of a stream gate
+              role     controller became primary or backup of a switch
+              drift    table entries missing, extra or modified on a
+                       switch (state_verify.py)
+              register non-zero entries, sum and maximum of a register
+                       array (register_reader.py)
+
+load_records() reads a file back with its rotated parts, and load_columns()
+turns the records of one kind into NumPy arrays, one per field:
+
+    columns = load_columns("logs/rx_stats.jsonl", "latency")
+    columns["p99"][columns["probe_id"] == 1]
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 64 << 20
+DEFAULT_BACKUPS = 5
+DEFAULT_BUFFER_SIZE = 1 << 20
+QUEUE_SIZE = 65536
+
+
+class StatsWriter:
+    """
+    Buffered JSONL writer running in a background thread.
+
+    :param path: the JSONL file (appended to)
+    :param source: value of the "source" field of the records
+    :param max_bytes: rotate when the file exceeds this size (0: never)
+    :param backups: rotated files kept
+    :param flush_interval: seconds between flushes of the buffered lines
+    """
+
+    def __init__(self, path, source, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS, flush_interval=1.0):
+        self.path = path
+        self.source = source
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.dropped = 0
+        self.written = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a", buffering=DEFAULT_BUFFER_SIZE)
+        self.size = self.file.tell()
+        self.thread = threading.Thread(target=self._run, name="stats-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, kind, **fields):
+        """
+        Queues a record; never blocks (records are counted as dropped when
+        the queue is full).
+        """
+        record = {"ts": time.time(), "source": self.source, "kind": kind}
+        record.update(fields)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """
+        Writes the queued records and closes the file.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+    def _run(self):
+        dumps = json.JSONEncoder(separators=(",", ":"), default=str).encode
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = False
+            if record:
+                line = dumps(record) + "\n"
+                self.file.write(line)
+                self.size += len(line)
+                self.written += 1
+                if self.max_bytes and self.size >= self.max_bytes:
+                    self._rotate()
+            now = time.monotonic()
+            if record is None or now - last_flush >= self.flush_interval:
+                self.file.flush()
+                last_flush = now
+            if record is None:
+                return
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "w", buffering=DEFAULT_BUFFER_SIZE)
+        self.size = 0
+
+
+def rotated_files(path):
+    """
+    A JSONL file and its rotated parts, oldest first.
+    """
+    parts = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        parts.append(f"{path}.{i}")
+        i += 1
+    parts.reverse()
+    if os.path.exists(path):
+        parts.append(path)
+    return parts
+
+
+def load_records(path, kind=None, source=None, rotated=True):
+    """
+    Reads the records of a JSONL file.
+
+    :param kind: only return records of this kind
+    :param source: only return records of this source
+    :param rotated: also read the rotated parts, oldest first
+    :return: generator of dicts
+    """
+    for part in rotated_files(path) if rotated else [path]:
+        with open(part) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partial last line of a file still being written
+                    continue
+                if (kind is None or record.get("kind") == kind) and (source is None or record.get("source") == source):
+                    yield record
+
+
+def load_columns(path, kind, source=None, rotated=True):
+    """
+    Reads the records of one kind into columns.
+
+    Numeric fields become NumPy arrays (missing values are NaN), the other
+    fields object arrays.
+
+    :return: dict of field name to array
+    """
+    import numpy as np
+
+    records = list(load_records(path, kind, source, rotated))
+    names = []
+    for record in records:
+        for name in record:
+            if name not in names:
+                names.append(name)
+    columns = {}
+    for name in names:
+        values = [record.get(name) for record in records]
+        present = [v for v in values if v is not None]
+        if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+            if len(present) == len(values) and all(isinstance(v, int) for v in values):
+                columns[name] = np.array(values, dtype=np.int64)
+            else:
+                columns[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        else:
+            columns[name] = np.array(values, dtype=object)
+    return columns
@@ -0,0 +1,742 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Local JSON API adding, updating, removing and listing PSFP streams.
+
+A stream is one entry in each of stream_id, stream_filter_instance,
+stream_id_active and max_sdu_filter, plus the stream_gate_instance
+intervals and hyperperiod of its gate and the flow_meter_config,
+flow_meter_instance and meter bands of its flow meter. The API takes
+streams as single objects, validates them against the installed
+configuration and the table sizes of the p4info, allocates the stream
+handles, gate IDs and flow meter IDs left out, and hands the resulting
+runtime configuration to the controller, which pushes the difference as
+batched writes rolled back on failure (mycontroller.apply_runtime_config):
+a request is applied completely or not at all.
+
+    ./mycontroller.py --api 127.0.0.1:9090        # or --api /tmp/psfp.sock
+
+    GET    /streams                    streams, gates and meters
+    GET    /streams/<handle>           one stream
+    POST   /streams                    add a stream, or {"streams": [...]}
+    PUT    /streams/<handle>           update the fields given
+    PUT    /streams                    {"streams": [{"stream_handle": ...}, ...]}
+    DELETE /streams/<handle>           remove a stream
+    DELETE /streams                    {"stream_handles": [...]}
+
+With several switches, ?switch=<name> selects one. A stream:
+
+    {
+      "dst_mac": "08:00:00:00:02:22", "vid": 6,      # required, unique pair
+      "pcp": 5, "max_sdu": 1500,                     # defaults 0 and 1500
+      "active": true, "block_oversize": false,
+      "close_on_invalid_rx": false, "close_on_octets_exceeded": false,
+      "stream_handle": 6,                            # allocated when left out
+      "stream_gate_id": 1,                           # an existing gate, or a new one:
+      "gate": {"hyperperiod": 20, "intervals": [
+          {"start_us": 0, "end_us": 2000000, "gate_state": 0, "ipv": 2, "max_octets": 180000},
+          {"start_us": 2000000, "end_us": 8000000, "gate_state": 1, "ipv": 2}]},
+      "flow_meter_instance_id": 1,                   # an existing meter, or a new one:
+      "meter": {"cir": 100000, "cburst": 4096, "pir": 200000, "pburst": 8192,
+                "drop_on_yellow": true, "mark_all_red": false, "color_aware": true}
+    }
+
+Updating a stream with a "gate" or "meter" rewrites that gate or meter in
+place when no other stream uses it; gates and meters left without a stream
+by an update or a removal are removed with it. A hot reload of the runtime
+JSON (mycontroller.py --watch) replaces the streams added here.
+"""
+
+import json
+import os
+import re
+import socketserver
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from psfp_runtime import (FLOW_METER, FLOW_METER_CONFIG_TABLE, FLOW_METER_INSTANCE_TABLE, GATE_CLOSED, GATE_OPEN,
+                          GATE_TABLE, MAX_SDU_TABLE, STREAM_FILTER_TABLE, STREAM_ID_ACTIVE_TABLE, STREAM_ID_TABLE,
+                          gate_schedule, hyperperiod_state_entries)
+
+STREAM_FILTER = "IngressImpl.psfp_c.streamFilter_c."
+STREAM_GATE = "IngressImpl.psfp_c.streamGate_c."
+FLOW_METER_CONTROL = "IngressImpl.psfp_c.flowMeter_c."
+HANDLE_FIELD = "meta.ingress_md.stream_filter.stream_handle"
+GATE_FIELD = "meta.ingress_md.stream_filter.stream_gate_id"
+METER_FIELD = "meta.ingress_md.stream_filter.flow_meter_instance_id"
+
+# Largest IDs of the P4 metadata (bit<16> handles and meters, bit<12> gates)
+MAX_STREAM_HANDLE = 0xffff
+MAX_GATE_ID = 0xfff
+MAX_FLOW_METER_ID = 0xffff
+MAX_VID = 4094
+MAX_PACKET_LENGTH = 0xffff
+DEFAULT_MAX_SDU = 1500
+# Priority of the max_sdu_filter entry of a new stream (matched exactly on
+# the handle) and of the first interval of a new gate
+MAX_SDU_PRIORITY = 1
+GATE_PRIORITY = 100
+MAC_RE = re.compile(r"^[0-9a-fA-F]{2}(:[0-9a-fA-F]{2}){5}$")
+STREAM_TABLES = (STREAM_ID_TABLE, STREAM_FILTER_TABLE, STREAM_ID_ACTIVE_TABLE, MAX_SDU_TABLE)
+METER_TABLES = (FLOW_METER_CONFIG_TABLE, FLOW_METER_INSTANCE_TABLE)
+STREAM_FIELDS = {"stream_handle", "dst_mac", "vid", "pcp", "max_sdu", "active", "block_oversize",
+                 "close_on_invalid_rx", "close_on_octets_exceeded", "stream_gate_id", "gate",
+                 "flow_meter_instance_id", "meter"}
+METER_FLAGS = (("drop_on_yellow", "dropOnYellow"), ("mark_all_red", "markAllFramesRedEnable"),
+               ("color_aware", "colorAware"))
+METER_BANDS = ("cir", "cburst", "pir", "pburst")
+# Largest request body accepted
+MAX_BODY = 64 << 20
+
+
+class StreamError(ValueError):
+    """
+    Rejected request.
+
+    :param status: HTTP status of the response
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def check_int(spec, name, low, high, default=None):
+    value = spec.get(name)
+    if value is None:
+        value = default
+    if value is None:
+        raise StreamError(f"{name} is required")
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise StreamError(f"{name} must be an integer in [{low}, {high}], not {value!r}")
+    return value
+
+
+def check_flag(spec, name, default=False):
+    value = spec.get(name, default)
+    if value not in (True, False, 0, 1):
+        raise StreamError(f"{name} must be a boolean, not {value!r}")
+    return bool(value)
+
+
+def entry_handle(entry):
+    if entry["table"] == STREAM_ID_TABLE:
+        return entry["action_params"]["stream_handle"]
+    return entry["match"][HANDLE_FIELD]
+
+
+def allocator(used, high):
+    """
+    Yields the free IDs from 1 to high, skipping the ones added to used
+    in the meantime.
+    """
+    return (i for i in range(1, high + 1) if i not in used)
+
+
+class StreamConfig:
+    """
+    Streams of one runtime configuration (psfp_runtime.load_runtime_config).
+
+    The operations do not change the configuration: they return the new
+    one, to be applied to the switch before it replaces this one.
+
+    :param config: runtime configuration
+    :param capacity: {table name: size} from the p4info, None for no limit
+    """
+
+    def __init__(self, config, capacity=None):
+        self.config = config
+        self.capacity = capacity or {}
+        self.streams = {}
+        self.priorities = {}
+        self.meters = {}
+        rows = {table: {} for table in STREAM_TABLES}
+        for entry in config["table_entries"]:
+            if entry.get("default_action"):
+                continue
+            table = entry["table"]
+            if table in rows:
+                rows[table][entry_handle(entry)] = entry
+            elif table == FLOW_METER_CONFIG_TABLE:
+                params = entry["action_params"]
+                self.meters[entry["match"][METER_FIELD]] = {
+                    flag: bool(params[param]) for flag, param in METER_FLAGS}
+        bands = {meter["index"]: meter for meter in config["meters"] if meter["meter"] == FLOW_METER}
+        for meter_id, meter in self.meters.items():
+            meter.update({band: bands[meter_id][band] if meter_id in bands else None for band in METER_BANDS})
+
+        for handle, entry in rows[STREAM_ID_TABLE].items():
+            params = entry["action_params"]
+            match = entry["match"]
+            stream = {
+                "stream_handle": handle,
+                "dst_mac": match["hdr.ethernet.dst_addr"],
+                "vid": match["hdr.eth_802_1q.vid"],
+                "pcp": 0,
+                "max_sdu": None,
+                "active": bool(params["active"]),
+                "block_oversize": bool(params["stream_blocked_due_to_oversize_frame_enable"]),
+                "close_on_invalid_rx": False,
+                "close_on_octets_exceeded": False,
+                "stream_gate_id": None,
+                "flow_meter_instance_id": None
+            }
+            sdu = rows[MAX_SDU_TABLE].get(handle)
+            if sdu is not None:
+                stream["pcp"] = sdu["match"]["hdr.eth_802_1q.pcp"][0]
+                stream["max_sdu"] = sdu["match"]["std_md.packet_length"][1]
+                self.priorities[handle] = sdu.get("priority")
+            filter_entry = rows[STREAM_FILTER_TABLE].get(handle)
+            if filter_entry is not None:
+                params = filter_entry["action_params"]
+                stream.update(stream_gate_id=params["stream_gate_id"],
+                              flow_meter_instance_id=params["flow_meter_instance_id"],
+                              close_on_invalid_rx=bool(params["gate_closed_due_to_invalid_rx_enable"]),
+                              close_on_octets_exceeded=bool(params["gate_closed_due_to_octets_exceeded_enable"]))
+            self.streams[handle] = stream
+        self.gates = {gate_id: {"hyperperiod": config["hyperperiods"].get(gate_id), "intervals": intervals}
+                      for gate_id, intervals in gate_schedule(config["table_entries"]).items()}
+
+    def list(self):
+        return {
+            "streams": [self.streams[handle] for handle in sorted(self.streams)],
+            "gates": {str(gate_id): self.gates[gate_id] for gate_id in sorted(self.gates)},
+            "meters": {str(meter_id): self.meters[meter_id] for meter_id in sorted(self.meters)}
+        }
+
+    def get(self, handle):
+        if handle not in self.streams:
+            raise StreamError(f"no stream with handle {handle}", 404)
+        return self.streams[handle]
+
+    # ------------------------------------------------------------------
+    # Operations
+
+    def add(self, specs):
+        """
+        :param specs: list of stream objects
+        :return: (new configuration, list of the streams added)
+        """
+        change = _Change(self)
+        added = []
+        for i, spec in enumerate(specs):
+            try:
+                added.append(change.put(spec, None))
+            except StreamError as e:
+                raise StreamError(f"streams[{i}]: {e}", e.status)
+        return change.config(), added
+
+    def update(self, specs):
+        """
+        :param specs: list of stream objects with their stream_handle
+        :return: (new configuration, list of the streams updated)
+        """
+        change = _Change(self)
+        updated = []
+        for i, spec in enumerate(specs):
+            try:
+                if not isinstance(spec, dict):
+                    raise StreamError("a stream must be an object")
+                handle = spec.get("stream_handle")
+                if handle not in change.streams:
+                    raise StreamError(f"no stream with handle {handle}", 404)
+                updated.append(change.put(spec, handle))
+            except StreamError as e:
+                raise StreamError(f"streams[{i}]: {e}", e.status)
+        return change.config(), updated
+
+    def remove(self, handles):
+        """
+        :param handles: stream handles
+        :return: (new configuration, list of the streams removed)
+        """
+        change = _Change(self)
+        removed = []
+        for handle in handles:
+            if handle not in change.streams:
+                raise StreamError(f"no stream with handle {handle}", 404)
+            removed.append(change.drop(handle))
+        return change.config(), removed
+
+
+class _Change:
+    """
+    Streams, gates and meters being changed by one operation.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.streams = dict(base.streams)
+        self.gates = dict(base.gates)
+        self.meters = dict(base.meters)
+        self.flows = {(s["dst_mac"].lower(), s["vid"]): handle for handle, s in self.streams.items()}
+        # Streams, gates and meters whose entries are rewritten
+        self.touched = set()
+        self.rewritten_gates = set()
+        self.rewritten_meters = set()
+        self.handles = allocator(self.streams, MAX_STREAM_HANDLE)
+        self.gate_ids = allocator(self.gates, MAX_GATE_ID)
+        self.meter_ids = allocator(self.meters, MAX_FLOW_METER_ID)
+
+    def users(self, field, value, exclude=None):
+        return [h for h, s in self.streams.items() if s[field] == value and h != exclude]
+
+    def put(self, spec, handle):
+        """
+        Adds a stream (handle None) or updates one with the fields of spec.
+        """
+        if not isinstance(spec, dict):
+            raise StreamError("a stream must be an object")
+        unknown = set(spec) - STREAM_FIELDS
+        if unknown:
+            raise StreamError(f"unknown fields {', '.join(sorted(unknown))}")
+        old = self.streams.get(handle)
+        if old is not None:
+            merged = dict(old, **spec)
+            # A new gate or meter definition replaces the ID of the old one
+            if "gate" in spec and "stream_gate_id" not in spec:
+                merged["stream_gate_id"] = None
+            if "meter" in spec and "flow_meter_instance_id" not in spec:
+                merged["flow_meter_instance_id"] = None
+            spec = merged
+
+        mac = spec.get("dst_mac")
+        if not isinstance(mac, str) or not MAC_RE.match(mac):
+            raise StreamError(f"dst_mac must be a MAC address, not {mac!r}")
+        vid = check_int(spec, "vid", 1, MAX_VID)
+        if handle is None:
+            handle = spec.get("stream_handle")
+            if handle is None:
+                handle = next(self.handles, None)
+                if handle is None:
+                    raise StreamError("no stream handle left", 507)
+            else:
+                check_int(spec, "stream_handle", 1, MAX_STREAM_HANDLE)
+                if handle in self.streams:
+                    raise StreamError(f"stream handle {handle} is in use", 409)
+        other = self.flows.get((mac.lower(), vid))
+        if other is not None and other != handle:
+            raise StreamError(f"{mac} VID {vid} is stream {other}", 409)
+        stream = {
+            "stream_handle": handle,
+            "dst_mac": mac,
+            "vid": vid,
+            "pcp": check_int(spec, "pcp", 0, 7, 0),
+            "max_sdu": check_int(spec, "max_sdu", 1, MAX_PACKET_LENGTH, DEFAULT_MAX_SDU),
+            "active": check_flag(spec, "active", True),
+            "block_oversize": check_flag(spec, "block_oversize"),
+            "close_on_invalid_rx": check_flag(spec, "close_on_invalid_rx"),
+            "close_on_octets_exceeded": check_flag(spec, "close_on_octets_exceeded"),
+            "stream_gate_id": self.put_gate(spec, old),
+            "flow_meter_instance_id": self.put_meter(spec, old)
+        }
+        if old is not None:
+            self.flows.pop((old["dst_mac"].lower(), old["vid"]), None)
+        self.flows[(mac.lower(), vid)] = handle
+        self.streams[handle] = stream
+        self.touched.add(handle)
+        if old is not None:
+            self.collect(old, handle)
+        return stream
+
+    def put_gate(self, spec, old):
+        gate_id = spec.get("stream_gate_id")
+        gate = spec.get("gate")
+        if gate is None:
+            if gate_id is None:
+                raise StreamError("stream_gate_id or gate is required")
+            check_int(spec, "stream_gate_id", 1, MAX_GATE_ID)
+            if gate_id not in self.gates:
+                raise StreamError(f"no gate {gate_id}", 404)
+            return gate_id
+        if gate_id is None:
+            # The gate of the stream is rewritten when it is its only user
+            if old is not None and old["stream_gate_id"] is not None and not self.users(
+                    "stream_gate_id", old["stream_gate_id"], old["stream_handle"]):
+                gate_id = old["stream_gate_id"]
+            else:
+                gate_id = next(self.gate_ids, None)
+                if gate_id is None:
+                    raise StreamError("no gate ID left", 507)
+        else:
+            check_int(spec, "stream_gate_id", 1, MAX_GATE_ID)
+            if gate_id in self.gates and (old is None or old["stream_gate_id"] != gate_id
+                                          or self.users("stream_gate_id", gate_id, old["stream_handle"])):
+                raise StreamError(f"gate {gate_id} exists, leave out gate to share it", 409)
+        self.gates[gate_id] = check_gate(gate)
+        self.rewritten_gates.add(gate_id)
+        return gate_id
+
+    def put_meter(self, spec, old):
+        meter_id = spec.get("flow_meter_instance_id")
+        meter = spec.get("meter")
+        if meter is None:
+            if meter_id is None:
+                raise StreamError("flow_meter_instance_id or meter is required")
+            check_int(spec, "flow_meter_instance_id", 1, MAX_FLOW_METER_ID)
+            if meter_id not in self.meters:
+                raise StreamError(f"no flow meter {meter_id}", 404)
+            return meter_id
+        if meter_id is None:
+            if old is not None and old["flow_meter_instance_id"] is not None and not self.users(
+                    "flow_meter_instance_id", old["flow_meter_instance_id"], old["stream_handle"]):
+                meter_id = old["flow_meter_instance_id"]
+            else:
+                meter_id = next(self.meter_ids, None)
+                if meter_id is None:
+                    raise StreamError("no flow meter ID left", 507)
+        else:
+            check_int(spec, "flow_meter_instance_id", 1, MAX_FLOW_METER_ID)
+            if meter_id in self.meters and (old is None or old["flow_meter_instance_id"] != meter_id
+                                            or self.users("flow_meter_instance_id", meter_id, old["stream_handle"])):
+                raise StreamError(f"flow meter {meter_id} exists, leave out meter to share it", 409)
+        self.meters[meter_id] = check_meter(meter)
+        self.rewritten_meters.add(meter_id)
+        return meter_id
+
+    def drop(self, handle):
+        stream = self.streams.pop(handle)
+        self.flows.pop((stream["dst_mac"].lower(), stream["vid"]), None)
+        self.touched.add(handle)
+        self.collect(stream)
+        return stream
+
+    def collect(self, old, handle=None):
+        """
+        Removes the gate and meter of a changed or removed stream when no
+        stream uses them anymore.
+        """
+        gate_id = old["stream_gate_id"]
+        if gate_id in self.gates and not any(s["stream_gate_id"] == gate_id for s in self.streams.values()):
+            del self.gates[gate_id]
+            self.rewritten_gates.add(gate_id)
+        meter_id = old["flow_meter_instance_id"]
+        if meter_id in self.meters and not any(s["flow_meter_instance_id"] == meter_id
+                                               for s in self.streams.values()):
+            del self.meters[meter_id]
+            self.rewritten_meters.add(meter_id)
+
+    def config(self):
+        """
+        Runtime configuration with the changes, checked against the table
+        sizes. The hyperperiod_state entries of new and rewritten gates are
+        table entries like the others, so they are written and rolled back
+        with them.
+        """
+        base = self.base
+
+        def kept(entry):
+            if entry.get("default_action"):
+                return True
+            table = entry["table"]
+            if table in STREAM_TABLES:
+                return entry_handle(entry) not in self.touched
+            if table == GATE_TABLE:
+                return entry["match"][GATE_FIELD] not in self.rewritten_gates
+            if table in METER_TABLES:
+                return entry["match"][METER_FIELD] not in self.rewritten_meters
+            return True
+
+        table_entries = [entry for entry in base.config["table_entries"] if kept(entry)]
+        for meter_id in sorted(self.rewritten_meters & set(self.meters)):
+            table_entries += meter_entries(meter_id, self.meters[meter_id])
+        for gate_id in sorted(self.rewritten_gates & set(self.gates)):
+            table_entries += gate_entries(gate_id, self.gates[gate_id]["intervals"])
+        for handle in sorted(self.touched & set(self.streams)):
+            table_entries += stream_entries(self.streams[handle], base.priorities.get(handle) or MAX_SDU_PRIORITY)
+        hyperperiods = {gate_id: secs for gate_id, secs in base.config["hyperperiods"].items()
+                        if gate_id not in self.rewritten_gates}
+        hyperperiods.update({gate_id: self.gates[gate_id]["hyperperiod"]
+                             for gate_id in self.rewritten_gates if gate_id in self.gates})
+        table_entries = hyperperiod_state_entries(table_entries, hyperperiods)
+
+        counts = {}
+        for entry in table_entries:
+            if not entry.get("default_action"):
+                counts[entry["table"]] = counts.get(entry["table"], 0) + 1
+        for table, count in counts.items():
+            size = base.capacity.get(table)
+            if size is not None and count > size:
+                raise StreamError(f"{table} would hold {count} entries, its size is {size}", 507)
+
+        meters = [meter for meter in base.config["meters"]
+                  if meter["meter"] != FLOW_METER or meter["index"] not in self.rewritten_meters]
+        meters += [dict({"meter": FLOW_METER, "index": meter_id},
+                        **{band: self.meters[meter_id][band] for band in METER_BANDS})
+                   for meter_id in sorted(self.rewritten_meters & set(self.meters))]
+        return dict(base.config, table_entries=table_entries, hyperperiods=hyperperiods, meters=meters)
+
+
+def check_gate(gate):
+    """
+    Validated gate: hyperperiod (seconds) and intervals sorted by start.
+    """
+    if not isinstance(gate, dict):
+        raise StreamError("gate must be an object")
+    hyperperiod = check_int(gate, "hyperperiod", 1, (1 << 48) // 1_000_000)
+    intervals = gate.get("intervals")
+    if not isinstance(intervals, list) or not intervals:
+        raise StreamError("gate intervals must be a non-empty list")
+    bounds = []
+    for interval in intervals:
+        if not isinstance(interval, dict):
+            raise StreamError("a gate interval must be an object")
+        start = check_int(interval, "start_us", 0, hyperperiod * 1_000_000)
+        end = check_int(interval, "end_us", start, hyperperiod * 1_000_000)
+        bounds.append((start, end, interval))
+    result = []
+    for i, (start, end, interval) in enumerate(sorted(bounds, key=lambda b: b[:2])):
+        if result and start < result[-1]["end_us"]:
+            raise StreamError(f"gate interval {start}-{end} us overlaps {result[-1]['start_us']}-"
+                              f"{result[-1]['end_us']} us")
+        result.append({
+            "start_us": start,
+            "end_us": end,
+            "gate_state": check_int(interval, "gate_state", GATE_OPEN, GATE_CLOSED, GATE_OPEN),
+            "ipv": check_int(interval, "ipv", 0, 15, gate.get("ipv", 0)),
+            "interval_identifier": i + 1,
+            "max_octets": check_int(interval, "max_octets", 0, 0xffffffff, 0)
+        })
+    return {"hyperperiod": hyperperiod, "intervals": result}
+
+
+def check_meter(meter):
+    if not isinstance(meter, dict):
+        raise StreamError("meter must be an object")
+    result = {flag: check_flag(meter, flag) for flag, _ in METER_FLAGS}
+    result.update({band: check_int(meter, band, 0, (1 << 63) - 1) for band in METER_BANDS})
+    return result
+
+
+def stream_entries(stream, max_sdu_priority=MAX_SDU_PRIORITY):
+    """
+    stream_id, stream_id_active, stream_filter_instance and max_sdu_filter
+    entries of a stream (s1-runtime.json format).
+    """
+    handle = stream["stream_handle"]
+    return [
+        {
+            "table": STREAM_ID_TABLE,
+            "match": {"hdr.ethernet.dst_addr": stream["dst_mac"], "hdr.eth_802_1q.vid": stream["vid"]},
+            "action_name": STREAM_FILTER + "assign_stream_handle",
+            "action_params": {
+                "stream_handle": handle,
+                "active": int(stream["active"]),
+                "stream_blocked_due_to_oversize_frame_enable": int(stream["block_oversize"])
+            }
+        },
+        {
+            "table": STREAM_FILTER_TABLE,
+            "match": {HANDLE_FIELD: handle},
+            "action_name": STREAM_FILTER + "assign_gate_and_meter",
+            "action_params": {
+                "stream_gate_id": stream["stream_gate_id"],
+                "flow_meter_instance_id": stream["flow_meter_instance_id"],
+                "gate_closed_due_to_invalid_rx_enable": int(stream["close_on_invalid_rx"]),
+                "gate_closed_due_to_octets_exceeded_enable": int(stream["close_on_octets_exceeded"])
+            }
+        },
+        {
+            "table": STREAM_ID_ACTIVE_TABLE,
+            "match": {HANDLE_FIELD: handle},
+            "action_name": STREAM_FILTER + "overwrite_stream_active",
+            "action_params": {"eth_dst_addr": stream["dst_mac"], "vid": stream["vid"], "pcp": stream["pcp"]}
+        },
+        {
+            "table": MAX_SDU_TABLE,
+            "match": {
+                HANDLE_FIELD: handle,
+                "hdr.eth_802_1q.pcp": [stream["pcp"], 7],
+                "std_md.packet_length": [1, stream["max_sdu"]]
+            },
+            "action_name": STREAM_FILTER + "none",
+            "action_params": {},
+            "priority": max_sdu_priority
+        }
+    ]
+
+
+def gate_entries(gate_id, intervals):
+    """
+    stream_gate_instance entries of a gate, as read back by psfp_runtime.gate_schedule.
+    """
+    return [
+        {
+            "table": GATE_TABLE,
+            "match": {GATE_FIELD: gate_id, "meta.ingress_md.diff_ts": [interval["start_us"], interval["end_us"]]},
+            "action_name": STREAM_GATE + "set_gate_and_ipv",
+            "action_params": {
+                "gate_state": interval["gate_state"],
+                "ipv": interval["ipv"],
+                "interval_identifier": interval["interval_identifier"],
+                "max_octects_interval": interval["max_octets"]
+            },
+            "priority": max(GATE_PRIORITY, len(intervals)) - i
+        }
+        for i, interval in enumerate(intervals)
+    ]
+
+
+def meter_entries(meter_id, meter):
+    return [
+        {
+            "table": FLOW_METER_CONFIG_TABLE,
+            "match": {METER_FIELD: meter_id},
+            "action_name": FLOW_METER_CONTROL + "set_flow_meter_config",
+            "action_params": {param: int(meter[flag]) for flag, param in METER_FLAGS}
+        },
+        {
+            "table": FLOW_METER_INSTANCE_TABLE,
+            "match": {METER_FIELD: meter_id},
+            "action_name": FLOW_METER_CONTROL + "set_color_direct",
+            "action_params": {}
+        }
+    ]
+
+
+# ----------------------------------------------------------------------
+# HTTP server
+
+
+class StreamRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes the requests of the API to server.transaction.
+    """
+    server_version = "psfp-streams/1"
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode() + b"\n"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            raise StreamError(f"request body over {MAX_BODY} bytes", 413)
+        try:
+            return json.loads(self.rfile.read(length) or b"null")
+        except ValueError as e:
+            raise StreamError(f"invalid JSON: {e}")
+
+    def route(self):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        if not parts or parts[0] != "streams" or len(parts) > 2:
+            raise StreamError(f"no resource {url.path}", 404)
+        handle = None
+        if len(parts) == 2:
+            try:
+                handle = int(parts[1])
+            except ValueError:
+                raise StreamError(f"invalid stream handle {parts[1]!r}", 404)
+        switch = parse_qs(url.query).get("switch", [None])[0]
+        if switch is None:
+            if len(self.server.switches) > 1:
+                raise StreamError(f"?switch= is required, one of {', '.join(self.server.switches)}")
+            switch = self.server.switches[0]
+        elif switch not in self.server.switches:
+            raise StreamError(f"no switch {switch}", 404)
+        return switch, handle
+
+    def handle_method(self, method):
+        try:
+            switch, handle = self.route()
+            status, body = self.dispatch(method, switch, handle)
+        except StreamError as e:
+            status, body = e.status, {"error": str(e)}
+        except Exception as e:
+            traceback.print_exc()
+            status, body = 500, {"error": f"internal error: {e!r}"}
+        self.reply(status, body)
+
+    def dispatch(self, method, switch, handle):
+        server = self.server
+        if method == "GET":
+            streams = StreamConfig(server.snapshot(switch), server.capacity)
+            return 200, (streams.list() if handle is None else streams.get(handle))
+
+        body = None if method == "DELETE" and handle is not None else self.body()
+        if method == "POST":
+            if handle is not None:
+                raise StreamError("POST to /streams, the handle is allocated or given in the body", 405)
+            specs = body["streams"] if isinstance(body, dict) and "streams" in body else [body]
+            operation, status = "add", 201
+        elif method == "PUT":
+            if handle is not None:
+                if not isinstance(body, dict):
+                    raise StreamError("a stream must be an object")
+                specs = [dict(body, stream_handle=handle)]
+            else:
+                specs = body.get("streams") if isinstance(body, dict) else None
+            operation, status = "update", 200
+        else:
+            specs = [handle] if handle is not None else (body.get("stream_handles") if isinstance(body, dict)
+                                                         else None)
+            operation, status = "remove", 200
+        if not isinstance(specs, list):
+            raise StreamError("expected a list of streams" if method != "DELETE" else "expected stream_handles")
+
+        def apply(config):
+            return getattr(StreamConfig(config, server.capacity), operation)(specs)
+
+        streams, changes, seconds = server.transaction(switch, apply)
+        return status, {"switch": switch, "streams": streams, "updates": changes, "ms": round(seconds * 1000, 3)}
+
+    def do_GET(self):
+        self.handle_method("GET")
+
+    def do_POST(self):
+        self.handle_method("POST")
+
+    def do_PUT(self):
+        self.handle_method("PUT")
+
+    def do_DELETE(self):
+        self.handle_method("DELETE")
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_api(address, switches, snapshot, transaction, capacity=None, verbose=False):
+    """
+    Starts the API in a background thread.
+
+    :param address: "host:port", or the path of a Unix socket
+    :param switches: names of the switches
+    :param snapshot: snapshot(switch) -> runtime configuration of the switch
+    :param transaction: transaction(switch, apply) -> (result, changes, seconds):
+                        runs apply(runtime configuration) -> (new configuration,
+                        result), pushes the new configuration to the switch
+                        and makes it the switch's configuration, atomically;
+                        raises StreamError when the switch cannot be written
+    :param capacity: {table name: size} from the p4info
+    :return: the server (shutdown() stops it)
+    """
+    if "/" in address:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = UnixHTTPServer(address, StreamRequestHandler)
+    else:
+        host, port = address.rsplit(":", 1)
+        server = ThreadingHTTPServer((host, int(port)), StreamRequestHandler)
+    server.switches = list(switches)
+    server.snapshot = snapshot
+    server.transaction = transaction
+    server.capacity = capacity
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, name="stream-api", daemon=True).start()
+    return server
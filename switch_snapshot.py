@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+"""
+Snapshot of the whole state of a switch and warm restore.
+
+The snapshot is taken with one batched wildcard Read: every table entry,
+register (reg_gate_blocked, reg_filter_blocked, reg_meter_blocked,
+octets_per_interval, the hyperperiod registers, ...), counter, meter
+configuration and the direct counters and meters of the tables that have
+them. Restoring writes them back in batched Writes after a switch restart,
+so the blocked states, octet budgets and hyperperiod anchors survive
+instead of being reset by a new run of mycontroller.py:
+
+    ./switch_snapshot.py snapshot s1.snapshot
+    ./switch_snapshot.py restore s1.snapshot --address 127.0.0.1:50051 --device-id 0
+
+Restore installs the pipeline with the cookie of mycontroller.py
+(pipeline_cookie), so a controller started afterwards takes the switch
+over without reprovisioning it (--no-pipeline when it already runs it).
+
+File layout (integers big endian):
+
+    magic "PSFPSNP1" | SHA-256 of the p4info | u64 time taken (µs since
+    the epoch) | u32 entity count | zlib-compressed serialized ReadResponse
+
+The entities are kept as the bytes the switch sent: neither the snapshot
+nor the restore of table entries decodes them, a restore only prefixes
+every entity with its update header. Registers, counters and meters are
+decoded to leave out the zero values and unconfigured meters a freshly
+started switch already has.
+"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+import zlib
+
+# Import P4Runtime lib from parent utils dir
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
+
+import grpc
+import p4runtime_lib.bmv2
+import p4runtime_lib.helper
+from p4runtime_lib.error_utils import printGrpcError
+from p4runtime_lib.switch import ShutdownAllSwitchConnections
+
+from p4.v1 import p4runtime_pb2
+
+from mycontroller import DEFAULT_ELECTION_ID, ControllerConnection, pipeline_cookie
+from runtime_bundle import DEFAULT_CHUNK_UPDATES, WRITE_METHOD, p4info_hash
+from state_verify import ENTITIES_TAG, READ_METHOD, read_varint
+
+MAGIC = b"PSFPSNP1"
+HEADER = struct.Struct(">8s32sQI")
+# Wire tags of the p4.v1.Entity fields (field number << 3 | length-delimited)
+ENTITY_KINDS = {
+    0x12: "table_entry",
+    0x2a: "meter_entry",
+    0x32: "direct_meter_entry",
+    0x3a: "counter_entry",
+    0x42: "direct_counter_entry",
+    0x5a: "register_entry",
+}
+# Write order: direct resources need their table entry
+RESTORE_ORDER = ["table_entry", "direct_counter_entry", "direct_meter_entry", "register_entry",
+                 "counter_entry", "meter_entry"]
+# Wire tags: Update.type, Update.entity, WriteRequest.updates
+UPDATE_TYPE_TAG = 0x08
+UPDATE_ENTITY_TAG = 0x12
+UPDATES_TAG = 0x22
+
+
+def encode_varint(value):
+    data = bytearray()
+    while value >= 0x80:
+        data.append(value & 0x7f | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+def field(tag, data):
+    """
+    Length-delimited protobuf field.
+    """
+    return bytes([tag]) + encode_varint(len(data)) + data
+
+
+def snapshot_request(p4info, device_id):
+    """
+    ReadRequest of every entity of a switch, wildcards only.
+    """
+    request = p4runtime_pb2.ReadRequest()
+    request.device_id = device_id
+    request.entities.add().table_entry.table_id = 0
+    request.entities.add().register_entry.register_id = 0
+    request.entities.add().counter_entry.counter_id = 0
+    request.entities.add().meter_entry.meter_id = 0
+    for counter in p4info.direct_counters:
+        request.entities.add().direct_counter_entry.table_entry.table_id = counter.direct_table_id
+    for meter in p4info.direct_meters:
+        request.entities.add().direct_meter_entry.table_entry.table_id = meter.direct_table_id
+    return request
+
+
+def split_entities(data):
+    """
+    Serialized entities of a serialized ReadResponse.
+
+    :return: generator of (kind, serialized p4.v1.Entity)
+    """
+    pos = 0
+    while pos < len(data):
+        tag, pos = read_varint(data, pos)
+        length, pos = read_varint(data, pos)
+        entity = data[pos:pos + length]
+        pos += length
+        if tag == ENTITIES_TAG and entity:
+            yield ENTITY_KINDS.get(entity[0]), entity
+
+
+def take_snapshot(sw, p4info):
+    """
+    Reads the state of a switch.
+
+    :return: (serialized ReadResponse of all the entities, entity count)
+    """
+    read = sw.channel.unary_stream(READ_METHOD, request_serializer=p4runtime_pb2.ReadRequest.SerializeToString,
+                                   response_deserializer=None)
+    body = bytearray()
+    count = 0
+    for response in read(snapshot_request(p4info, sw.device_id)):
+        for _, entity in split_entities(response):
+            body += field(ENTITIES_TAG, entity)
+            count += 1
+    return bytes(body), count
+
+
+def write_snapshot(path, p4info, body, count, taken_us=None):
+    if taken_us is None:
+        taken_us = int(time.time() * 1_000_000)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, p4info_hash(p4info), taken_us, count))
+        f.write(zlib.compress(body))
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """
+    :return: (p4info hash, time taken in µs, serialized ReadResponse)
+    :raise ValueError: the file is not a snapshot
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path}: truncated snapshot")
+    magic, p4info_digest, taken_us, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path}: not a snapshot")
+    try:
+        body = zlib.decompress(data[HEADER.size:])
+    except zlib.error as e:
+        raise ValueError(f"{path}: corrupted snapshot ({e})")
+    return p4info_digest, taken_us, body
+
+
+def restored(kind, entity):
+    """
+    Whether an entity has to be written back to a freshly started switch.
+    """
+    if kind == "table_entry":
+        return True
+    decoded = getattr(p4runtime_pb2.Entity.FromString(entity), kind)
+    if kind in ("meter_entry", "direct_meter_entry"):
+        return decoded.HasField("config")
+    if kind == "register_entry":
+        return decoded.data.bitstring.strip(b"\0") != b""
+    return decoded.data.packet_count != 0 or decoded.data.byte_count != 0
+
+
+def restore_updates(body):
+    """
+    Serialized updates writing the entities of a snapshot back, in
+    RESTORE_ORDER: table entries are inserted, the rest modified.
+
+    :return: {kind: [serialized p4.v1.Update]}
+    """
+    updates = {kind: [] for kind in RESTORE_ORDER}
+    for kind, entity in split_entities(body):
+        if kind not in updates or not restored(kind, entity):
+            continue
+        update_type = p4runtime_pb2.Update.INSERT if kind == "table_entry" else p4runtime_pb2.Update.MODIFY
+        updates[kind].append(bytes([UPDATE_TYPE_TAG, update_type]) + field(UPDATE_ENTITY_TAG, entity))
+    return updates
+
+
+def write_updates(sw, updates, chunk_updates=DEFAULT_CHUNK_UPDATES):
+    """
+    Writes serialized updates in batched WriteRequests, as the primary.
+
+    :raise grpc.RpcError: a Write failed
+    """
+    prefix = p4runtime_pb2.WriteRequest()
+    prefix.device_id = sw.device_id
+    prefix.election_id.low = sw.election_id
+    prefix = prefix.SerializeToString()
+    write = sw.channel.unary_unary(WRITE_METHOD, request_serializer=None,
+                                   response_deserializer=p4runtime_pb2.WriteResponse.FromString)
+    for start in range(0, len(updates), chunk_updates):
+        write(prefix + b"".join(field(UPDATES_TAG, update) for update in updates[start:start + chunk_updates]))
+
+
+def snapshot(args, p4info_helper):
+    sw = p4runtime_lib.bmv2.Bmv2SwitchConnection(name="switch", address=args.address, device_id=args.device_id)
+    start = time.perf_counter()
+    body, count = take_snapshot(sw, p4info_helper.p4info)
+    write_snapshot(args.file, p4info_helper.p4info, body, count)
+    counts = {}
+    for kind, _ in split_entities(body):
+        counts[kind] = counts.get(kind, 0) + 1
+    print(f"{count} entities of {args.address} in {(time.perf_counter() - start) * 1000:.1f} ms: "
+          f"{args.file} ({os.path.getsize(args.file)} bytes)")
+    for kind, kind_count in sorted(counts.items(), key=lambda item: str(item[0])):
+        print(f"  {kind}: {kind_count}")
+
+
+def restore(args, p4info_helper):
+    p4info_digest, taken_us, body = read_snapshot(args.file)
+    if p4info_digest != p4info_hash(p4info_helper.p4info):
+        raise ValueError(f"{args.file} was taken with another p4info than {args.p4info}")
+    sw = ControllerConnection(election_id=args.election_id, name="switch", address=args.address,
+                              device_id=args.device_id)
+    sw.MasterArbitrationUpdate()
+    if not sw.primary.is_set():
+        raise ValueError(f"not primary for {args.address} with election ID {args.election_id}")
+    start = time.perf_counter()
+    if not args.no_pipeline:
+        sw.SetForwardingPipelineConfig(p4info=p4info_helper.p4info, bmv2_json_file_path=args.bmv2_json,
+                                       cookie=pipeline_cookie(p4info_helper, args.bmv2_json))
+    updates = restore_updates(body)
+    for kind in RESTORE_ORDER:
+        write_updates(sw, updates[kind], args.chunk_updates)
+    age = time.time() - taken_us / 1_000_000
+    print(f"Restored {sum(len(u) for u in updates.values())} entities on {args.address} in "
+          f"{(time.perf_counter() - start) * 1000:.1f} ms (snapshot taken {age:.1f} s ago)")
+    for kind in RESTORE_ORDER:
+        if updates[kind]:
+            print(f"  {kind}: {len(updates[kind])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot the state of a switch or restore it')
+    parser.add_argument('command', choices=['snapshot', 'restore'])
+    parser.add_argument('file', help='Snapshot file')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False, default='./build/sdn-psfp.p4.p4info.txtpb')
+    parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c, installed before restoring',
+                        type=str, action="store", required=False, default='./build/sdn-psfp.json')
+    parser.add_argument('--address', help='P4Runtime address of the switch',
+                        type=str, action="store", required=False, default='127.0.0.1:50051')
+    parser.add_argument('--device-id', help='Device ID of the switch',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--election-id', help='Election ID used to restore (must be the highest connected)',
+                        type=int, action="store", required=False, default=DEFAULT_ELECTION_ID)
+    parser.add_argument('--no-pipeline', help='Restore on a switch already running the pipeline',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('--chunk-updates', help='Updates per WriteRequest',
+                        type=int, action="store", required=False, default=DEFAULT_CHUNK_UPDATES)
+    args = parser.parse_args()
+
+    p4info_helper = p4runtime_lib.helper.P4InfoHelper(args.p4info)
+    try:
+        if args.command == "snapshot":
+            snapshot(args, p4info_helper)
+        else:
+            restore(args, p4info_helper)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    except grpc.RpcError as e:
+        printGrpcError(e)
+        sys.exit(1)
+    finally:
+        ShutdownAllSwitchConnections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Declarative traffic profiles for the packet generators.
+
+A profile is a JSON (or YAML, with PyYAML installed) file describing flows:
+
+{
+  "defaults": {"dst_ip": "10.0.2.2", "dst_mac": "08:00:00:00:02:22", "duration": 10},
+  "flows": [
+    {"name": "voice", "class": "audio", "vid": 1,
+     "size": {"dist": "normal", "mean": 200, "stddev": 20},
+     "interarrival": {"dist": "constant", "rate": 2000}},
+    {"name": "video", "vid": 2, "pcp": 4, "dscp": 34, "protocol": "udp",
+     "size": {"dist": "uniform", "min": 600, "max": 1400},
+     "interarrival": {"dist": "exponential", "rate": 800},
+     "burst": {"size": 8, "gap_us": 20}, "start": 1.0, "duration": 5}
+  ]
+}
+
+Flow keys:
+  class         gen_pkts.py flow class to inherit from (1-5 or its name)
+  vid, pcp, dscp, ecn, protocol ("udp"/"tcp"), ttl, dport
+  dst_ip, dst_mac, src_ip, src_mac (src_* default to the sending interface)
+  size          frame size distribution in bytes:
+                  {"dist": "fixed", "value": N}
+                  {"dist": "uniform", "min": A, "max": B}
+                  {"dist": "normal", "mean": M, "stddev": S}
+                  {"dist": "choice", "values": [..], "weights": [..]}
+  interarrival  time between bursts, "rate" being the average frame rate:
+                  {"dist": "constant", "rate": R}
+                  {"dist": "exponential", "rate": R}           (Poisson)
+                  {"dist": "uniform", "min_us": A, "max_us": B}
+  burst         {"size": N, "gap_us": G}: N frames G µs apart per arrival
+  start, duration (s), count (frames), seed, worker, cpu (gen_load.py)
+
+Send times and frame sizes are drawn up front as NumPy arrays
+(precompute / merge), so send loops only index precomputed values.
+"""
+
+import json
+import math
+
+import numpy as np
+
+from pkt_templates import DPORT, FLOW_NAMES, FLOWS, MAX_FRAME, header_len
+
+PROTOCOLS = {"udp": 17, "tcp": 6, 17: 17, 6: 6}
+
+DEFAULT_FLOW = {
+    "vid": 0, "pcp": 0, "dscp": 0, "ecn": 0, "protocol": 17, "ttl": 64, "dport": DPORT,
+    "dst_ip": "10.0.2.2", "dst_mac": "08:00:00:00:02:22", "src_ip": None, "src_mac": None,
+    "size": {"dist": "fixed", "value": 542}, "interarrival": {"dist": "constant", "rate": 1000},
+    "burst": None, "start": 0.0, "duration": 10.0, "count": 0, "seed": 1, "worker": None, "cpu": None
+}
+
+CLASS_KEYS = ("vid", "pcp", "dscp", "ecn", "protocol", "ttl")
+
+
+def flow_class(name):
+    """
+    Returns the FLOWS profile for a class given as "1".."5" or by name.
+    """
+    key = str(name)
+    if key not in FLOWS:
+        key = next((k for k, v in FLOW_NAMES.items() if v == key), None)
+    if key is None:
+        raise ValueError(f"Unknown flow class: {name}")
+    return FLOWS[key]
+
+
+def load_profile(path):
+    """
+    Loads and normalizes a traffic profile.
+
+    :param path: JSON or YAML (.yaml/.yml) profile file
+    :return: list of flow dicts with every key of DEFAULT_FLOW, plus name
+    """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"{path}: PyYAML is needed for YAML profiles")
+            profile = yaml.safe_load(f)
+        else:
+            profile = json.load(f)
+
+    defaults = profile.get("defaults", {})
+    flows = []
+    for index, spec in enumerate(profile.get("flows", [])):
+        flow = dict(DEFAULT_FLOW)
+        merged = dict(defaults, **spec)
+        if "class" in merged:
+            flow.update({k: flow_class(merged["class"])[k] for k in CLASS_KEYS})
+        flow.update({k: v for k, v in merged.items() if k in DEFAULT_FLOW})
+        flow["name"] = merged.get("name", f"flow{index}")
+        if flow["protocol"] not in PROTOCOLS:
+            raise ValueError(f"{flow['name']}: unknown protocol {flow['protocol']}")
+        flow["protocol"] = PROTOCOLS[flow["protocol"]]
+        if not flow["duration"] and not flow["count"]:
+            raise ValueError(f"{flow['name']}: needs a duration or a count")
+        check_interarrival(flow["name"], flow["interarrival"])
+        if flow["seed"] == DEFAULT_FLOW["seed"]:
+            flow["seed"] += index
+        flows.append(flow)
+    if not flows:
+        raise ValueError(f"{path}: no flows")
+    return flows
+
+
+def check_interarrival(name, spec):
+    """
+    :raise ValueError: the inter-arrival distribution of a flow is unknown,
+                       or its gaps are not positive (a zero gap never
+                       advances the send times of precompute)
+    """
+    dist = spec.get("dist", "constant")
+    if dist == "uniform":
+        bounds = [spec.get(key) for key in ("min_us", "max_us")]
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in bounds):
+            raise ValueError(f"{name}: uniform inter-arrival needs numeric min_us and max_us")
+        if bounds[1] <= 0:
+            raise ValueError(f"{name}: uniform inter-arrival needs max_us > 0, got {bounds[1]}")
+        if not 0 <= bounds[0] <= bounds[1]:
+            raise ValueError(f"{name}: uniform inter-arrival needs 0 <= min_us <= max_us")
+    elif dist in ("constant", "exponential"):
+        rate = spec.get("rate")
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)) or not rate > 0:
+            raise ValueError(f"{name}: {dist} inter-arrival needs a rate > 0, got {rate!r}")
+    else:
+        raise ValueError(f"{name}: unknown inter-arrival distribution {dist!r}")
+
+
+def draw_sizes(rng, spec, count, minimum):
+    """
+    Draws frame sizes, clamped to [minimum, MAX_FRAME].
+    """
+    dist = spec.get("dist", "fixed")
+    if dist == "fixed":
+        sizes = np.full(count, spec["value"])
+    elif dist == "uniform":
+        sizes = rng.integers(spec["min"], spec["max"] + 1, count)
+    elif dist == "normal":
+        sizes = np.rint(rng.normal(spec["mean"], spec["stddev"], count))
+    elif dist == "choice":
+        weights = spec.get("weights")
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float) / sum(weights)
+        sizes = rng.choice(spec["values"], count, p=weights)
+    else:
+        raise ValueError(f"Unknown size distribution: {dist}")
+    return np.clip(sizes, minimum, MAX_FRAME).astype(np.int32)
+
+
+def draw_gaps(rng, spec, count, burst_size):
+    """
+    Draws the times between arrivals (bursts) in nanoseconds.
+    """
+    dist = spec.get("dist", "constant")
+    if dist == "uniform":
+        return rng.uniform(spec["min_us"] * 1e3, spec["max_us"] * 1e3, count)
+    mean_ns = 1e9 * burst_size / spec["rate"]
+    if dist == "constant":
+        return np.full(count, mean_ns)
+    if dist == "exponential":
+        return rng.exponential(mean_ns, count)
+    raise ValueError(f"Unknown inter-arrival distribution: {dist}")
+
+
+def mean_gap_ns(spec, burst_size):
+    if spec.get("dist", "constant") == "uniform":
+        return (spec["min_us"] + spec["max_us"]) * 500.0
+    return 1e9 * burst_size / spec["rate"]
+
+
+def precompute(flow):
+    """
+    Precomputes the send times and frame sizes of a flow.
+
+    :param flow: a flow from load_profile
+    :return: (send times in ns from the profile start as int64, frame sizes
+             as int32), sorted by time
+    """
+    rng = np.random.default_rng(flow["seed"])
+    burst = flow["burst"] or {"size": 1, "gap_us": 0}
+    burst_size = max(1, int(burst["size"]))
+    offsets = np.arange(burst_size) * burst.get("gap_us", 0) * 1e3
+    start_ns = flow["start"] * 1e9
+    end_ns = start_ns + flow["duration"] * 1e9 if flow["duration"] else math.inf
+
+    if flow["count"]:
+        arrivals = -(-flow["count"] // burst_size)
+    else:
+        arrivals = int(flow["duration"] * 1e9 / mean_gap_ns(flow["interarrival"], burst_size) * 1.1) + 16
+
+    # First arrival at the start, the following ones after a drawn gap
+    chunks = []
+    last = start_ns
+    total = 0
+    while True:
+        gaps = draw_gaps(rng, flow["interarrival"], arrivals, burst_size)
+        gaps[0] = 0.0 if not chunks else gaps[0]
+        times = last + np.cumsum(gaps)
+        chunks.append(times)
+        total += len(times)
+        last = times[-1]
+        if (flow["count"] and total * burst_size >= flow["count"]) or last >= end_ns:
+            break
+        arrivals = max(16, arrivals // 4)
+    burst_times = np.concatenate(chunks)
+
+    times = (burst_times[:, None] + offsets[None, :]).ravel()
+    times = times[times < end_ns]
+    if flow["count"]:
+        times = times[:flow["count"]]
+    times = np.sort(times).astype(np.int64)
+    sizes = draw_sizes(rng, flow["size"], len(times), header_len(flow))
+    return times, sizes
+
+
+def merge(flows):
+    """
+    Precomputes and merges several flows into one timeline.
+
+    :param flows: flows from load_profile
+    :return: (send times in ns as int64, flow index as int32, frame sizes as
+             int32), sorted by time
+    """
+    arrays = [precompute(flow) for flow in flows]
+    times = np.concatenate([t for t, _ in arrays])
+    index = np.concatenate([np.full(len(t), i, dtype=np.int32) for i, (t, _) in enumerate(arrays)])
+    sizes = np.concatenate([s for _, s in arrays])
+    order = np.argsort(times, kind="stable")
+    return times[order], index[order], sizes[order]